@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Compare the archive codecs of website_manager.py on a synthetic WordPress tree.
+A web file tree with PHP, JavaScript and CSS files, media uploads and an
+SQL dump is generated in a temporary directory. Then the tree is archived
+with each selected codec and throughput and compression ratio are reported.
+With --store, gzip and zstd are also run with a member index (+index) and
+with a member index and storecompressed = true (+store), which stores the
+media files without compressing them again.
+"""
+import argparse, os, random, shutil, tempfile, time
+from wm.archive import CODEC_SUFFIXES, ArchiveWriter, zstandard
+from wm.memberindex import INDEXED_CODECS
+__version__ = "1.1.0"
+
+WORDS = ['function', 'return', 'array', 'echo', 'if', 'else', 'foreach', 'as',
+         '$post', '$wpdb', '$query', '$args', 'get_option', 'apply_filters',
+         'esc_html', 'wp_enqueue_script', 'null', 'true', 'false', '=>', '(', ')',
+         '{', '}', ';', '$this->', 'public', 'static', 'class', 'new', "'title'",
+         "'post_type'", 'isset', 'empty', '__(', "'textdomain'", '$i++', '// TODO']
+
+def text_file(rnd: random.Random, size: int) -> bytes:
+    lines: list[str] = ['<?php']
+    length = 5
+    while length < size:
+        indent = '    ' * rnd.randint(0, 3)
+        line = indent + ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 12)))
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines).encode()
+
+def sql_dump(rnd: random.Random, size: int) -> bytes:
+    rows: list[str] = []
+    length = 0
+    i = 0
+    while length < size:
+        i += 1
+        row = (f"({i},{rnd.randint(1, 9999)},'_meta_{rnd.choice(WORDS)}',"
+               f"'{' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 20)))}')")
+        rows.append(row)
+        length += len(row) + 1
+    return ('INSERT INTO `wp_postmeta` VALUES ' + ',\n'.join(rows) + ';\n').encode()
+
+def make_tree(root: str, totalBytes: int, mediaShare: float, seed: int = 42) -> int:
+    """Create a synthetic WordPress tree below root. Returns the number of files."""
+    rnd = random.Random(seed)
+    mediaBytes = int(totalBytes * mediaShare)
+    sqlBytes = totalBytes // 10
+    codeBytes = totalBytes - mediaBytes - sqlBytes
+    numFiles = 0
+    written = 0
+    dirs = ['wp-admin', 'wp-includes', 'wp-content/plugins/seo/inc',
+            'wp-content/plugins/shop/src', 'wp-content/themes/twenty/assets']
+    while written < codeBytes:
+        d = os.path.join(root, 'www', rnd.choice(dirs))
+        os.makedirs(d, exist_ok=True)
+        size = int(rnd.lognormvariate(9, 1))
+        ext = rnd.choice(['.php', '.php', '.php', '.js', '.css'])
+        with open(os.path.join(d, f'file{numFiles}{ext}'), 'wb') as f:
+            f.write(text_file(rnd, size))
+        written += size
+        numFiles += 1
+    written = 0
+    uploads = os.path.join(root, 'www', 'wp-content', 'uploads', '2024', '05')
+    os.makedirs(uploads, exist_ok=True)
+    while written < mediaBytes:
+        size = int(rnd.lognormvariate(12, 1))
+        ext = rnd.choice(['.jpg', '.png', '.webp'])
+        with open(os.path.join(uploads, f'image{numFiles}{ext}'), 'wb') as f:
+            f.write(rnd.randbytes(size))
+        written += size
+        numFiles += 1
+    os.makedirs(os.path.join(root, 'database'))
+    with open(os.path.join(root, 'database', 'site.sql'), 'wb') as f:
+        f.write(sql_dump(rnd, sqlBytes))
+    return numFiles + 1
+
+def tree_size(root: str) -> int:
+    size = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return size
+
+def run(root: str, outDir: str, codec: str, level: int, threads: int,
+        indexed: bool = False, store: bool = False) -> tuple[float, float, int]:
+    """Archive the tree and return wall time, CPU time and archive size."""
+    path = os.path.join(outDir, 'bench' + CODEC_SUFFIXES[codec])
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    with ArchiveWriter(path, codec, level, threads, indexed=indexed,
+                       storeCompressed=store) as archive:
+        archive.tar.add(os.path.join(root, 'www'), arcname='www')
+        archive.tar.add(os.path.join(root, 'database'), arcname='database')
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    size = os.path.getsize(path)
+    os.remove(path)
+    return wall, cpu, size
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('-s', '--size', type=int, default=200,
+                   help='size of the synthetic tree in MB (default 200)')
+    p.add_argument('-m', '--media', type=float, default=0.5,
+                   help='share of incompressible media files (default 0.5)')
+    p.add_argument('-l', '--level', type=int, default=0,
+                   help='compression level, default: 5 for gzip, 3 for zstd, 6 for xz')
+    p.add_argument('-t', '--threads', type=int, default=os.cpu_count() or 1,
+                   help='threads for pgzip and zstd (default: number of cores)')
+    p.add_argument('-c', '--codecs', type=str, default=','.join(CODEC_SUFFIXES),
+                   help='comma separated list of codecs')
+    p.add_argument('--store', action='store_true',
+                   help='also run gzip and zstd with member index and storecompressed')
+    p.add_argument('-d', '--dir', type=str, default=None,
+                   help='directory for the temporary files')
+    p.add_argument("-v", "--version", action='version',
+                   version='%(prog)s version {version}'.format(version=__version__))
+    args = p.parse_args()
+
+    defaultLevels = {'gzip': 5, 'pgzip': 5, 'zstd': 3, 'xz': 6, 'none': 0}
+    codecs = args.codecs.split(',')
+    tempDir: str | None = args.dir
+    root = tempfile.mkdtemp(dir=tempDir)
+    try:
+        print('Creating synthetic WordPress tree in', root, '...')
+        numFiles = make_tree(root, args.size * 1000000, args.media)
+        inBytes = tree_size(root)
+        print(f'{numFiles} files, {inBytes / 1e6:.1f} MB,',
+              f'{args.media:.0%} media, {args.threads} threads')
+        print(f"{'codec':12}{'level':>6}{'wall s':>9}{'cpu s':>9}{'MB/s':>9}{'ratio':>8}")
+        for codec in codecs:
+            if codec not in CODEC_SUFFIXES:
+                print(f'{codec:12} unknown codec')
+                continue
+            if codec == 'zstd' and zstandard is None:
+                print(f'{codec:12} skipped, Python package zstandard missing')
+                continue
+            level = args.level if args.level > 0 else defaultLevels[codec]
+            variants = [('', False, False)]
+            if args.store and codec in INDEXED_CODECS:
+                variants += [('+index', True, False), ('+store', True, True)]
+            for name, indexed, store in variants:
+                wall, cpu, size = run(root, root, codec, level, args.threads, indexed, store)
+                print(f'{codec + name:12}{level:6}{wall:9.2f}{cpu:9.2f}'
+                      f'{inBytes / 1e6 / wall:9.1f}{inBytes / size:8.2f}')
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -16,9 +16,10 @@ import argparse, paramiko, getpass, os, tempfile, shutil
 from wm.websites import WebSiteTable
 from wm.config import Parameters
 from wm.timeutils import get_date_tag
+from wm.archive import ARCHIVE_SUFFIXES
 import wm.utils as u
 import subprocess
-__version__ = "1.0.1"
+__version__ = "1.1.0"
 
 def get_names(siteName : str):
     """
@@ -48,7 +49,13 @@ def get_names(siteName : str):
     return wwwroot, site.wwwSubdir, local_snapshot_dir, www_user_group
 
 def download(hostname: str, port: int, username: str, 
-             remote_archive_path: str, local_archive_path: str):
+             remote_archive_base: str, local_archive_base: str) -> str:
+    """
+    Download the archive remote_archive_base + suffix where the suffix
+    depends on the codec of the archive. The local archive gets the same 
+    suffix. Returns the path of the local archive or 'none'.
+    """
+    local_archive_path = 'none'
     # Passwort sicher abfragen
     password = getpass.getpass("Passwort eingeben: ")
     try:
@@ -60,17 +67,22 @@ def download(hostname: str, port: int, username: str,
         # SFTP-Client erstellen
         sftp = ssh.open_sftp()
 
-        # Prüfen, ob Datei existiert
-        try:
-            sftp.stat(remote_archive_path)
+        # Prüfen, ob Datei mit einer der Archiv-Endungen existiert
+        for suffix in ARCHIVE_SUFFIXES:
+            remote_archive_path = remote_archive_base + suffix
+            try:
+                sftp.stat(remote_archive_path)
+            except FileNotFoundError:
+                continue
             print(f"Datei '{remote_archive_path}' gefunden. Wird heruntergeladen...")
 
             # Datei herunterladen
+            local_archive_path = local_archive_base + suffix
             sftp.get(remote_archive_path, local_archive_path)
             print(f"Datei wurde erfolgreich heruntergeladen nach: {local_archive_path}")
-
-        except FileNotFoundError:
-            print(f"Datei '{remote_archive_path}' wurde nicht gefunden.")
+            break
+        else:
+            print(f"Datei '{remote_archive_base}.tar*' wurde nicht gefunden.")
 
         # Verbindung schließen
         sftp.close()
@@ -79,6 +91,7 @@ def download(hostname: str, port: int, username: str,
 
     except Exception as e:
         print(f"Fehler: {e}")
+    return local_archive_path
 
 # =====================================================================
 p = argparse.ArgumentParser(description=__doc__,
@@ -117,11 +130,12 @@ tag = args.timestamp
 # if no tag given, use current date tag
 if not tag:
     tag = get_date_tag()
-remote_archive_filename = remote_site_name + '.' + tag + '.tar.gz'
+# the archive suffix depends on the codec and is detected on download
+remote_archive_filename = remote_site_name + '.' + tag
 remote_archive_path = f"{remote_dir}/{remote_archive_filename}"
 
 local_site_name = args.localSiteName
-local_archive_site_name = local_site_name + '.' + tag + '.tar.gz'
+local_archive_site_name = local_site_name + '.' + tag
 wwwroot, wwwsubdir, local_snapshot_dir, www_user_group = get_names(local_site_name)
 local_archive_path = os.path.join(local_snapshot_dir, local_archive_site_name)
 
@@ -154,7 +168,9 @@ print('user:group for webfiles:', www_user_group)
 u.print_line()
 u.is_file_or_abort(config_path)
 
-download(hostname, port, username, remote_archive_path, local_archive_path)
+local_archive_path = download(hostname, port, username, remote_archive_path, local_archive_path)
+if local_archive_path == 'none':
+    u.abort('no archive downloaded')
 
 if args.config:
     print('save', args.config, 'to temp directory')
@@ -0,0 +1,28 @@
+import os, pathlib, sys
+from collections.abc import Callable
+import pytest
+
+# The tests import the package wm of the website manager.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wm.config import Parameters
+
+@pytest.fixture
+def make_params(tmp_path: pathlib.Path) -> Callable[..., Parameters]:
+    """
+    Parameters of a config file with the required parameters, replaced or
+    extended by the keyword arguments. The directories are below tmp_path.
+    """
+    def make(**options: str) -> Parameters:
+        config = {'runasroot': 'false', 'scp': 'scp', 'sql': 'mysql', 'sqldump': 'mysqldump',
+                  'sqldumpoptions': 'none', 'sqlmainuser': 'root', 'sqlmainpw': 'none',
+                  'wwwusergroup': 'none', 'wwwbanothers': 'false', 'remotelocation': 'none'}
+        for key, dir in (('sitedumpdir', 'dumps'), ('snapshotdir', 'snaps'),
+                         ('logdir', 'logs'), ('wwwroot', 'www')):
+            (tmp_path / dir).mkdir(exist_ok=True)
+            config[key] = str(tmp_path / dir)
+        config.update(options)
+        ini = tmp_path / 'config.ini'
+        ini.write_text('[wm_config]\n' + ''.join(k + ' = ' + v + '\n' for k, v in config.items()))
+        return Parameters(str(ini))
+    return make
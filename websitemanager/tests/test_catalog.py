@@ -0,0 +1,29 @@
+import hashlib, io, pathlib, tarfile
+import pytest
+import wm.catalog as cat
+from wm.archive import ArchiveWriter
+
+def test_find_member_of_xz_archive(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    # xz archives have no member index
+    data = b'<?php echo "hello";'
+    backupDir = tmp_path / 'dumps'
+    backupDir.mkdir()
+    with ArchiveWriter(str(backupDir / 'site1.d20261018.tar.xz'), 'xz', 0) as archive:
+        info = tarfile.TarInfo('www/blog/index.php')
+        info.size = len(data)
+        info.mtime = 1_000_000
+        archive.tar.addfile(info, io.BytesIO(data))
+    catalog = cat.Catalog(str(tmp_path / 'logs'))
+
+    catalog.scan_dir('local', str(backupDir))
+
+    members = catalog.members(['www/*/index.php'])
+    assert [(m.name, m.path, m.type, m.size, m.mtime, m.sha256) for m in members] == [
+        ('site1.d20261018.tar.xz', 'www/blog/index.php', 'f', len(data), 1_000_000,
+         hashlib.sha256(data).hexdigest())]
+    # read only once, like an indexed archive
+    def read_again(path: str) -> list[tuple[str, str, int, int, str]]:
+        pytest.fail('read again: ' + path)
+    monkeypatch.setattr(cat, 'scan_members', read_again)
+    catalog.scan_dir('local', str(backupDir))
+    assert len(catalog.members(['www/blog/index.php'])) == 1
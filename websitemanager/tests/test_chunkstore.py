@@ -0,0 +1,50 @@
+import os, pathlib, time
+import wm.chunkstore as cs
+
+OLD = time.time() - 2 * cs.PRUNE_GRACE
+
+def age_chunks(store: cs.ChunkStore):
+    for dirpath, _, filenames in os.walk(store.dir + '/chunks'):
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), (OLD, OLD))
+
+def test_reused_chunks_survive_concurrent_prune(tmp_path: pathlib.Path):
+    # The chunks of an old snapshot whose index was deleted by the
+    # retention are reused by a snapshot which has not written its index yet.
+    backupDir = str(tmp_path)
+    store = cs.ChunkStore(cs.store_dir(backupDir))
+    www = tmp_path / 'www'
+    www.mkdir()
+    (www / 'index.php').write_bytes(os.urandom(1000))
+    (www / 'style.css').write_bytes(os.urandom(1000))
+    previous = cs.SnapshotIndex('site1', 'd20261017', '2026-10-17T01:00:00',
+                                cs.store_tree(store, str(www), None))
+    age_chunks(store)
+
+    # index.php is unchanged and taken from the previous index,
+    # the content of style.css is stored again
+    os.utime(www / 'style.css', (OLD, OLD))
+    entries = cs.store_tree(store, str(www), previous)
+    cs.prune(backupDir)
+
+    current = cs.SnapshotIndex('site1', 'd20261018', '2026-10-18T01:00:00', entries)
+    for hash in current.hashes():
+        assert os.path.isfile(store.chunk_path(hash))
+    assert store.reusedChunks == 2
+
+def test_pruned_chunk_of_unchanged_file_is_stored_again(tmp_path: pathlib.Path):
+    backupDir = str(tmp_path)
+    store = cs.ChunkStore(cs.store_dir(backupDir))
+    www = tmp_path / 'www'
+    www.mkdir()
+    (www / 'index.php').write_bytes(os.urandom(1000))
+    previous = cs.SnapshotIndex('site1', 'd20261017', '2026-10-17T01:00:00',
+                                cs.store_tree(store, str(www), None))
+    age_chunks(store)
+    cs.prune(backupDir)
+
+    entries = cs.store_tree(store, str(www), previous)
+
+    current = cs.SnapshotIndex('site1', 'd20261018', '2026-10-18T01:00:00', entries)
+    for hash in current.hashes():
+        assert os.path.isfile(store.chunk_path(hash))
@@ -0,0 +1,26 @@
+from collections.abc import Callable
+from wm.config import Parameters
+from wm.exclusions import get_exclusions
+from wm.websites import WebSiteData
+
+def wordpress(exclude: str = 'none') -> WebSiteData:
+    return WebSiteData('site1', '1', 'site1', comment='Wordpress blog', exclude=exclude)
+
+def test_profiles_are_off_by_default(make_params: Callable[..., Parameters]):
+    exclusions = get_exclusions(make_params(), wordpress())
+    assert (exclusions.paths, exclusions.tables) == ([], [])
+    assert not exclusions.skips('wp-content/cache/page.html', False)
+
+def test_profiles_are_enabled_by_cmsexclusions(make_params: Callable[..., Parameters]):
+    exclusions = get_exclusions(make_params(cmsexclusions='true'), wordpress())
+    assert exclusions.profile == 'wordpress'
+    assert exclusions.skips('wp-content/cache/page.html', False)
+    assert get_exclusions(make_params(cmsexclusions='true'), wordpress('off')).paths == []
+
+def test_profile_is_enabled_per_site(make_params: Callable[..., Parameters]):
+    params = make_params()
+    exclusions = get_exclusions(params, wordpress('profile,!wp-content/upgrade,logs'))
+    assert exclusions.profile == 'wordpress'
+    assert exclusions.paths == ['wp-content/cache', 'logs']
+    # patterns only, without the profile
+    assert get_exclusions(params, wordpress('logs')).paths == ['logs']
@@ -0,0 +1,24 @@
+import os
+from collections.abc import Callable
+import pytest
+import wm.planner as planner
+from wm.config import Parameters
+from wm.websites import WebSiteData
+
+def test_unreachable_database_is_planned_by_files(make_params: Callable[..., Parameters],
+                                                  capsys: pytest.CaptureFixture[str]):
+    # the SQL client fails like for a database which is down
+    params = make_params(sql='false')
+    site = WebSiteData('site1', '1', 'site1', 'default', 'localhost', 'db1', 'user1', 'secret')
+    os.makedirs(params.get('wwwroot') + '/site1')
+    with open(params.get('wwwroot') + '/site1/index.php', 'wb') as f:
+        f.write(bytes(1000))
+
+    plan = planner.plan_backups(params, [site], 1)
+
+    e = plan.estimates[0]
+    assert (e.source, e.dumpBytes) == ('scan', 0)
+    assert e.archiveBytes == int(1000 / planner.DEFAULT_RATIO)
+    assert 'Warning: size of database db1 unknown' in capsys.readouterr().out
+    # the credentials are not left behind
+    assert os.listdir(params.get('snapshotdir')) == []
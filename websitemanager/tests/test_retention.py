@@ -0,0 +1,65 @@
+import io, os, tarfile
+from collections.abc import Callable
+import wm.incremental as inc
+import wm.retention as ret
+from wm.archive import ArchiveReader, ArchiveWriter
+from wm.config import Parameters
+
+def write_archive(backupDir: str, tag: str, manifest: inc.Manifest, mtime: float) -> str:
+    """Archive of site1 with a single file holding the id of the manifest."""
+    path = backupDir + '/site1.' + tag + '.tar.gz'
+    with ArchiveWriter(path, 'gzip', 1) as archive:
+        data = manifest.id.encode()
+        info = tarfile.TarInfo('www/id.txt')
+        info.size = len(data)
+        archive.tar.addfile(info, io.BytesIO(data))
+    manifest.write(inc.manifest_path(path))
+    os.utime(path, (mtime, mtime))
+    return path
+
+def read_id(path: str) -> str:
+    with ArchiveReader(path) as archive:
+        f = archive.tar.extractfile('www/id.txt')
+        assert f is not None
+        return f.read().decode()
+
+def test_same_day_keeps_newest_backup(make_params: Callable[..., Parameters]):
+    # The first saveall of the day was promoted to y20261018, the second
+    # one holds the newer state of the site.
+    params = make_params(compression='gzip', incremental='true', retention='gfs')
+    backupDir = params.get('sitedumpdir')
+    write_archive(backupDir, 'y20261018',
+                  inc.Manifest('full-1', 'site1', '2026-10-18T01:00:00', 'full'), 1_000_000)
+    write_archive(backupDir, 'd20261018',
+                  inc.Manifest('full-2', 'site1', '2026-10-18T02:00:00', 'full'), 2_000_000)
+
+    ret.apply_retention(params, ['site1'])
+
+    assert not [name for name in os.listdir(backupDir) if '.d20261018.' in name]
+    assert read_id(backupDir + '/site1.y20261018.tar.gz') == 'full-2'
+
+def test_same_day_incremental_keeps_promoted_base(make_params: Callable[..., Parameters]):
+    # The first saveall of the day promoted its full archive to y20261018,
+    # the second one wrote an incremental archive on top of it.
+    params = make_params(compression='gzip', incremental='true', retention='gfs')
+    backupDir = params.get('sitedumpdir')
+    full = write_archive(backupDir, 'y20261018',
+                         inc.Manifest('full-1', 'site1', '2026-10-18T01:00:00', 'full'),
+                         1_000_000)
+    newest = write_archive(backupDir, 'd20261018',
+                           inc.Manifest('inc-1', 'site1', '2026-10-18T02:00:00', 'incremental',
+                                        'full-1'),
+                           2_000_000)
+
+    ret.apply_retention(params, ['site1'])
+
+    # the newest state of the day is kept, and the base it depends on
+    assert read_id(newest) == 'inc-1'
+    manifest = inc.read_manifest(inc.manifest_path(full), headerOnly=True)
+    assert (manifest.id, manifest.level) == ('full-1', 'full')
+    assert read_id(full) == 'full-1'
+    # no backup is left which depends on a missing base
+    for name in os.listdir(backupDir):
+        if name.endswith(inc.MANIFEST_SUFFIX):
+            m = inc.read_manifest(backupDir + '/' + name, headerOnly=True)
+            assert m.level == 'full' or m.base == 'full-1'
@@ -0,0 +1,227 @@
+import hashlib, os, pathlib, shlex, socket, threading
+from collections.abc import Iterator
+from typing import Any
+import pytest
+import wm.upload as upload
+from wm.sftp import PART_SUFFIX, SftpSession
+
+paramiko: Any = pytest.importorskip('paramiko')
+
+# The uploads go to an SFTP server of paramiko in a thread of the test,
+# which serves the directory root. The client finds it by the host alias
+# backuphost in ~/.ssh/config of a temporary home directory.
+HOST = 'backuphost'
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+class LocalHandle(paramiko.SFTPHandle):
+    def stat(self) -> Any:
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+class LocalSftp(paramiko.SFTPServerInterface):
+    """SFTP server interface on a local directory, see ServerOptions."""
+    options: 'ServerOptions'
+
+    def __init__(self, server: 'Server', *args: Any, **kwargs: Any):
+        # the base class keeps nothing of the server
+        self.options = server.options
+
+    def local(self, path: str) -> str:
+        return os.path.join(self.options.root, path.lstrip('/'))
+
+    def stat(self, path: str) -> Any:
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path: str, flags: int, attr: Any) -> Any:
+        try:
+            fd = os.open(self.local(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = LocalHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path: str) -> int:
+        try:
+            os.remove(self.local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath: str, newpath: str) -> int:
+        if os.path.exists(self.local(newpath)):
+            return paramiko.SFTP_FAILURE    # like the SFTP protocol demands
+        os.rename(self.local(oldpath), self.local(newpath))
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath: str, newpath: str) -> int:
+        if not self.options.posixRename:
+            return paramiko.SFTP_OP_UNSUPPORTED
+        os.replace(self.local(oldpath), self.local(newpath))
+        return paramiko.SFTP_OK
+
+class ServerOptions:
+    def __init__(self, root: str):
+        self.root = root
+        self.posixRename = True
+        self.sha256sum = True     # run "sha256sum path", else refuse commands
+        self.commands: list[str] = []
+
+class Server(paramiko.ServerInterface):
+    def __init__(self, userKey: Any, options: ServerOptions):
+        self.userKey = userKey
+        self.options = options
+
+    def get_allowed_auths(self, username: str) -> str:
+        return 'publickey'
+
+    def check_auth_publickey(self, username: str, key: Any) -> int:
+        if username == 'backup' and key == self.userKey:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel: Any, command: bytes) -> bool:
+        args = shlex.split(command.decode())
+        self.options.commands.append(args[0])
+        if not self.options.sha256sum or args[0] != 'sha256sum':
+            return False
+        path = os.path.join(self.options.root, args[1].lstrip('/'))
+        threading.Thread(target=self.sha256sum, args=(channel, path, args[1])).start()
+        return True
+
+    def sha256sum(self, channel: Any, path: str, name: str):
+        with open(path, 'rb') as f:
+            channel.sendall((hashlib.sha256(f.read()).hexdigest() + '  ' + name + '\n').encode())
+        channel.send_exit_status(0)
+        channel.close()
+
+@pytest.fixture(scope='module')
+def keys() -> tuple[Any, Any]:
+    return paramiko.RSAKey.generate(2048), paramiko.RSAKey.generate(2048)
+
+@pytest.fixture
+def server(tmp_path: pathlib.Path, keys: tuple[Any, Any],
+           monkeypatch: pytest.MonkeyPatch) -> Iterator[ServerOptions]:
+    hostKey, userKey = keys
+    options = ServerOptions(str(tmp_path / 'remote'))
+    os.makedirs(options.root + '/upload')
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    transports: list[Any] = []
+
+    def accept():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return      # closed at the end of the test
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(hostKey)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, LocalSftp)
+            transport.start_server(server=Server(userKey, options))
+            transports.append(transport)
+
+    threading.Thread(target=accept, daemon=True).start()
+    home = tmp_path / 'home'
+    os.makedirs(home / '.ssh')
+    userKey.write_private_key_file(str(home / '.ssh' / 'id_backup'))
+    (home / '.ssh' / 'config').write_text(
+        f'Host {HOST}\n    HostName 127.0.0.1\n    Port {port}\n'
+        f'    User backup\n    IdentityFile {home}/.ssh/id_backup\n')
+    hostKeys = paramiko.HostKeys()
+    hostKeys.add(f'[127.0.0.1]:{port}', hostKey.get_name(), hostKey)
+    hostKeys.save(str(home / '.ssh' / 'known_hosts'))
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.delenv('SSH_AUTH_SOCK', raising=False)
+    yield options
+    listener.close()
+    for transport in transports:
+        transport.close()
+
+@pytest.fixture
+def archive(tmp_path: pathlib.Path) -> str:
+    path = str(tmp_path / 'site1.wd0.tar.gz')
+    with open(path, 'wb') as f:
+        f.write(DATA)
+    return path
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_fresh_upload(server: ServerOptions, archive: str):
+    session = SftpSession(HOST + ':upload')
+    try:
+        session.upload(archive, 'site1.wd0.tar.gz')
+    finally:
+        session.close()
+    assert read(server.root + '/upload/site1.wd0.tar.gz') == DATA
+    assert not os.path.exists(server.root + '/upload/site1.wd0.tar.gz' + PART_SUFFIX)
+    assert server.commands == ['sha256sum']
+
+def test_resumed_upload(server: ServerOptions, archive: str, capsys: pytest.CaptureFixture[str]):
+    # without sha256sum and posix-rename, replacing the previous upload
+    server.sha256sum = False
+    server.posixRename = False
+    target = server.root + '/upload/site1.wd0.tar.gz'
+    with open(target, 'wb') as f:
+        f.write(b'previous upload')
+    with open(target + PART_SUFFIX, 'wb') as f:
+        f.write(DATA[:1000000])
+    session = SftpSession(HOST + ':upload')
+    try:
+        session.upload(archive, 'site1.wd0.tar.gz')
+    finally:
+        session.close()
+    assert 'Resuming upload at:    1000000 of ' + str(len(DATA)) in capsys.readouterr().out
+    assert read(target) == DATA
+    assert not os.path.exists(target + PART_SUFFIX)
+
+def test_mismatched_upload(server: ServerOptions, archive: str):
+    # a partial upload of another archive
+    target = server.root + '/upload/site1.wd0.tar.gz'
+    with open(target + PART_SUFFIX, 'wb') as f:
+        f.write(os.urandom(1000))
+    session = SftpSession(HOST + ':upload')
+    try:
+        with pytest.raises(IOError, match='SHA-256 mismatch'):
+            session.upload(archive, 'site1.wd0.tar.gz')
+        assert not os.path.exists(target)
+        assert not os.path.exists(target + PART_SUFFIX)
+        # the session is reopened and the next attempt starts from scratch
+        session.upload(archive, 'site1.wd0.tar.gz')
+    finally:
+        session.close()
+    assert read(target) == DATA
+
+def test_upload_queue_retries_mismatch(server: ServerOptions, archive: str,
+                                       monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(upload, 'RETRY_DELAY', 0)
+    target = server.root + '/upload/site1.wd0.tar.gz'
+    with open(target + PART_SUFFIX, 'wb') as f:
+        f.write(os.urandom(1000))
+    queue = upload.UploadQueue('scp', uploader='sftp')
+    queue.put([os.path.basename(archive)], os.path.dirname(archive), HOST + ':upload', 'site1')
+    assert queue.wait()
+    assert queue.uploads[0].attempts == 2
+    assert read(target) == DATA
@@ -0,0 +1,33 @@
+import pathlib, time
+import pytest
+import wm.upload as upload
+
+def wait_for(queue: upload.UploadQueue, numMessages: int):
+    """Wait for the messages of the uploads, without stopping the threads."""
+    for _ in range(500):
+        with queue.lock:
+            if len(queue.messages) >= numMessages:
+                return
+        time.sleep(0.01)
+    pytest.fail('uploads not finished')
+
+def test_messages_are_printed_between_the_backups(tmp_path: pathlib.Path,
+                                                  capsys: pytest.CaptureFixture[str]):
+    (tmp_path / 'remote').mkdir()
+    (tmp_path / 'site1.d20261018.tar.gz').write_bytes(b'archive')
+    # cp takes the arguments of scp, the missing archive fails
+    queue = upload.UploadQueue('cp', retries=0)
+    queue.put(['site1.d20261018.tar.gz', 'site2.d20261018.tar.gz'], str(tmp_path),
+              str(tmp_path / 'remote'))
+    wait_for(queue, 3)
+    # the site running meanwhile has its output for itself
+    assert capsys.readouterr().out == ''
+
+    queue.show_messages()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('Upload done: site1.d20261018.tar.gz (')
+    assert lines[1].startswith('Upload failed with exit code 1 : site2.d20261018.tar.gz - cp:')
+    assert lines[2].startswith('Upload failed: site2.d20261018.tar.gz (')
+    assert (tmp_path / 'remote' / 'site1.d20261018.tar.gz').read_bytes() == b'archive'
+    assert not queue.wait()
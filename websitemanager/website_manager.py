@@ -26,27 +26,60 @@ for further information.
   Autosave mode overwrites older archives from the same day.
   Backups are stored in the directory specified by the sitedumpdir parameter.
   No other arguments are allowed when the saveall option is entered.
+  With the jobs option several sites are saved concurrently.
+  The state of each site is recorded in journal.jsonl in the log directory.
+  With the resume option an interrupted saveall continues: finished sites
+  are skipped and pending uploads are queued again.
+- Use the stats option to show per site statistics of the last backups.
+  Each backup, upload and restore appends its metrics to metrics.jsonl
+  in the log directory.
+- Use the plan option to show the order of the saveall backups (longest
+  first, see the jobs option) with their predicted time and archive size
+  from the metrics of previous runs, and the predicted total time and
+  disk need. With compresslevel = auto it also shows the codec and level
+  saveall would choose for each site to fit into the backup window.
+- Use the find option to search the archives for files by a glob pattern, e.g.
+  'wp-content/plugins/*/evil.php', and the history option to list the archives
+  containing a file with its changes. Both only query the catalog, which
+  lists the members of the archives with a member index, snapshot indexes
+  and link farms. A site name restricts them to this site.
+- Use the reindex option to rebuild the archive catalog in the log directory
+  by scanning the backup directories, e.g. after archives have been moved
+  by hand. An alternative snapshot directory is scanned if entered.
 - Use the snapshot option to create a time-stamped backup of just one website
   which must have been specified by its identifier in the website table.
   The default storage location of the backups is configured in the parameter file.
+  With snapshotformat = linkfarm the snapshot is a directory in which only the
+  files changed since the last snapshot are copied, the others are hard links.
 - A website to treat can be selected interactively or entered as the first 
   positional argument. An alternative location for snapshots can be specified 
   as the second positional argument.
 - The timestamp of the website recovery archive is an optional argument.
+- Use the dbonly option with a recovery to restore only the database.
+- Use the list option to list the members of the archive of a website
+  with the timestamp and the extract option to extract a file or directory
+  of it, e.g. www/configuration.php, into the current directory. With the
+  member index written next to the archive only the needed part is read.
 - Single website actions are logged in a folder specified in the parameter file.
 - After restoration of a CMS (Joomla, Wordpress oder Mediawiki) the database
   credentials are adjusted to the corresponding values in the website table.
 """
 
 import argparse, os
-from wm.backup import get_archive_dir, backup, dumpwebsite
-from wm.restore import prepare_database, get_archive_timestamp, restore
+from wm.backup import get_archive_dir, backup
+from wm.batch import saveall
+from wm.metrics import show_stats
+from wm.planner import plan_backups, show_plan
+from wm.autotune import show_choices, tune_plan
+from wm.catalog import Catalog, open_catalog, reindex, show_find, show_history, show_summary
+from wm.throttle import configure_throttle, set_priority
+from wm.restore import prepare_database, get_archive_timestamp, inspect_archive, restore
 
 import wm.utils as u
 from wm.utils import Operation
 from wm.websites import WebSiteTable
 from wm.config import Parameters
-__version__ = "1.8.0"
+__version__ = "1.9.0"
 
 p = argparse.ArgumentParser(description=__doc__,
                # formatter used to preserve the raw doc format
@@ -63,10 +96,28 @@ g.add_argument("-b", "--back", help="recover after having made a snapshot",
                action="store_true")
 g.add_argument("-p", "--prepare", help="prepare database", 
                action="store_true")
+g.add_argument('--stats', type=int, nargs='?', const=10, metavar='N',
+               help='show backup statistics of the last N runs per site (default 10)')
+g.add_argument('--reindex', help='rebuild the archive catalog by scanning',
+               action='store_true')
+g.add_argument('--find', type=str, metavar='PATTERN',
+               help="find the archives containing files like 'wp-content/plugins/*/x.php'")
+g.add_argument('--history', type=str, metavar='PATH',
+               help='show the archives containing a file and its changes')
+g.add_argument('--plan', help='show the predicted saveall schedule without running it',
+               action='store_true')
 g.add_argument('-t', '--timestamp', type=str, 
                help='''enter timestamp and recover from associated backup
 - timestamp format: YYYY-MM-DD_hh-mm or YYYY-MM-DD''')
 
+p.add_argument('--list', help='list the members of an archive', action='store_true')
+p.add_argument('--extract', type=str, metavar='PATH',
+               help='extract a file or directory of an archive, e.g. www/index.php')
+p.add_argument('--dbonly', help='only restore the database', action='store_true')
+p.add_argument('--resume', help='continue the last saveall run from its journal',
+               action='store_true')
+p.add_argument('-j', '--jobs', type=int, default=1,
+               help='number of websites saved concurrently in saveall mode')
 p.add_argument('-c', '--config', type=str, help='enter alternative parameter file name')
 p.add_argument('-w', '--websites', type=str, help='enter alternative websites file name')
 p.add_argument("siteName", nargs='?', type=str, default='none',
@@ -89,13 +140,19 @@ u.is_file_or_abort(websitesfile)
 
 siteName = args.siteName
 mode = Operation.UNKNOWN
-if (args.timestamp):
+if args.list or args.extract is not None:
+    mode = Operation.INSPECT
+    if args.saveall or args.snapshot or args.replace or args.back or args.prepare:
+        u.abort('The list and extract options only accept a site and a timestamp')
+elif (args.timestamp):
     mode = Operation.REPLACE
 else:
     if args.saveall:
         mode = Operation.BATCH_SAVEALL
         if siteName != 'none':
             u.abort('Site name argument prohibited for saveall mode')
+    elif args.resume:
+        u.abort('The resume option requires the saveall option')
     elif args.snapshot:
         mode = Operation.SNAPSHOT
     elif args.replace:
@@ -104,12 +161,19 @@ else:
         mode = Operation.REPLACE_AFTER_SNAPSHOT
     elif args.prepare:
         mode = Operation.DBEXIST
+if args.dbonly and mode not in (Operation.UNKNOWN, Operation.REPLACE,
+                                Operation.REPLACE_AFTER_SNAPSHOT):
+    u.abort('The dbonly option requires a recovery')
+
+if args.jobs < 1:
+    u.abort('Number of jobs must be at least 1')
 
 altDir = args.altDir
 if altDir != "none":    
     u.is_dir_or_abort(altDir)
 
-# ensure that working dir is the source dir
+# ensure that working dir is the source dir, extract into the original one
+extractDir = os.getcwd()
 os.chdir(script_folder)
 u.print_line()
 print('Current working directory:', os. getcwd())
@@ -120,6 +184,34 @@ numSites = websites.getNumWebsites()
 params = Parameters(paramsfile)
 if params.get('runasroot') == 'true':
     u.check_root_user()
+configure_throttle(params)
+
+if args.stats is not None:
+    show_stats(params.get('logdir'), args.stats, siteName)
+    show_summary(open_catalog(params), siteName)
+    u.print_line()
+    quit()
+
+if args.reindex:
+    reindex(Catalog(params.get('logdir')), params, altDir)
+    quit()
+
+if args.find is not None:
+    show_find(open_catalog(params), args.find, siteName)
+    quit()
+
+if args.history is not None:
+    show_history(open_catalog(params), args.history, siteName)
+    quit()
+
+if args.plan:
+    sites = [websites.getData(row) for row in range(numSites)]
+    plan = plan_backups(params, sites, args.jobs)
+    if params.get('compresslevel') == 'auto':
+        plan, choices = tune_plan(params, plan, record=False)
+        show_choices(plan, choices)
+    show_plan(params, plan)
+    quit()
 
 if mode == Operation.UNKNOWN:
     print('Select task:')
@@ -141,8 +233,8 @@ if mode == Operation.UNKNOWN:
     quit()
 
 if mode.isSaveall():
-    for row in range(numSites):
-        dumpwebsite(params, websites.getData(row))
+    set_priority(params)
+    saveall(params, websites, args.jobs, args.resume)
     quit()
 
 if siteName != 'none' and not websites.hasSite(siteName):
@@ -160,6 +252,9 @@ print('=> Treated website:', site.siteName, '"' + site.comment + '"')
 if mode.isSnapshot():
     u.print_line()
     print('=> Create snapshot of', site.siteName)
+    if mode == Operation.SNAPSHOT:
+        # not before a restore, which should be as fast as possible
+        set_priority(params)
     dailydump = False
     backup(params, site, dailydump, altDir)
 
@@ -171,7 +266,16 @@ if mode.isReplace():
     else:
         timestamp = get_archive_timestamp(params, site, altDir)
     backupDir = get_archive_dir(params, timestamp, altDir)
-    restore(params, site, timestamp, backupDir)
+    restore(params, site, timestamp, backupDir, args.dbonly)
+
+if mode == Operation.INSPECT:
+    if (args.timestamp):
+        timestamp = args.timestamp
+    else:
+        timestamp = get_archive_timestamp(params, site, altDir)
+    backupDir = get_archive_dir(params, timestamp, altDir)
+    inspect_archive(params, site, timestamp, backupDir,
+                    args.extract if args.extract is not None else 'none', extractDir)
 
 if mode == Operation.DBEXIST:
     u.check_root_user()
@@ -0,0 +1,293 @@
+try:                 # optional, only needed for the codec zstd
+    import zstandard # type: ignore
+except ImportError:
+    zstandard = None
+import collections, concurrent.futures, glob, gzip, hashlib, io, lzma, os, struct, tarfile, time, zlib
+from typing import IO, Any
+import wm.utils as u
+from wm.config import Parameters
+from wm.pagecache import READ_SIZE, CacheFriendlyTarFile, PageCache, get_page_cache
+from wm.throttle import THROTTLE
+from wm.memberindex import INDEXED_CODECS, BlockWriter, IndexedTarFile, write_index
+
+# Supported archive codecs and the file name suffix of their archives.
+# pgzip writes a single gzip member with multiple threads like pigz does.
+CODEC_SUFFIXES: dict[str, str] = {
+    'gzip':  '.tar.gz',
+    'pgzip': '.tar.gz',
+    'zstd':  '.tar.zst',
+    'xz':    '.tar.xz',
+    'none':  '.tar',
+}
+# Levels of compresslevel = auto outside of saveall, see wm.autotune.
+DEFAULT_LEVELS: dict[str, int] = {'gzip': 5, 'pgzip': 5, 'zstd': 3, 'xz': 6, 'none': 0}
+# Suffixes of all readable archives, longest first.
+ARCHIVE_SUFFIXES = ['.tar.zst', '.tar.gz', '.tar.xz', '.tar']
+# Size of the tar stream buffer in front of the compressor.
+TAR_BUFSIZE = 1024 * 1024
+# The SHA-256 of each archive is stored next to it in the format of
+# sha256sum, e.g. siteName.wd0.tar.gz.sha256.
+CHECKSUM_SUFFIX = '.sha256'
+# The fingerprint of the site saved by a daily archive, see wm.fingerprint.
+FINGERPRINT_SUFFIX = '.fingerprint'
+
+def archive_suffix(path: str) -> str:
+    """Returns the archive suffix of path or '' if there is none."""
+    for suffix in ARCHIVE_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return ''
+
+def archive_name(siteName: str, tag: str, codec: str) -> str:
+    return siteName + '.' + tag + CODEC_SUFFIXES[codec]
+
+def archive_tag(siteName: str, archive: str) -> str:
+    """Returns the tag of an archive file name of site siteName."""
+    name = os.path.basename(archive)
+    name = name[len(siteName) + 1:]
+    return name[:len(name) - len(archive_suffix(name))]
+
+def find_archives(archiveDir: str, siteName: str, tag: str) -> list[str]:
+    """Returns the paths of all archives of siteName with tag regardless of the codec."""
+    paths: list[str] = []
+    for suffix in ARCHIVE_SUFFIXES:
+        path = archiveDir + '/' + siteName + '.' + tag + suffix
+        if os.path.isfile(path):
+            paths.append(path)
+    return paths
+
+def find_archive(archiveDir: str, siteName: str, tag: str) -> str:
+    """Returns the path of the newest archive of siteName with tag or 'none'."""
+    paths = find_archives(archiveDir, siteName, tag)
+    if len(paths) == 0:
+        return 'none'
+    return max(paths, key=os.path.getmtime)
+
+def list_archives(archiveDir: str, siteName: str) -> list[str]:
+    """Returns the file names of all archives of siteName in archiveDir."""
+    files = glob.glob(glob.escape(archiveDir) + '/' + glob.escape(siteName) + '.*.tar*')
+    return [os.path.basename(f) for f in files if archive_suffix(f) != '']
+
+def checksum_path(archivePath: str) -> str:
+    return archivePath + CHECKSUM_SUFFIX
+
+def fingerprint_path(archivePath: str) -> str:
+    return archivePath + FINGERPRINT_SUFFIX
+
+def write_checksum(archivePath: str, digest: str):
+    with open(checksum_path(archivePath), 'w', encoding='utf-8') as f:
+        f.write(digest + '  ' + os.path.basename(archivePath) + '\n')
+
+def read_checksum(archivePath: str) -> str:
+    """Returns the stored SHA-256 of an archive or '' if there is none."""
+    path = checksum_path(archivePath)
+    if not os.path.isfile(path):
+        return ''
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().split(' ', 1)[0].strip()
+
+def get_level(params: Parameters, codec: str) -> int:
+    """compresslevel, with compresslevel = auto the default level of codec."""
+    level = params.get('compresslevel')
+    if level == 'auto':
+        return DEFAULT_LEVELS[codec]
+    return int(level)
+
+def get_codec(params: Parameters) -> tuple[str, int, int]:
+    """Returns codec, compression level and number of threads from the parameters."""
+    codec = params.get('compression')
+    if codec not in CODEC_SUFFIXES:
+        u.abort('unknown compression "' + codec + '", use one of:',
+                ', '.join(CODEC_SUFFIXES))
+    if codec == 'zstd' and zstandard is None:
+        u.abort('compression zstd requires the Python package zstandard')
+    level = get_level(params, codec)
+    threads = int(params.get('compressthreads'))
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    return codec, level, threads
+
+def detect_codec(path: str) -> str:
+    """Detect the codec of an archive from its magic bytes."""
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if magic.startswith(b'\x28\xb5\x2f\xfd'):
+        return 'zstd'
+    if magic.startswith(b'\xfd7zXZ\x00'):
+        return 'xz'
+    return 'none'
+
+class ParallelGzipWriter:
+    """
+    Write a single gzip member whose deflate blocks are compressed by
+    several threads, like pigz does. Each block is primed with the last
+    32 KiB of its predecessor and ends with a sync flush, so the blocks
+    can simply be concatenated. zlib releases the GIL while compressing.
+    """
+    def __init__(self, fileobj: IO[bytes], level: int, threads: int,
+                 blockSize: int = 1024 * 1024):
+        self.fileobj = fileobj
+        self.level = level
+        self.blockSize = blockSize
+        self.maxPending = 2 * threads
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.pending: collections.deque[concurrent.futures.Future[bytes]] = collections.deque()
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        # gzip header: magic, deflate, no flags, mtime, no extra flags, Unix
+        self.fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time()))
+                           + b'\x00\x03')
+
+    def write(self, data: Any) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.blockSize:
+            block = bytes(self.buffer[:self.blockSize])
+            del self.buffer[:self.blockSize]
+            self._submit(block, False)
+        return len(data)
+
+    def _submit(self, block: bytes, last: bool):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.pool.submit(deflate_block, block, self.dictionary,
+                                             self.level, last))
+        self.dictionary = block[-32768:]
+        while len(self.pending) > self.maxPending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        self._submit(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.fileobj.write(struct.pack('<II', self.crc & 0xffffffff,
+                                       self.size & 0xffffffff))
+
+def deflate_block(block: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    if dictionary:
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(block) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class HashingWriter(io.BufferedWriter):
+    """
+    File opened for writing which computes the SHA-256 of the data written
+    to it. The writing is paused by THROTTLE while the server is under pressure.
+    """
+    def __init__(self, path: str):
+        super().__init__(io.FileIO(path, 'wb'))
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: Any) -> int:
+        THROTTLE.wait()
+        self.sha256.update(data)
+        return super().write(data)
+
+class ArchiveWriter:
+    """
+    Tar archive written with one of the codecs of CODEC_SUFFIXES.
+    Use as context manager, the tar file is available as attribute tar.
+    With pageCache the files added are read according to this policy.
+    The SHA-256 of the archive is computed while it is written and
+    stored next to it when the archive is closed. With indexed, gzip and
+    zstd archives are written in blocks and a member index is stored
+    next to the archive as well, see wm.memberindex. With storeCompressed
+    in addition, files compressed already are not compressed again.
+    """
+    def __init__(self, path: str, codec: str, level: int, threads: int = 1,
+                 pageCache: PageCache | None = None, indexed: bool = False,
+                 storeCompressed: bool = False):
+        self.path = path
+        self.codec = codec
+        self.raw = HashingWriter(path)
+        self.stream: Any = self.raw
+        self.indexed = indexed and codec in INDEXED_CODECS
+        if self.indexed:
+            self.stream = BlockWriter(self.raw, codec, level, threads)
+        elif codec == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=level)
+        elif codec == 'pgzip':
+            self.stream = ParallelGzipWriter(self.raw, level, threads)
+        elif codec == 'xz':
+            self.stream = lzma.LZMAFile(self.raw, 'wb', preset=level)
+        elif codec == 'zstd':
+            cctx = zstandard.ZstdCompressor(level=level, threads=threads) # type: ignore
+            self.stream = cctx.stream_writer(self.raw, closefd=False)
+        self.tar: tarfile.TarFile
+        self.indexedTar: IndexedTarFile | None = None
+        if self.indexed:
+            # not streamed, the members are written directly to the blocks
+            indexedTar = IndexedTarFile(fileobj=self.stream, mode='w',
+                                        dereference=True, copybufsize=READ_SIZE)
+            indexedTar.pageCache = pageCache or PageCache()
+            indexedTar.entries = []
+            indexedTar.storeCompressed = storeCompressed
+            self.indexedTar = indexedTar
+            self.tar = indexedTar
+        elif pageCache is None:
+            self.tar = tarfile.open(fileobj=self.stream, mode='w|',
+                                    bufsize=TAR_BUFSIZE, dereference=True)
+        else:
+            tar = CacheFriendlyTarFile.open(fileobj=self.stream, mode='w|',
+                                            bufsize=TAR_BUFSIZE, dereference=True)
+            tar.copybufsize = READ_SIZE   # not a parameter of open()
+            tar.pageCache = pageCache
+            self.tar = tar
+
+    def close(self):
+        self.tar.close()
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.close()
+        write_checksum(self.path, self.raw.sha256.hexdigest())
+        if self.indexedTar is not None:
+            write_index(self.path, self.codec, self.indexedTar.entries)
+
+    def __enter__(self) -> 'ArchiveWriter':
+        return self
+
+    def __exit__(self, *exc: Any):
+        self.close()
+
+def open_archive_writer(params: Parameters, path: str) -> ArchiveWriter:
+    codec, level, threads = get_codec(params)
+    return ArchiveWriter(path, codec, level, threads, get_page_cache(params),
+                         params.get('archiveindex') == 'true',
+                         params.get('storecompressed') == 'true')
+
+class ArchiveReader:
+    """
+    Tar archive opened for sequential reading. The codec is detected
+    automatically. Use as context manager, the tar file is available as
+    attribute tar.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.codec = detect_codec(path)
+        self.raw: Any = None
+        if self.codec == 'zstd':
+            if zstandard is None:
+                u.abort('reading', path, 'requires the Python package zstandard')
+            self.raw = open(path, 'rb')
+            reader = zstandard.ZstdDecompressor().stream_reader(self.raw) # type: ignore
+            self.tar = tarfile.open(fileobj=reader, mode='r|', bufsize=TAR_BUFSIZE)
+        else:
+            # tarfile handles gzip, xz and uncompressed archives itself
+            self.tar = tarfile.open(path, 'r:*')
+
+    def close(self):
+        self.tar.close()
+        if self.raw is not None:
+            self.raw.close()
+
+    def __enter__(self) -> 'ArchiveReader':
+        return self
+
+    def __exit__(self, *exc: Any):
+        self.close()
@@ -0,0 +1,168 @@
+import copy, statistics
+from dataclasses import dataclass
+import wm.utils as u
+from wm.archive import DEFAULT_LEVELS, zstandard
+from wm.config import Parameters
+from wm.metrics import Metrics, new_metrics, read_metrics, write_metrics
+from wm.planner import Estimate, Plan, schedule
+
+# With compresslevel = auto, saveall chooses the codec and level of each
+# site such that the archives are as small as possible while the backups
+# are predicted to fit into backupwindow. The candidates are the levels of
+# REFERENCE of the codecs in autotunecodecs. A candidate is predicted from
+# the last backups of the site: the time writing the archive scales with
+# the relative speed of the candidate to the codec and level of a backup,
+# the archive size with the relative ratio, the rest of the backup time is
+# kept. All candidates are predicted from the same backups, a backup with
+# the candidate itself counts as it was measured. As the last backups
+# were made with the last choices, the choice adapts with each run.
+HISTORY_RUNS = 5
+# Relative speed and compression ratio on web files, against gzip level 5.
+REFERENCE: dict[str, dict[int, tuple[float, float]]] = {
+    'gzip':  {1: (2.2, 0.92), 3: (1.6, 0.97), 5: (1.0, 1.0), 6: (0.8, 1.01), 9: (0.35, 1.02)},
+    'pgzip': {1: (2.2, 0.92), 3: (1.6, 0.97), 5: (1.0, 1.0), 6: (0.8, 1.01), 9: (0.35, 1.02)},
+    'zstd':  {1: (4.5, 1.0), 3: (3.5, 1.05), 6: (1.6, 1.1), 9: (1.0, 1.13), 12: (0.6, 1.14),
+              15: (0.35, 1.15), 19: (0.08, 1.22)},
+    'xz':    {0: (0.6, 1.15), 3: (0.25, 1.2), 6: (0.12, 1.27), 9: (0.1, 1.28)},
+}
+
+@dataclass
+class Choice:
+    siteName: str
+    codec: str
+    level: int
+    source: str          # measured, scaled or default
+    seconds: float = 0.0
+    archiveBytes: int = 0
+
+def get_candidates(params: Parameters) -> list[tuple[str, int]]:
+    codecs = params.get('autotunecodecs')
+    if codecs == 'none':
+        codecs = params.get('compression')
+    candidates: list[tuple[str, int]] = []
+    for codec in codecs.split(','):
+        codec = codec.strip()
+        if codec not in REFERENCE:
+            u.abort('autotunecodecs: unknown codec "' + codec + '", use some of:',
+                    ', '.join(REFERENCE))
+        if codec == 'zstd' and zstandard is None:
+            u.abort('compression zstd requires the Python package zstandard')
+        candidates += [(codec, level) for level in REFERENCE[codec]]
+    return candidates
+
+def level_of(m: Metrics) -> int:
+    # metrics written before the level was recorded
+    return m.compressLevel if m.compressLevel >= 0 else DEFAULT_LEVELS.get(m.codec, 0)
+
+def reference_of(m: Metrics) -> tuple[float, float] | None:
+    return REFERENCE.get(m.codec, {}).get(level_of(m))
+
+def predict(runs: list[Metrics], codec: str, level: int) -> tuple[str, float, int]:
+    """Source, seconds and archive bytes of a backup with codec and level."""
+    speed, ratio = REFERENCE[codec][level]
+    seconds: list[float] = []
+    archiveBytes: list[float] = []
+    for m in runs:
+        reference = reference_of(m)
+        assert reference is not None    # filtered by tune_plan
+        speed0, ratio0 = reference
+        # the dump is compressed at the rate of the web files
+        writeSeconds = (m.bytesRead + m.dumpBytes) / (m.bytesRead / m.tarSeconds)
+        other = max(m.seconds - writeSeconds, 0.0)
+        seconds.append(other + writeSeconds * speed0 / speed)
+        archiveBytes.append(m.archiveBytes * ratio0 / ratio)
+    measured = any(m.codec == codec and level_of(m) == level for m in runs)
+    return ('measured' if measured else 'scaled', statistics.median(seconds),
+            int(statistics.median(archiveBytes)))
+
+def choose(options: dict[str, list[Choice]], budget: float) -> dict[str, Choice]:
+    """
+    Start with the fastest option of each site and upgrade the site which
+    saves the most bytes per additional second while the budget allows.
+    """
+    chosen = {name: min(opts, key=lambda c: (c.seconds, c.archiveBytes))
+              for name, opts in options.items()}
+    used = sum(c.seconds for c in chosen.values())
+    while True:
+        best: tuple[float, str, Choice] | None = None
+        for name, opts in options.items():
+            current = chosen[name]
+            for c in opts:
+                if c.archiveBytes >= current.archiveBytes:
+                    continue
+                extra = c.seconds - current.seconds
+                if used + extra > budget:
+                    continue
+                gain = (current.archiveBytes - c.archiveBytes) / max(extra, 1e-3)
+                if best is None or gain > best[0]:
+                    best = (gain, name, c)
+        if best is None:
+            return chosen
+        used += best[2].seconds - chosen[best[1]].seconds
+        chosen[best[1]] = best[2]
+
+def tune_plan(params: Parameters, plan: Plan,
+              record: bool = True) -> tuple[Plan, dict[str, Choice]]:
+    """
+    Choose codec and level of the sites of plan and return the plan with
+    the predictions of the choices. With record, each choice is recorded
+    in the metrics.
+    """
+    window = float(params.get('backupwindow'))
+    if window <= 0:
+        u.abort('compresslevel = auto requires a backupwindow')
+    candidates = get_candidates(params)
+    history = [m for m in read_metrics(params.get('logdir'))
+               if m.kind == 'backup' and m.level != 'unchanged' and m.tarSeconds > 0
+               and m.bytesRead > 0 and m.archiveBytes > 0 and reference_of(m) is not None]
+    options: dict[str, list[Choice]] = {}
+    defaults: dict[str, Choice] = {}
+    for e in plan.estimates:
+        if e.source == 'skipped':
+            continue
+        runs = [m for m in history if m.siteName == e.siteName][-HISTORY_RUNS:]
+        if not runs:
+            # no history yet: the default level of the first codec
+            codec = candidates[0][0]
+            defaults[e.siteName] = Choice(e.siteName, codec, DEFAULT_LEVELS[codec], 'default',
+                                          e.seconds, e.archiveBytes)
+            continue
+        options[e.siteName] = [Choice(e.siteName, codec, level, *predict(runs, codec, level))
+                               for codec, level in candidates]
+    budget = window * 60 * plan.jobs - sum(c.seconds for c in defaults.values())
+    choices = choose(options, budget) | defaults
+    estimates: list[Estimate] = []
+    for e in plan.estimates:
+        c = choices.get(e.siteName)
+        if c is not None:
+            e = Estimate(e.siteName, e.source, c.seconds, c.archiveBytes, e.dumpBytes)
+        estimates.append(e)
+    if record:
+        for c in choices.values():
+            m = new_metrics('tuning', c.siteName, '')
+            m.codec = c.codec
+            m.compressLevel = c.level
+            m.seconds = round(c.seconds, 3)
+            m.archiveBytes = c.archiveBytes
+            write_metrics(params.get('logdir'), m)
+    return schedule(estimates, plan.jobs), choices
+
+def site_params(params: Parameters, choice: Choice | None) -> Parameters:
+    """The parameters of a site with the codec and level of its choice."""
+    if choice is None:
+        return params
+    siteParams = copy.deepcopy(params)
+    siteParams.set('compression', choice.codec)
+    siteParams.set('compresslevel', str(choice.level))
+    return siteParams
+
+def show_choices(plan: Plan, choices: dict[str, Choice]):
+    u.print_line()
+    print('Compression tuned to the backup window, predicted per site:')
+    width = max([len(name) for name in choices] + [len('site')])
+    print('site'.ljust(width), ' codec', ' level', ' source  ', '  seconds', ' archive MB')
+    for e in plan.estimates:
+        c = choices.get(e.siteName)
+        if c is not None:
+            print(c.siteName.ljust(width), c.codec.rjust(6), f'{c.level:6}', '', c.source.ljust(8),
+                  f'{c.seconds:9.1f}', f'{c.archiveBytes / 1e6:11.1f}')
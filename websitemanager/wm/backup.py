@@ -1,7 +1,27 @@
-import os, datetime, platform, tarfile
+import os, datetime, platform, shlex, shutil, tarfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 import wm.utils as u
 import wm.dbutils as db
 import wm.timeutils as t
+import wm.incremental as inc
+import wm.chunkstore as cs
+import wm.retention as ret
+from wm.archive import archive_name, archive_suffix, archive_tag, find_archive
+from wm.archive import find_archives, get_codec, get_level, open_archive_writer
+from wm.archive import read_checksum, write_checksum
+from wm.sqlstream import SqlSpool, add_directory
+from wm.tabledump import TABLES_DIR, dump_tables, list_tables
+from wm.exclusions import get_exclusions
+from wm.pagecache import get_page_cache
+from wm.throttle import THROTTLE
+from wm.sftp import SftpSession
+from wm.catalog import Catalog, location_of, open_catalog, remote_key
+from wm.fingerprint import find_unchanged, site_fingerprint, write_fingerprint
+from wm.journal import Journal
+from wm.memberindex import IndexedTarFile, index_path
+import wm.linkfarm as lf
+from wm.metrics import FileCounter, Metrics, new_metrics, write_metrics
 from wm.websites import WebSiteData
 from wm.config import Parameters
 
@@ -24,31 +44,45 @@ def get_archive_dir(params : Parameters, timestamp: str, altdir: str = 'none') -
         u.ensure_dir(archiveDir)
     return archiveDir
 
-def dumpwebsite(p : Parameters, d : WebSiteData):
+def dumpwebsite(p : Parameters, d : WebSiteData, uploads: list[str] | None = None,
+                journal: Journal | None = None) -> str:
+    """
+    Daily backup of a website of the website table. 
+    Returns the path of the written archive or 'none' if the site is skipped.
+    See backup() for uploads and journal.
+    """
     if d.save != "1":
         u.print_line()
         print(d.siteName, 'skipped due to column "save"')
-        return
+        return 'none'
     dailydump = True
-    backup(p, d, dailydump)
+    return backup(p, d, dailydump, uploads=uploads, journal=journal)
 
-def backup(params : Parameters, site : WebSiteData, sitedump : bool, altdir: str = "none"):
+def backup(params : Parameters, site : WebSiteData, sitedump : bool, altdir: str = "none",
+           uploads: list[str] | None = None, journal: Journal | None = None) -> str:
     """
     Arguments:
       params:     Parameters object with general settings
       data:       WebSiteData object containing the website data
       sitedump:   True - daily dump, False - timed snapshot
       altdir:     If entered, alternative target directory
+      uploads:    If entered, the archives to be uploaded to the remote
+                  location are appended instead of being uploaded
+      journal:    If entered, the progress is recorded in the saveall journal
+    Returns the path of the written archive.
     """
     timer = t.TimerElapsed()
+    pausedBefore = THROTTLE.pausedSeconds
     
     # Current weekday time stamp wd0 ... wd6
     weekday = t.get_weekday()
     # year-month-day_hour-min
     time = t.get_time_tag()
     tag = time
+    gfs = ret.is_gfs(params)
     if sitedump:
-        tag = weekday
+        # with GFS retention d<YYYYMMDD>, promoted by apply_retention()
+        tag = ret.daily_tag(datetime.date.today()) if gfs else weekday
 
     # Define directories:
     wwwRoot = params.get('wwwroot')                # web files' root directory
@@ -56,15 +90,37 @@ def backup(params : Parameters, site : WebSiteData, sitedump : bool, altdir: str
     wwwDir = wwwRoot + '/' + site.wwwSubdir        # website files' directory
     backupDir = get_archive_dir(params, tag, altdir) # backup archive target dir
 
-    # Database and archive files
-    zipArchive = site.siteName + '.' + tag + '.tar.gz'
+    metrics = new_metrics('backup' if sitedump else 'snapshot', site.siteName, tag)
+    backend = params.get('backend')
+    metrics.backend = backend
+    if backend == 'chunkstore':
+        return backup_to_chunkstore(params, site, sitedump, tag, wwwDir, backupDir,
+                                    timer, metrics, pausedBefore)
+    if backend != 'archive':
+        u.abort('unknown backend "' + backend + '", use archive or chunkstore')
+    snapshotFormat = params.get('snapshotformat')
+    if snapshotFormat not in ('archive', 'linkfarm'):
+        u.abort('unknown snapshotformat "' + snapshotFormat + '", use archive or linkfarm')
+    if not sitedump and snapshotFormat == 'linkfarm':
+        metrics.backend = 'linkfarm'
+        return backup_to_linkfarm(params, site, tag, wwwDir, backupDir,
+                                  timer, metrics, pausedBefore)
+
+    # Database and archive files, the suffix depends on the codec
+    codec, level, _ = get_codec(params)
+    metrics.codec = codec
+    metrics.compressLevel = level
+    zipArchive = archive_name(site.siteName, tag, codec)
     zipPath = backupDir + '/' + zipArchive
+    # archive of a previous backup with the same tag, possibly another codec
+    oldZipPath = find_archive(backupDir, site.siteName, tag)
 
     # will a longterm backup be created?
     longtermZipArchive = 'none'
     useRemoteLocation = 'none'
     if sitedump:
-        longtermZipArchive = get_longterm_archive(zipPath, site.siteName)
+        if not gfs:
+            longtermZipArchive = get_longterm_archive(oldZipPath, site.siteName)
         useRemoteLocation = remoteLocation
     u.print_line()
     print('Script started:       ', t.get_current_time())
@@ -73,71 +129,403 @@ def backup(params : Parameters, site : WebSiteData, sitedump : bool, altdir: str
     print('Webpage directory:    ', wwwDir)
     print('Included database:    ', site.dbName)
     print('Backup directory:     ', backupDir)
-    print('Gzip archive written: ', zipArchive)
+    print('Archive written:      ', zipArchive)
+    print('Compression:          ', codec, 'level', level)
     print('Remote backup path:   ', useRemoteLocation)
     print('Longterm archive:     ', longtermZipArchive)
     
     # ========== Check that www directory exists ===================
     u.is_dir_or_abort(wwwDir)
+    exclusions = get_exclusions(params, site)
+    exclusions.show()
 
-    # ========== If there is a database, create SQL dump ===================
-    tempDir = dump_database(params, site, backupDir)
+    # ========== Full or incremental archive? ===================
+    plan = None
+    if sitedump and params.get('incremental') == 'true':
+        if gfs:
+            full = ret.full_backup_due(backupDir, site.siteName, tag, datetime.date.today())
+        else:
+            full = is_full_backup_day(datetime.date.today())
+        plan = inc.plan_backup(backupDir, site.siteName, tag, wwwDir, full, exclusions)
+        print('Backup level:         ', plan.manifest.level)
+        metrics.level = plan.manifest.level
+        metrics.scanSeconds = timer.show_elapsed('Scan time elapsed')
+
+    # ========== Unchanged since an archive of the site? ===================
+    fingerprint = ''
+    unchangedPath = 'none'
+    if sitedump and plan is None and params.get('skipunchanged') == 'true':
+        fingerprint = site_fingerprint(params, site, wwwDir, exclusions)
+        unchangedPath = find_unchanged(open_catalog(params), backupDir, site.siteName,
+                                       archive_suffix(zipPath), fingerprint)
+        print('Unchanged since:      ', os.path.basename(unchangedPath))
+        metrics.scanSeconds = timer.show_elapsed('Fingerprint time elapsed')
 
-    # ========== Create tar.gz archive ===================
+    # ========== Create tar archive ===================
     # rename archive as longterm archive if applicable
+    newUploads = [zipArchive]
     if longtermZipArchive != 'none':
         longtermArchivePath = backupDir + '/' + longtermZipArchive
-        print('Replacing:', zipPath, longtermArchivePath)
-        os.replace(zipPath, longtermArchivePath)
+        longtermTag = archive_tag(site.siteName, longtermZipArchive)
+        for path in find_archives(backupDir, site.siteName, longtermTag):
+            inc.delete_archive(path)
+        inc.rename_archive(oldZipPath, longtermArchivePath)
+        newUploads.append(longtermZipArchive)
+        if unchangedPath == oldZipPath:
+            unchangedPath = longtermArchivePath
+    elif plan is not None and oldZipPath != 'none':
+        # keep a full archive which is still the base of incremental archives
+        if inc.base_in_use(backupDir, site.siteName, oldZipPath):
+            retiredPath = inc.retire_archive(site.siteName, oldZipPath)
+            newUploads.append(os.path.basename(retiredPath))
+    # remove an archive with the same tag written with another codec
+    for path in find_archives(backupDir, site.siteName, tag):
+        if path != zipPath:
+            print('Removing:', path)
+            inc.delete_archive(path)
+    u.delete_file(inc.manifest_path(zipPath))
+    u.delete_file(cs.index_path(backupDir, site.siteName, tag))
 
-    # Open gz archive to be written, add webfiles and add SQL dump.
-    with tarfile.open(zipPath, "w:gz", compresslevel=5, dereference=True) as tar:
-        tar.add(wwwDir, arcname="www")
+    # Open archive to be written, add webfiles and add SQL dump.
+    counter = FileCounter()
+    if unchangedPath != 'none':
+        link_archive(unchangedPath, zipPath)
+        metrics.level = 'unchanged'
+    else:
+        # If there is a database, the SQL dump runs in a thread while the
+        # web files are archived, its members are appended to the archive
+        # when it has finished.
+        if journal is not None:
+            journal.record(site.siteName, 'dumping')
+        dumpPool = ThreadPoolExecutor(max_workers=1)
+        dumpFuture = dumpPool.submit(run_dump, params, site, backupDir)
+        # the archive of the same tag may be a hard link of another archive
+        inc.delete_archive(zipPath)
+        try:
+            with open_archive_writer(params, zipPath) as archive:
+                tar = archive.tar
+                if plan is not None:
+                    inc.add_info(tar, plan)
+                    inc.add_webfiles(tar, wwwDir, plan, exclusions.tar_filter(counter))
+                else:
+                    tar.add(wwwDir, arcname="www", filter=exclusions.tar_filter(counter))
+                metrics.tarSeconds = timer.show_elapsed('Tarfile time elapsed')
+                dump = dumpFuture.result()
+                if journal is not None:
+                    journal.record(site.siteName, 'archiving')
+                metrics.dumpBytes = dump.size
+                metrics.dumpSeconds = dump.seconds
+                dump.add_to(tar, site.siteName)
+                if isinstance(tar, IndexedTarFile) and tar.storeCompressed:
+                    print('Stored uncompressed:  ', f'{tar.storedBytes / 1e6:.1f}', 'MBytes')
+        except BaseException:
+            # e.g. the dump failed: no archive without its database
+            inc.delete_archive(zipPath)
+            raise
+        finally:
+            dumpPool.shutdown()
         if site.dbName != 'none':
-            tar.add(tempDir, arcname="database")
-            u.delete_dir(tempDir)
-    timer.show_elapsed('Tarfile time elapsed')
+            timer.show_elapsed('Database added, time elapsed')
+    metrics.fileCount = counter.files
+    metrics.bytesRead = counter.bytes
 
     if os.path.exists(zipPath):
         if params.get('wwwbanothers') == 'true':
            u.RUNNER.do(BAN_OTHERS_SINGLE + zipPath)
-        print('Gzip archive written: ', zipPath)
+        print('Archive written:      ', zipPath)
+        metrics.archiveBytes = os.path.getsize(zipPath)
+        if plan is not None:
+            plan.manifest.write(inc.manifest_path(zipPath))
+            inc.prune_retired(backupDir, site.siteName)
+        if fingerprint != '':
+            write_fingerprint(zipPath, fingerprint)
         # no log on bulk backup
         if not sitedump:
             logFile = params.get('logdir') + '/' + site.siteName + '.txt'
             u.append_logfile(logFile, tag + ' saved: ')
     else:
-        u.abort('Gzip archive missing: ', zipPath)
+        u.abort('Archive missing: ', zipPath)
+    catalog = open_catalog(params)
+    catalog.scan_dir(location_of(params, backupDir), backupDir, site.siteName)
+    if (unchangedPath != 'none' and useRemoteLocation != 'none'
+            and copy_on_remote(params, catalog, site.siteName, zipPath)):
+        newUploads.remove(zipArchive)
 
     scp = params.get('scp')
     if useRemoteLocation != 'none':
-        remote_upload(zipArchive, longtermZipArchive, backupDir, scp, useRemoteLocation)
+        if uploads is not None:
+            uploads += newUploads
+        else:
+            uploadTimer = t.TimerElapsed()
+            if params.get('uploader') == 'sftp':
+                sftp_upload(newUploads, backupDir, useRemoteLocation)
+            else:
+                remote_upload(newUploads, backupDir, scp, useRemoteLocation)
+            for a in newUploads:
+                catalog.add_remote(useRemoteLocation, backupDir + '/' + a)
+            metrics.uploadSeconds = uploadTimer.show_elapsed('Upload time elapsed')
+            metrics.uploadBytes = sum(os.path.getsize(backupDir + '/' + a) for a in newUploads)
+
+    metrics.throttleSeconds = THROTTLE.show_paused(pausedBefore)
+    metrics.seconds = timer.show_total_elapsed('Backup time elapsed')
+    write_metrics(params.get('logdir'), metrics)
+    print('Finished:             ', t.get_current_time())
+    return zipPath
+
+def link_archive(sourcePath: str, zipPath: str):
+    """
+    Save an unchanged site as hard link of its archive sourcePath, or as a
+    copy if the file system does not support hard links.
+    """
+    if sourcePath == zipPath:
+        return
+    inc.delete_archive(zipPath)
+    print('Linking:', sourcePath, zipPath)
+    try:
+        os.link(sourcePath, zipPath)
+    except OSError:
+        shutil.copy2(sourcePath, zipPath)
+    digest = read_checksum(sourcePath)
+    if digest != '':
+        write_checksum(zipPath, digest)
+    if os.path.isfile(index_path(sourcePath)):
+        shutil.copyfile(index_path(sourcePath), index_path(zipPath))
+
+def copy_on_remote(params : Parameters, catalog: Catalog, siteName: str, zipPath: str) -> bool:
+    """
+    An unchanged archive is not uploaded if the remote location has an
+    archive with the same content according to the catalog. If its name
+    differs, it is copied on the remote location. Returns True if the
+    upload is not needed.
+    """
+    remoteLocation = params.get('remotelocation')
+    name = os.path.basename(zipPath)
+    digest = read_checksum(zipPath)
+    same = [e for e in catalog.entries(siteName, 'remote')
+            if e.dir == remote_key(remoteLocation) and digest != '' and e.checksum == digest]
+    if not same:
+        return False
+    if any(e.name == name for e in same):
+        print('Already uploaded:     ', name)
+        return True
+    if ret.RemoteLocation(params, catalog).copy(same[-1].name, name, zipPath):
+        print('Copied on remote:     ', same[-1].name, '->', name)
+        return True
+    return False
+
+def backup_to_chunkstore(params : Parameters, site : WebSiteData, sitedump : bool, tag: str,
+                         wwwDir: str, backupDir: str, timer: t.TimerElapsed,
+                         metrics: Metrics, pausedBefore: float = 0.0) -> str:
+    """
+    Backup into the deduplicating chunk store of the backup directory.
+    Instead of an archive a snapshot index is written, which references
+    the chunks of the web files and the SQL dump. The daily indexes are
+    rotated and retained like the archives. Returns the path of the snapshot index.
+    """
+    indexPath = cs.index_path(backupDir, site.siteName, tag)
+    oldIndexPath = cs.find_index(backupDir, site.siteName, tag)
+    longtermTag = 'none'
+    if sitedump and oldIndexPath != 'none' and not ret.is_gfs(params):
+        longtermTag = get_longterm_tag(datetime.date.today())
+    u.print_line()
+    print('Script started:       ', t.get_current_time())
+    print('Time tag:             ', tag)
+    print('Save website:         ', site.siteName)
+    print('Webpage directory:    ', wwwDir)
+    print('Included database:    ', site.dbName)
+    print('Chunk store:          ', cs.store_dir(backupDir))
+    print('Snapshot index:       ', os.path.basename(indexPath))
+    print('Longterm tag:         ', longtermTag)
+    u.is_dir_or_abort(wwwDir)
+    exclusions = get_exclusions(params, site)
+    exclusions.show()
+
+    store = cs.ChunkStore(cs.store_dir(backupDir), get_level(params, 'gzip'))
+    index = cs.SnapshotIndex(site.siteName, tag, datetime.datetime.now().isoformat())
+    index.www = cs.store_tree(store, wwwDir, cs.latest_index(backupDir, site.siteName),
+                              exclusions, get_page_cache(params))
+    metrics.tarSeconds = timer.show_elapsed('Web files time elapsed')
+    metrics.fileCount = sum(1 for e in index.www if e[1] == 'f')
+    metrics.bytesRead = store.totalBytes
+    if site.dbName != 'none':
+        defaults_file, sqlDumpCommand = get_dump_command(params, site)
+        exitcode, size, hashes = cs.store_command(store, sqlDumpCommand)
+        os.remove(defaults_file)
+        if exitcode != 0:
+            u.abort('ERROR in command:', sqlDumpCommand)
+        index.database.append([site.siteName + '.sql', size, hashes])
+        print('Stored SQL dump:      ', size, 'bytes')
+        metrics.dumpBytes = size
+        metrics.dumpSeconds = timer.show_elapsed('Dump time elapsed')
+    store.show_stats()
+    metrics.archiveBytes = store.newBytes
+
+    # keep the old index as longterm snapshot if applicable
+    if longtermTag != 'none':
+        print('Replacing:', oldIndexPath, cs.index_path(backupDir, site.siteName, longtermTag))
+        os.replace(oldIndexPath, cs.index_path(backupDir, site.siteName, longtermTag))
+    # archives with the same tag of the archive backend are replaced as well
+    for path in find_archives(backupDir, site.siteName, tag):
+        if inc.base_in_use(backupDir, site.siteName, path):
+            inc.retire_archive(site.siteName, path)
+        else:
+            print('Removing:', path)
+            inc.delete_archive(path)
+    inc.prune_retired(backupDir, site.siteName)
+    index.write(indexPath)
+    print('Index written:        ', indexPath)
+    open_catalog(params).scan_dir(location_of(params, backupDir), backupDir, site.siteName)
+    if not sitedump:
+        logFile = params.get('logdir') + '/' + site.siteName + '.txt'
+        u.append_logfile(logFile, tag + ' saved: ')
+    if params.get('remotelocation') != 'none':
+        print('Note: remote upload is not supported by the chunk store, mirror',
+              cs.store_dir(backupDir), 'instead, e.g. with rsync.')
+    metrics.throttleSeconds = THROTTLE.show_paused(pausedBefore)
+    metrics.seconds = timer.show_total_elapsed('Backup time elapsed')
+    write_metrics(params.get('logdir'), metrics)
+    print('Finished:             ', t.get_current_time())
+    return indexPath
+
+def backup_to_linkfarm(params : Parameters, site : WebSiteData, tag: str,
+                       wwwDir: str, backupDir: str, timer: t.TimerElapsed,
+                       metrics: Metrics, pausedBefore: float = 0.0) -> str:
+    """
+    Snapshot as a link farm, see wm.linkfarm: only the web files changed
+    since the latest link farm of the site are copied, the SQL dump is
+    written uncompressed alongside. Returns the path of the link farm.
+    """
+    farmDir = lf.farm_path(backupDir, site.siteName, tag)
+    previous = lf.latest_farm(backupDir, site.siteName, exclude=farmDir)
+    u.print_line()
+    print('Script started:       ', t.get_current_time())
+    print('Time tag:             ', tag)
+    print('Save website:         ', site.siteName)
+    print('Webpage directory:    ', wwwDir)
+    print('Included database:    ', site.dbName)
+    print('Link farm written:    ', farmDir)
+    print('Linked to:            ', os.path.basename(previous))
+    u.is_dir_or_abort(wwwDir)
+    exclusions = get_exclusions(params, site)
+    exclusions.show()
 
-    timer.show_total_elapsed('Backup time elapsed')
+    # built next to the link farm, which is replaced when complete
+    partDir = farmDir + '.part'
+    u.delete_dir(partDir)
+    u.ensure_dir(partDir)
+    dumpPool = ThreadPoolExecutor(max_workers=1)
+    dumpFuture = dumpPool.submit(run_dump, params, site, backupDir)
+    try:
+        stats = lf.build_farm(wwwDir, partDir, previous, exclusions, get_page_cache(params))
+        stats.show()
+        metrics.tarSeconds = timer.show_elapsed('Web files time elapsed')
+        dump = dumpFuture.result()
+        dump.write_to(partDir + '/database', site.siteName)
+        metrics.dumpBytes = dump.size
+        metrics.dumpSeconds = dump.seconds
+    except BaseException:
+        u.delete_dir(partDir)
+        raise
+    finally:
+        dumpPool.shutdown()
+    lf.write_info(partDir, site.siteName, tag, stats, previous, dump.size)
+    if params.get('wwwbanothers') == 'true':
+        u.RUNNER.do(BAN_OTHERS_SINGLE + partDir)
+    u.delete_dir(farmDir)
+    os.replace(partDir, farmDir)
+    print('Link farm written:    ', farmDir)
+    metrics.fileCount = stats.files
+    metrics.bytesRead = stats.totalBytes
+    metrics.archiveBytes = stats.copiedBytes + dump.size
+    open_catalog(params).scan_dir(location_of(params, backupDir), backupDir, site.siteName)
+    logFile = params.get('logdir') + '/' + site.siteName + '.txt'
+    u.append_logfile(logFile, tag + ' saved: ')
+    metrics.throttleSeconds = THROTTLE.show_paused(pausedBefore)
+    metrics.seconds = timer.show_total_elapsed('Backup time elapsed')
+    write_metrics(params.get('logdir'), metrics)
     print('Finished:             ', t.get_current_time())
+    return farmDir
 
+@dataclass
+class DatabaseDump:
+    """SQL dump of a site in one of the forms written by run_dump()."""
+    tempDir: str = 'none'
+    spool: SqlSpool | None = None
+    tableSpools: list[tuple[str, SqlSpool]] = field(default_factory=list[tuple[str, SqlSpool]])
+    size: int = 0
+    seconds: float = 0.0
+
+    def add_to(self, tar: tarfile.TarFile, siteName: str):
+        """Add the database members to the archive and remove the temporary files."""
+        if self.spool is not None:
+            add_directory(tar, "database")
+            self.spool.add_to(tar, "database/" + siteName + '.sql')
+            self.spool.close()
+        elif self.tableSpools:
+            add_directory(tar, "database")
+            add_directory(tar, "database/" + TABLES_DIR)
+            for arcname, tableSpool in self.tableSpools:
+                tableSpool.add_to(tar, "database/" + arcname)
+                tableSpool.close()
+        elif self.tempDir != 'none':
+            tar.add(self.tempDir, arcname="database")
+            u.delete_dir(self.tempDir)
+
+    def write_to(self, databaseDir: str, siteName: str):
+        """Write the database files to databaseDir and remove the temporary files."""
+        spools = self.tableSpools
+        if self.spool is not None:
+            spools = [(siteName + '.sql', self.spool)]
+        if spools:
+            for name, spool in spools:
+                path = databaseDir + '/' + name
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                spool.extract(path)
+                spool.close()
+        elif self.tempDir != 'none':
+            shutil.move(self.tempDir, databaseDir)
+
+def run_dump(params : Parameters, site : WebSiteData, backupDir : str) -> DatabaseDump:
+    """
+    Dump the database of a site (if there is one) as configured by
+    sqldumpjobs and sqldumpmode. Runs concurrently to the archiving of
+    the web files.
+    """
+    timer = t.TimerElapsed()
+    dump = DatabaseDump()
+    if site.dbName != 'none' and int(params.get('sqldumpjobs')) > 1:
+        dump.tableSpools = dump_tables(params, site, backupDir)
+        dump.size = sum(s.size for _, s in dump.tableSpools)
+    elif params.get('sqldumpmode') == 'stream':
+        dump.spool = spool_database(params, site, backupDir)
+        dump.size = dump.spool.size if dump.spool is not None else 0
+    else:
+        dump.tempDir = dump_database(params, site, backupDir)
+        sqlPath = dump.tempDir + '/' + site.siteName + '.sql'
+        if os.path.isfile(sqlPath):
+            dump.size = os.path.getsize(sqlPath)
+    if site.dbName != 'none':
+        dump.seconds = timer.show_elapsed('Dump time elapsed')
+    return dump
 
 def dump_database(params : Parameters, site : WebSiteData, backupDir : str) -> str:
     """
     Dump the database (if there is one) to a temp directory inside the backup directory.
     Returns the path to the temp directory with the SQL file or 'none'. 
+    The temp directory is specific to the site such that several sites
+    may be saved concurrently into the same backup directory.
     """
     tempDir = 'none'
     if site.dbName != 'none':
         # ========== Create SQL dump ===================
         # Create a temporary folder in the backup directory
-        temp = 'temp932524687'
+        temp = 'temp932524687.' + site.siteName
         tempDir = backupDir + '/' + temp
         u.make_empty_dir(tempDir)
-        # Used Linux shell commands. Full path due to cron usage.
-        mySqldump = params.get('sqldump')
-        mySqldumpOptions = params.get('sqldumpoptions')
-        # A global transaction identifier (GTID) for the SQL dump is not necessary.
         sqlFile = site.siteName  + '.sql'
-        defaults_file, db_credential = db.get_db_defaults_file(params, site)
+        defaults_file, sqlDumpCommand = get_dump_command(params, site)
         sqlFilePath = tempDir + '/' + sqlFile
-        sqlDumpCommand = (mySqldump + db_credential + ' -h ' + site.host + ' '
-                        + mySqldumpOptions + ' ' + site.dbName + ' > ' + sqlFilePath)
+        sqlDumpCommand += ' > ' + sqlFilePath
         # Note: On Linux start a new shell to be able to redirect as root user!
         # sh -c "command > file"
         if platform.system() != 'Windows':
@@ -148,6 +536,53 @@ def dump_database(params : Parameters, site : WebSiteData, backupDir : str) -> s
             u.abort(sqlFilePath + ' does not exist')
     return tempDir
 
+def spool_database(params : Parameters, site : WebSiteData, backupDir : str) -> SqlSpool | None:
+    """
+    Stream the SQL dump of the database (if there is one) into a compressed
+    spool inside the backup directory. Nothing is written uncompressed.
+    Returns the spool or None if the site has no database.
+    """
+    if site.dbName == 'none':
+        return None
+    defaults_file, sqlDumpCommand = get_dump_command(params, site)
+    spool = SqlSpool(backupDir)
+    exitcode = spool.dump(sqlDumpCommand)
+    os.remove(defaults_file)
+    if exitcode != 0:
+        spool.close()
+        u.abort('ERROR in command:', sqlDumpCommand)
+    print('Streamed SQL dump:    ', spool.size, 'bytes')
+    return spool
+
+def get_dump_command(params : Parameters, site : WebSiteData) -> tuple[str, str]:
+    """
+    Returns the path of the temporary defaults file with the database 
+    credentials and the mysqldump command writing the dump to stdout.
+    The defaults file has to be removed after running the command.
+    Of the tables excluded by the CMS profile only the schema is dumped,
+    before the other tables such that views may refer to them.
+    """
+    # Used Linux shell commands. Full path due to cron usage.
+    mySqldump = params.get('sqldump')
+    mySqldumpOptions = params.get('sqldumpoptions')
+    # A global transaction identifier (GTID) for the SQL dump is not necessary.
+    defaults_file, db_credential = db.get_db_defaults_file(params, site)
+    sqlDumpCommand = (mySqldump + db_credential + ' -h ' + site.host + ' '
+                      + mySqldumpOptions + ' ' + site.dbName)
+    exclusions = get_exclusions(params, site)
+    if exclusions.tables:
+        tables, _ = list_tables(params, site, db_credential)
+        excluded = exclusions.excluded_tables([t.name for t in tables])
+        if excluded:
+            print('Schema only:          ', ' '.join(excluded))
+            schemaCommand = (mySqldump + db_credential + ' -h ' + site.host + ' '
+                             + mySqldumpOptions + ' --no-data --skip-routines --skip-events '
+                             + site.dbName + ' ' + ' '.join(shlex.quote(t) for t in excluded))
+            sqlDumpCommand = ('(' + schemaCommand + ' && ' + sqlDumpCommand
+                              + ''.join(' --ignore-table=' + shlex.quote(site.dbName + '.' + t)
+                                        for t in excluded) + ')')
+    return defaults_file, sqlDumpCommand
+
 def get_longterm_archive(zipPath: str, siteName: str) -> str:
     """
     Will a long-term backup archive be saved? If yes, the oldest
@@ -164,7 +599,13 @@ def get_longterm_archive(zipPath: str, siteName: str) -> str:
     # Is there already an 8 days old archive?
     if not os.path.exists(zipPath):
         return 'none'
-    d = datetime.datetime.now()
+    newTag = get_longterm_tag(datetime.date.today())
+    if newTag != 'none':
+        return siteName + '.' + newTag + archive_suffix(zipPath)
+    return 'none'
+
+def get_longterm_tag(d: datetime.date) -> str:
+    """Returns the longterm tag of the archive promoted at day d or 'none'."""
     monthTag = 'm' + d.strftime("%m")
     day = d.strftime("%d")
     switcher = {
@@ -173,13 +614,18 @@ def get_longterm_archive(zipPath: str, siteName: str) -> str:
         '23': 'w2',
         '01': 'w3',
     }
-    newTag = switcher.get(day, 'none')
-    if newTag != 'none':
-        return siteName + '.' + newTag + '.tar.gz'
-    return 'none'
+    return switcher.get(day, 'none')
+
+def is_full_backup_day(d: datetime.date) -> bool:
+    """
+    With incremental backups, the daily archive of day d is a full one if
+    it will be promoted to a longterm archive a week later. Thus longterm
+    archives are self-contained and the base of the incremental archives
+    is kept when its daily slot is reused.
+    """
+    return get_longterm_tag(d + datetime.timedelta(days=7)) != 'none'
 
-def remote_upload(zipArchive: str, 
-                  longtermZipArchive: str, 
+def remote_upload(zipArchives: list[str], 
                   backupDir: str, 
                   scp: str, 
                   remoteLocation: str):
@@ -188,18 +634,27 @@ def remote_upload(zipArchive: str,
     SSL key must be present. For Hetzner's storagebox see
     https://docs.hetzner.com/de/robot/storage-box/backup-space-ssh-keys/
     It is also ossible to save to a mounted storage device.
+    zipArchives: the new archive followed by archives renamed for keeping
     """
-    print('Upload:               ', zipArchive)
-    print('Upload started:       ', t.get_current_time())
-    zipPath = backupDir + '/' + zipArchive
-    scpCommand = (scp + ' -p ' + zipPath + ' ' 
-                  + remoteLocation + '/' + zipArchive)
-    u.RUNNER.do(scpCommand)
-    if longtermZipArchive == 'none':
-      return
-    print('Upload:               ', longtermZipArchive)
-    print('Upload started:       ', t.get_current_time())
-    scpCommand = (scp + ' -p ' + backupDir + '/' + longtermZipArchive
-                  + ' ' + remoteLocation + '/' + longtermZipArchive)
-    u.RUNNER.do(scpCommand)
-    return
+    for zipArchive in zipArchives:
+        print('Upload:               ', zipArchive)
+        print('Upload started:       ', t.get_current_time())
+        scpCommand = (scp + ' -p ' + backupDir + '/' + zipArchive + ' ' 
+                      + remoteLocation + '/' + zipArchive)
+        u.RUNNER.do(scpCommand)
+
+def sftp_upload(zipArchives: list[str], backupDir: str, remoteLocation: str):
+    """
+    Upload the archives within one SFTP session, see SftpSession.
+    zipArchives: the new archive followed by archives renamed for keeping
+    """
+    session = SftpSession(remoteLocation)
+    try:
+        for zipArchive in zipArchives:
+            print('Upload:               ', zipArchive)
+            print('Upload started:       ', t.get_current_time())
+            session.upload(backupDir + '/' + zipArchive, zipArchive)
+    except Exception as e:
+        u.abort('SFTP upload to', remoteLocation, 'failed:', str(e))
+    finally:
+        session.close()
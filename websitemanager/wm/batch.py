@@ -0,0 +1,198 @@
+import datetime, os, sys, tempfile, traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+import wm.utils as u
+import wm.timeutils as t
+import wm.chunkstore as cs
+import wm.retention as ret
+from wm.backup import dumpwebsite
+from wm.upload import open_upload_queue
+from wm.catalog import open_catalog
+from wm.journal import FINISHED, Journal, resume_journal, show_journal, start_journal
+from wm.planner import plan_backups, show_plan
+from wm.autotune import Choice, show_choices, site_params, tune_plan
+from wm.websites import WebSiteData, WebSiteTable
+from wm.config import Parameters
+
+@dataclass
+class SiteResult:
+    siteName: str = "none"
+    status: str = "pending"    # done, skipped or failed
+    seconds: float = 0.0
+    archive: str = "none"
+    archiveBytes: int = 0
+    output: str = ""
+    uploads: list[str] = field(default_factory=list[str])
+
+def saveall(params: Parameters, websites: WebSiteTable, jobs: int = 1, resume: bool = False):
+    """
+    Bulk backup of all websites of the website table.
+    With jobs > 1 the sites are saved concurrently by a pool of worker
+    processes. The output of each site is collected by its worker and
+    printed as one block as soon as the site is finished, such that the
+    output of different sites is not interleaved.
+    The sites are saved longest first as predicted by the planner, a
+    summary of all sites is printed at the end.
+    A failing site is recorded and does not stop the other sites.
+    The archives are uploaded to the remote location in the background
+    while the next sites are saved, see UploadQueue.
+    The state of each site is recorded in a journal. With resume, the
+    run of the journal is continued instead of starting a new one.
+    """
+    timer = t.TimerElapsed()
+    logdir = params.get('logdir')
+    sites = [websites.getData(row) for row in range(websites.getNumWebsites())]
+    backupDir = params.get('sitedumpdir')
+    remoteLocation = params.get('remotelocation')
+    open_catalog(params)    # a new catalog is filled before the jobs use it
+    uploader = open_upload_queue(params)
+    todo = sites
+    if resume:
+        journal = resume_journal(logdir)
+        states = journal.states()
+        u.print_line()
+        print('Resuming saveall of:  ', journal.run)
+        show_journal(states)
+        todo: list[WebSiteData] = []
+        for site in sites:
+            state = states.get(site.siteName)
+            if state is not None and state.state in FINISHED:
+                continue
+            if (state is not None and state.state == 'uploading' and state.archives
+                    and all(os.path.isfile(state.backupDir + '/' + a) for a in state.archives)):
+                print('Upload queued again:  ', ' '.join(state.archives))
+                uploader.put(state.archives, state.backupDir, remoteLocation, site.siteName)
+                continue
+            todo.append(site)
+    else:
+        journal = start_journal(logdir, [site.siteName for site in sites])
+    uploader.journal = journal
+    plan = plan_backups(params, todo, jobs)
+    choices: dict[str, Choice] = {}
+    if params.get('compresslevel') == 'auto':
+        plan, choices = tune_plan(params, plan)
+        show_choices(plan, choices)
+    show_plan(params, plan)
+    byName = {site.siteName: site for site in todo}
+    ordered = [byName[e.siteName] for e in plan.estimates]
+    results: list[SiteResult] = []
+
+    def collect(result: SiteResult):
+        if result.uploads:
+            journal.record(result.siteName, 'uploading', result.uploads, backupDir)
+            uploader.put(result.uploads, backupDir, remoteLocation, result.siteName)
+        else:
+            journal.record(result.siteName, result.status)
+        results.append(result)
+
+    try:
+        if jobs <= 1:
+            for site in ordered:
+                collect(run_site(site_params(params, choices.get(site.siteName)),
+                                 site, journal))
+                uploader.show_messages()
+        else:
+            u.print_line()
+            print('Saving', len(ordered), 'websites with', jobs, 'concurrent jobs...')
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                # sites are submitted one by one, so a full upload queue
+                # also holds back the backups
+                pending: set[Future[SiteResult]] = set()
+                for site in ordered + [None]:
+                    if site is not None:
+                        pending.add(pool.submit(run_captured_site,
+                                                site_params(params, choices.get(site.siteName)),
+                                                site, journal))
+                    while pending and (len(pending) >= jobs or site is None):
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            result = future.result()
+                            print(result.output, end='', flush=True)
+                            collect(result)
+                        uploader.show_messages()
+    finally:
+        uploadsDone = uploader.wait()
+    # report in the order of the website table
+    order = {site.siteName: i for i, site in enumerate(sites)}
+    results.sort(key=lambda r: order[r.siteName])
+    show_summary(results)
+    uploader.show_summary()
+    if ret.is_gfs(params):
+        ret.apply_retention(params, [site.siteName for site in sites])
+    if params.get('backend') == 'chunkstore':
+        # after all jobs, so that no backup writes chunks meanwhile
+        cs.prune(params.get('sitedumpdir'))
+    timer.show_total_elapsed('Saveall time elapsed')
+    if any(r.status == 'failed' for r in results):
+        u.abort('saveall finished with failed websites')
+    if not uploadsDone:
+        u.abort('saveall finished with failed uploads')
+
+def run_site(params: Parameters, site: WebSiteData, journal: Journal | None = None,
+             failfast: bool = False) -> SiteResult:
+    """
+    Back up a single site and return the result of this backup.
+    If failfast is True, an aborted backup also aborts the caller.
+    """
+    result = SiteResult(siteName=site.siteName)
+    start = datetime.datetime.now()
+    try:
+        result.archive = dumpwebsite(params, site, result.uploads, journal)
+        result.status = 'skipped' if result.archive == 'none' else 'done'
+    except SystemExit:
+        # u.abort() was called for this site
+        if failfast:
+            raise
+        result.status = 'failed'
+    except Exception:
+        if failfast:
+            raise
+        traceback.print_exc()
+        result.status = 'failed'
+    result.seconds = (datetime.datetime.now() - start).total_seconds()
+    if result.archive != 'none' and os.path.isfile(result.archive):
+        result.archiveBytes = os.path.getsize(result.archive)
+    return result
+
+def run_captured_site(params: Parameters, site: WebSiteData,
+                      journal: Journal | None = None) -> SiteResult:
+    """
+    Back up a single site in a worker process. Everything written to
+    stdout and stderr, including the output of called shell commands,
+    is captured and returned within the result.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with tempfile.TemporaryFile() as capture:
+        savedOut = os.dup(1)
+        savedErr = os.dup(2)
+        os.dup2(capture.fileno(), 1)
+        os.dup2(capture.fileno(), 2)
+        try:
+            result = run_site(params, site, journal)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(savedOut, 1)
+            os.dup2(savedErr, 2)
+            os.close(savedOut)
+            os.close(savedErr)
+        capture.seek(0)
+        result.output = capture.read().decode('utf-8', errors='replace')
+    return result
+
+def show_summary(results: list[SiteResult]):
+    u.print_line()
+    print('Saveall summary:')
+    width = max([len(r.siteName) for r in results] + [len('site')])
+    print('site'.ljust(width), ' status   ', '    seconds', '      MBytes')
+    for r in results:
+        print(r.siteName.ljust(width), '', r.status.ljust(8),
+              f'{r.seconds:11.1f}', f'{r.archiveBytes / 1e6:12.1f}')
+    numDone = sum(1 for r in results if r.status == 'done')
+    numFailed = sum(1 for r in results if r.status == 'failed')
+    totalBytes = sum(r.archiveBytes for r in results)
+    print('Saved:', numDone, ' failed:', numFailed,
+          ' skipped:', len(results) - numDone - numFailed,
+          ' archive size:', f'{totalBytes / 1e6:.1f}', 'MBytes')
+    u.print_line()
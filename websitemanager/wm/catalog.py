@@ -0,0 +1,458 @@
+import contextlib, datetime, glob, hashlib, os, sqlite3, stat
+from collections.abc import Generator
+from dataclasses import dataclass
+import wm.utils as u
+import wm.chunkstore as cs
+import wm.linkfarm as lf
+from wm.archive import ArchiveReader, archive_suffix, detect_codec, read_checksum
+from wm.memberindex import member_kind, read_index
+from wm.pagecache import READ_SIZE
+from wm.config import Parameters
+
+# The catalog of all archives and chunk store indexes is an SQLite
+# database in logdir. Listing, retention and reporting query it instead
+# of globbing directories which may be slow network mounts.
+CATALOG_FILE = 'catalog.sqlite'
+# Link farm snapshots are recorded with the codec 'linkfarm' and the
+# bytes which they do not share with other link farms as size.
+# Locations of the archives: 'local' (sitedumpdir), 'snapshot'
+# (snapshotdir), 'alt' (an alternative snapshot directory entered on
+# the command line) and 'remote' (remotelocation).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    location TEXT NOT NULL,
+    dir      TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    siteName TEXT NOT NULL,
+    tag      TEXT NOT NULL,
+    mtime    REAL NOT NULL,
+    size     INTEGER NOT NULL,
+    codec    TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (location, dir, name)
+);
+CREATE INDEX IF NOT EXISTS archivesBySite ON archives (siteName, location);
+CREATE TABLE IF NOT EXISTS members (
+    location TEXT NOT NULL,
+    dir      TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    path     TEXT NOT NULL,
+    file     TEXT NOT NULL,
+    type     TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime    INTEGER NOT NULL,
+    sha256   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS membersByPath ON members (path);
+CREATE INDEX IF NOT EXISTS membersByFile ON members (file);
+CREATE INDEX IF NOT EXISTS membersByArchive ON members (location, dir, name);
+CREATE TABLE IF NOT EXISTS memberSources (
+    location TEXT NOT NULL,
+    dir      TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    mtime    REAL NOT NULL,
+    size     INTEGER NOT NULL,
+    PRIMARY KEY (location, dir, name)
+);
+"""
+# The members of the local archives, snapshot indexes and link farms are
+# listed in the table members with the path in the archive (www/... or
+# database/...), so --find and --history are answered from the catalog.
+# They are read from the member index of an archive (see wm.memberindex),
+# an archive without one, e.g. of xz or written before, is read completely.
+# memberSources notes the mtime and size of each archive when its members
+# were read, so they are only read again if it has changed. file is the last part of the path, a pattern
+# like */evil.php is looked up by it. The sha256 of the members of snapshot indexes
+# and link farms is unknown ('').
+
+@dataclass
+class Member:
+    siteName: str
+    location: str
+    name: str           # of the archive
+    tag: str
+    archiveTime: float
+    path: str
+    type: str
+    size: int
+    mtime: int
+    sha256: str
+
+@dataclass
+class Entry:
+    location: str
+    dir: str
+    name: str
+    siteName: str
+    tag: str
+    mtime: float
+    size: int
+    codec: str        # codec of an archive or 'chunkstore' for an index
+    checksum: str
+
+    @property
+    def path(self) -> str:
+        return self.dir + '/' + self.name
+
+    def dated_name(self) -> str:
+        """Name with the date of the archive as shown when choosing a restore."""
+        date = datetime.datetime.fromtimestamp(self.mtime).strftime('%Y.%m.%d')
+        return date + '(' + self.name + ')'
+
+def parse_name(name: str) -> tuple[str, str, str]:
+    """Split the file name of an archive or index into site name, tag and suffix."""
+    suffix = archive_suffix(name)
+    if suffix == '' and name.endswith(cs.INDEX_SUFFIX):
+        suffix = cs.INDEX_SUFFIX
+    if suffix == '' and name.endswith(lf.FARM_SUFFIX):
+        suffix = lf.FARM_SUFFIX
+    siteName, _, tag = name[:len(name) - len(suffix)].rpartition('.')
+    return siteName, tag, suffix
+
+def scan_entry(location: str, path: str) -> Entry | None:
+    dir, name = os.path.split(path)
+    siteName, tag, suffix = parse_name(name)
+    if suffix == '' or siteName == '' or tag == '':
+        return None
+    if suffix == cs.INDEX_SUFFIX and not dir.endswith('/' + cs.STORE_DIR + '/index'):
+        return None     # e.g. the manifest of an incremental archive
+    if suffix == lf.FARM_SUFFIX:
+        if not lf.is_complete(path):
+            return None
+        info = lf.read_info(path)
+        return Entry(location, dir, name, siteName, tag,
+                     lf.info_mtime(path),
+                     info['copiedBytes'] + info['dumpBytes'], 'linkfarm', '')
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if suffix == cs.INDEX_SUFFIX:
+        return Entry(location, dir, name, siteName, tag, st.st_mtime, st.st_size,
+                     'chunkstore', '')
+    return Entry(location, dir, name, siteName, tag, st.st_mtime, st.st_size,
+                 detect_codec(path), read_checksum(path))
+
+def read_members(e: Entry) -> list[tuple[str, str, int, int, str]]:
+    """Path, type, size, mtime and sha256 of the members of an archive, see above."""
+    if e.codec == 'chunkstore':
+        return [('www/' + rel, kind, size, mtime // 1000000000, '')
+                for rel, kind, _, mtime, size, _ in cs.read_index(e.path).www]
+    if e.codec == 'linkfarm':
+        members: list[tuple[str, str, int, int, str]] = []
+        for top in ('www', 'database'):
+            for dirpath, dirnames, filenames in os.walk(e.path + '/' + top):
+                rel = dirpath[len(e.path) + 1:]
+                for name in dirnames + filenames:
+                    st = os.stat(dirpath + '/' + name)
+                    isDir = stat.S_ISDIR(st.st_mode)
+                    members.append((rel + '/' + name, 'd' if isDir else 'f',
+                                    0 if isDir else st.st_size, int(st.st_mtime), ''))
+        return members
+    index = read_index(e.path)
+    if index is None:
+        return scan_members(e.path)
+    return [(m.name, m.type, m.size, m.mtime, m.sha256) for m in index[1]]
+
+def scan_members(path: str) -> list[tuple[str, str, int, int, str]]:
+    """The members of an archive without member index, read in one pass."""
+    members: list[tuple[str, str, int, int, str]] = []
+    try:
+        with ArchiveReader(path) as archive:
+            for info in archive.tar:
+                sha256 = ''
+                f = archive.tar.extractfile(info) if info.isreg() else None
+                if f is not None:
+                    h = hashlib.sha256()
+                    while True:
+                        block = f.read(READ_SIZE)
+                        if not block:
+                            break
+                        h.update(block)
+                    sha256 = h.hexdigest()
+                members.append((info.name, member_kind(info), info.size, int(info.mtime), sha256))
+    except Exception as e:
+        print('Skipping unreadable archive', path + ':', e)
+    return members
+
+class Catalog:
+    """
+    Catalog of the archives. Each call opens its own short connection, so
+    the catalog may be used by the concurrent jobs and upload threads.
+    """
+    def __init__(self, logdir: str):
+        u.ensure_dir(logdir)
+        self.path = logdir + '/' + CATALOG_FILE
+        self.isNew = not os.path.isfile(self.path)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self) -> Generator[sqlite3.Connection, None, None]:
+        """Connection which commits at the end of the with block and is closed."""
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def scan_dir(self, location: str, dir: str, siteName: str = '*'):
+        """
+        Replace the catalog entries of a directory, or only those of one
+        site, by the archives and chunk store indexes found there.
+        """
+        dir = os.path.abspath(dir)
+        paths: list[str] = []
+        if siteName == '*':
+            if os.path.isdir(dir):
+                paths = [e.path for e in os.scandir(dir) if e.is_file()]
+        else:
+            paths = glob.glob(glob.escape(dir + '/' + siteName) + '.*.tar*')
+        paths += cs.list_indexes(dir, siteName)
+        paths += lf.list_farms(dir, siteName)
+        entries = [e for e in (scan_entry(location, p) for p in paths) if e is not None]
+        if siteName != '*':
+            entries = [e for e in entries if e.siteName == siteName]
+        indexDir = cs.store_dir(dir) + '/index'
+        # the members of new or changed archives
+        with self.connect() as db:
+            sources = {(row[0], row[1]): (row[2], row[3]) for row in db.execute(
+                'SELECT dir, name, mtime, size FROM memberSources '
+                'WHERE location=? AND dir IN (?,?)', (location, dir, indexDir))}
+        changed = [e for e in entries if location != 'remote'
+                   and sources.get((e.dir, e.name)) != (e.mtime, e.size)]
+        members = {(e.dir, e.name): read_members(e) for e in changed}
+        with self.connect() as db:
+            for d in (dir, indexDir):
+                if siteName == '*':
+                    db.execute('DELETE FROM archives WHERE location=? AND dir=?', (location, d))
+                else:
+                    db.execute('DELETE FROM archives WHERE location=? AND dir=? AND siteName=?',
+                               (location, d, siteName))
+            db.executemany('INSERT OR REPLACE INTO archives VALUES (?,?,?,?,?,?,?,?,?)',
+                           [tuple(e.__dict__.values()) for e in entries])
+            for e in changed:
+                self.delete_members(db, location, e.dir, e.name)
+                db.executemany('INSERT INTO members VALUES (?,?,?,?,?,?,?,?,?)',
+                               [(location, e.dir, e.name, m[0], m[0].rpartition('/')[2]) + m[1:]
+                                for m in members[(e.dir, e.name)]])
+                db.execute('INSERT INTO memberSources VALUES (?,?,?,?,?)',
+                           (location, e.dir, e.name, e.mtime, e.size))
+            # archives which are gone
+            db.execute('DELETE FROM members WHERE location=? AND dir IN (?,?) AND NOT EXISTS '
+                       '(SELECT 1 FROM archives a WHERE a.location=members.location '
+                       'AND a.dir=members.dir AND a.name=members.name)', (location, dir, indexDir))
+            db.execute('DELETE FROM memberSources WHERE location=? AND dir IN (?,?) AND NOT EXISTS '
+                       '(SELECT 1 FROM archives a WHERE a.location=memberSources.location '
+                       'AND a.dir=memberSources.dir AND a.name=memberSources.name)',
+                       (location, dir, indexDir))
+
+    def delete_members(self, db: sqlite3.Connection, location: str, dir: str, name: str):
+        db.execute('DELETE FROM members WHERE location=? AND dir=? AND name=?',
+                   (location, dir, name))
+        db.execute('DELETE FROM memberSources WHERE location=? AND dir=? AND name=?',
+                   (location, dir, name))
+
+    def add(self, entry: Entry):
+        with self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO archives VALUES (?,?,?,?,?,?,?,?,?)',
+                       tuple(entry.__dict__.values()))
+
+    def add_remote(self, remoteLocation: str, localPath: str):
+        """Record the upload of the local archive localPath."""
+        entry = scan_entry('remote', localPath)
+        if entry is not None:
+            entry.dir = remote_key(remoteLocation)
+            entry.mtime = datetime.datetime.now().timestamp()
+            self.add(entry)
+
+    def rename(self, location: str, dir: str, oldName: str, newName: str):
+        siteName, tag, _ = parse_name(newName)
+        with self.connect() as db:
+            db.execute('DELETE FROM archives WHERE location=? AND dir=? AND name=?',
+                       (location, dir, newName))
+            db.execute('UPDATE archives SET name=?, siteName=?, tag=? '
+                       'WHERE location=? AND dir=? AND name=?',
+                       (newName, siteName, tag, location, dir, oldName))
+            self.delete_members(db, location, dir, newName)
+            for table in ('members', 'memberSources'):
+                db.execute('UPDATE ' + table + ' SET name=? WHERE location=? AND dir=? AND name=?',
+                           (newName, location, dir, oldName))
+
+    def delete(self, location: str, dir: str, name: str):
+        with self.connect() as db:
+            db.execute('DELETE FROM archives WHERE location=? AND dir=? AND name=?',
+                       (location, dir, name))
+            self.delete_members(db, location, dir, name)
+
+    def members(self, paths: list[str], siteName: str = 'none') -> list[Member]:
+        """
+        The members whose path matches one of the glob patterns paths,
+        ordered by path and the time of their archive.
+        """
+        query = ('SELECT a.siteName, a.location, a.name, a.tag, a.mtime, m.path, m.type, '
+                 'm.size, m.mtime, m.sha256 FROM members m JOIN archives a '
+                 'ON a.location=m.location AND a.dir=m.dir AND a.name=m.name WHERE ('
+                 + ' OR '.join(['m.path GLOB ?'] * len(paths)) + ')')
+        args = list(paths)
+        files = {p.rpartition('/')[2] for p in paths}
+        if len(files) == 1 and not any(c in '*?[' for c in next(iter(files))):
+            query += ' AND m.file=?'
+            args.append(files.pop())
+        if siteName != 'none':
+            query += ' AND a.siteName=?'
+            args.append(siteName)
+        with self.connect() as db:
+            rows = db.execute(query + ' ORDER BY m.path, a.mtime', args).fetchall()
+        return [Member(*row) for row in rows]
+
+    def entries(self, siteName: str, location: str, dir: str = '') -> list[Entry]:
+        """Entries of a site at a location, optionally only of one directory, oldest first."""
+        query = 'SELECT * FROM archives WHERE siteName=? AND location=?'
+        args: list[str] = [siteName, location]
+        if dir != '':
+            dir = os.path.abspath(dir)
+            query += ' AND dir IN (?,?)'
+            args += [dir, cs.store_dir(dir) + '/index']
+        with self.connect() as db:
+            rows = db.execute(query + ' ORDER BY mtime', args).fetchall()
+        return [Entry(*row) for row in rows]
+
+    def summary(self) -> list[tuple[str, str, int, int]]:
+        """Number and bytes of the archives per site and location."""
+        with self.connect() as db:
+            return db.execute('SELECT siteName, location, COUNT(*), SUM(size) FROM archives '
+                              'GROUP BY siteName, location ORDER BY siteName').fetchall()
+
+def remote_key(remoteLocation: str) -> str:
+    """Directory of the remote location as stored in the catalog."""
+    if os.path.isdir(remoteLocation):
+        return os.path.abspath(remoteLocation)
+    return remoteLocation
+
+def remote_dir(params: Parameters) -> str:
+    """The remote location if it is a mounted directory, else ''."""
+    remoteLocation = params.get('remotelocation')
+    if remoteLocation != 'none' and os.path.isdir(remoteLocation):
+        return remoteLocation
+    return ''
+
+def location_of(params: Parameters, backupDir: str) -> str:
+    backupDir = os.path.abspath(backupDir)
+    if backupDir == os.path.abspath(params.get('sitedumpdir')):
+        return 'local'
+    if backupDir == os.path.abspath(params.get('snapshotdir')):
+        return 'snapshot'
+    return 'alt'
+
+def reindex(catalog: Catalog, params: Parameters, altdir: str = 'none'):
+    """Rebuild the catalog by scanning the backup directories."""
+    timer = datetime.datetime.now()
+    u.print_line()
+    print('Rebuilding catalog:   ', catalog.path)
+    with catalog.connect() as db:
+        db.execute('DELETE FROM archives WHERE location != ?', ('remote',))
+        # read again if listed without members, e.g. before archives without
+        # member index were read
+        db.execute('DELETE FROM memberSources WHERE NOT EXISTS (SELECT 1 FROM members m '
+                   'WHERE m.location=memberSources.location AND m.dir=memberSources.dir '
+                   'AND m.name=memberSources.name)')
+    catalog.scan_dir('local', params.get('sitedumpdir'))
+    catalog.scan_dir('snapshot', params.get('snapshotdir'))
+    if altdir != 'none':
+        catalog.scan_dir('alt', altdir)
+    remoteDir = remote_dir(params)
+    if remoteDir != '':
+        with catalog.connect() as db:
+            db.execute('DELETE FROM archives WHERE location=?', ('remote',))
+        catalog.scan_dir('remote', remoteDir)
+    elif params.get('remotelocation') != 'none':
+        print('Remote archives are kept as recorded by the uploads,',
+              params.get('remotelocation'), 'cannot be scanned.')
+    with catalog.connect() as db:
+        # e.g. of an alternative directory which has not been scanned again
+        for table in ('members', 'memberSources'):
+            db.execute('DELETE FROM ' + table + ' WHERE NOT EXISTS (SELECT 1 FROM archives a '
+                       'WHERE a.location=' + table + '.location AND a.dir=' + table + '.dir '
+                       'AND a.name=' + table + '.name)')
+    show_summary(catalog)
+    print('Catalog time elapsed: ', (datetime.datetime.now() - timer).total_seconds(), 'sec')
+
+def show_summary(catalog: Catalog, siteName: str = 'none'):
+    """Number and size of the archives per site and location."""
+    rows = [r for r in catalog.summary() if siteName in ('none', r[0])]
+    if not rows:
+        print('No archives in the catalog.')
+        return
+    width = max([len(r[0]) for r in rows] + [len('site')])
+    print('site'.ljust(width), 'location ', 'archives', '      MBytes')
+    for name, location, count, size in rows:
+        print(name.ljust(width), location.ljust(9), f'{count:8}', f'{size / 1e6:12.1f}')
+
+def member_patterns(pattern: str) -> list[str]:
+    """Glob patterns of the member paths, www/ may be omitted."""
+    if pattern.startswith('www/') or pattern.startswith('database/'):
+        return [pattern]
+    return [pattern, 'www/' + pattern]
+
+def same_version(a: Member, b: Member) -> bool:
+    """Compares the sha256 of two members, or size and mtime if one is unknown."""
+    if a.sha256 != '' and b.sha256 != '':
+        return a.sha256 == b.sha256
+    return a.size == b.size and a.mtime == b.mtime
+
+def count_versions(members: list[Member]) -> int:
+    """Number of changes of members ordered by time plus one."""
+    return 1 + sum(1 for a, b in zip(members, members[1:]) if not same_version(a, b))
+
+def archive_date(m: Member) -> str:
+    return datetime.datetime.fromtimestamp(m.archiveTime).strftime('%Y.%m.%d')
+
+def show_find(catalog: Catalog, pattern: str, siteName: str = 'none'):
+    """The paths matching the glob pattern with the first and last archive containing them."""
+    timer = datetime.datetime.now()
+    found: dict[tuple[str, str], list[Member]] = {}
+    for m in catalog.members(member_patterns(pattern), siteName):
+        found.setdefault((m.siteName, m.path), []).append(m)
+    u.print_line()
+    for (site, path), members in found.items():
+        first = members[0]
+        last = members[-1]
+        print(site + ':', path)
+        print('    first:', archive_date(first) + '(' + first.name + ')',
+              ' last:', archive_date(last) + '(' + last.name + ')',
+              ' archives:', len(members), ' versions:', count_versions(members))
+    print('Found:', len(found), 'paths in',
+          len({(m.location, m.name) for ms in found.values() for m in ms}), 'archives')
+    print('Query time elapsed:   ', (datetime.datetime.now() - timer).total_seconds(), 'sec')
+
+def show_history(catalog: Catalog, path: str, siteName: str = 'none'):
+    """The archives containing path, oldest first, and whether it changed."""
+    timer = datetime.datetime.now()
+    members = catalog.members(member_patterns(glob.escape(path)), siteName)
+    members.sort(key=lambda m: m.archiveTime)
+    u.print_line()
+    print('History of', path + ':')
+    width = max([len(m.name) for m in members] + [0])
+    previous: dict[str, Member] = {}
+    for m in members:
+        status = ('new' if m.siteName not in previous else
+                  'same' if same_version(previous[m.siteName], m) else 'changed')
+        previous[m.siteName] = m
+        mtime = datetime.datetime.fromtimestamp(m.mtime).strftime('%Y-%m-%d %H:%M')
+        print(archive_date(m), m.siteName, m.location.ljust(8), m.name.ljust(width), f'{m.size:12}',
+              mtime, m.sha256[:12].ljust(12), status)
+    if not members:
+        print('Not found in the catalog.')
+    print('Incremental archives only contain the files changed since their base.')
+    print('Query time elapsed:   ', (datetime.datetime.now() - timer).total_seconds(), 'sec')
+
+def open_catalog(params: Parameters) -> Catalog:
+    """Open the catalog in logdir. A new catalog is filled by scanning."""
+    catalog = Catalog(params.get('logdir'))
+    if catalog.isNew:
+        reindex(catalog, params)
+    return catalog
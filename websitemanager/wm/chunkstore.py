@@ -0,0 +1,304 @@
+import datetime, glob, hashlib, json, os, stat, subprocess, tempfile, time, zlib
+from dataclasses import dataclass, field
+from typing import IO, Any, Iterator
+import wm.utils as u
+from wm.exclusions import Exclusions
+from wm.pagecache import READ_SIZE, DroppingReader, PageCache
+from wm.throttle import THROTTLE
+
+# The chunk store is a directory inside the backup directory. It is shared
+# by all sites and days: chunks/ab/ab12... holds the chunks named by their
+# sha256, index/siteName.tag.json the snapshot index of each backup.
+STORE_DIR = 'chunkstore'
+INDEX_SUFFIX = '.json'
+# Content-defined chunking: files and SQL dumps are split at line ends.
+# A line ends a chunk if its crc32 is below a threshold proportional to
+# the line length, thus on average CHUNK_AVG bytes after CHUNK_MIN bytes.
+# Since the boundaries only depend on the content, an inserted row of a
+# SQL dump only changes the chunk it falls into. Lines are read in pieces
+# of at most LINE_MAX bytes to cope with binary files.
+CHUNK_MIN = 256 * 1024
+CHUNK_AVG = 512 * 1024
+CHUNK_MAX = 4 * 1024 * 1024
+LINE_MAX = 64 * 1024
+# First byte of a stored chunk: zlib compressed or raw (incompressible).
+ZLIB_CHUNK = b'z'
+RAW_CHUNK = b'r'
+# Chunks written or reused within the last PRUNE_GRACE seconds are never
+# pruned, so a backup running concurrently with prune cannot lose the
+# chunks of its snapshot index before the index is written.
+PRUNE_GRACE = 3600
+
+def split_chunks(f: 'DroppingReader | IO[bytes]') -> Iterator[bytes]:
+    """Split the content of the binary stream f into content-defined chunks."""
+    threshold = 2**32 // CHUNK_AVG
+    chunk = bytearray()
+    while True:
+        line = f.readline(LINE_MAX)
+        if not line:
+            break
+        chunk += line
+        if (len(chunk) >= CHUNK_MAX or (len(chunk) >= CHUNK_MIN
+                and zlib.crc32(line) < len(line) * threshold)):
+            yield bytes(chunk)
+            chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+class ChunkStore:
+    """
+    Content-addressed store of zlib compressed chunks. A chunk which is
+    already present is not written again. Chunks are written to a temp
+    file first and renamed, so concurrent backups may share the store.
+    """
+    def __init__(self, storeDir: str, level: int = 5):
+        self.dir = storeDir
+        self.level = max(1, min(level, 9))
+        self.totalBytes = 0     # bytes of all chunks passed to put()
+        self.newChunks = 0
+        self.newBytes = 0       # bytes written to the store
+        self.reusedChunks = 0
+        u.ensure_dir(self.dir + '/chunks')
+        u.ensure_dir(self.dir + '/index')
+
+    def chunk_path(self, hash: str) -> str:
+        return self.dir + '/chunks/' + hash[:2] + '/' + hash
+
+    def put(self, chunk: bytes) -> str:
+        """Store a chunk if it is not present yet. Returns its hash."""
+        THROTTLE.wait()
+        hash = hashlib.sha256(chunk).hexdigest()
+        path = self.chunk_path(hash)
+        self.totalBytes += len(chunk)
+        if self.touch(hash):
+            self.reusedChunks += 1
+            return hash
+        data = zlib.compress(chunk, self.level)
+        if len(data) < len(chunk):
+            data = ZLIB_CHUNK + data
+        else:
+            data = RAW_CHUNK + chunk
+        chunkDir = os.path.dirname(path)
+        os.makedirs(chunkDir, 0o700, exist_ok=True)
+        fd, tempPath = tempfile.mkstemp(dir=chunkDir, prefix='tmp.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tempPath, path)
+        self.newChunks += 1
+        self.newBytes += len(data)
+        return hash
+
+    def touch(self, hash: str) -> bool:
+        """Protect a present chunk from prune() for PRUNE_GRACE. False if it is missing."""
+        try:
+            os.utime(self.chunk_path(hash))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_stream(self, f: 'DroppingReader | IO[bytes]') -> tuple[int, list[str]]:
+        """Store the content of f. Returns its size and chunk hashes."""
+        size = 0
+        hashes: list[str] = []
+        for chunk in split_chunks(f):
+            size += len(chunk)
+            hashes.append(self.put(chunk))
+        return size, hashes
+
+    def get(self, hash: str) -> bytes:
+        path = self.chunk_path(hash)
+        if not os.path.isfile(path):
+            u.abort('chunk', hash, 'is missing in', self.dir)
+        with open(path, 'rb') as f:
+            data = f.read()
+        chunk = zlib.decompress(data[1:]) if data[:1] == ZLIB_CHUNK else data[1:]
+        if hashlib.sha256(chunk).hexdigest() != hash:
+            u.abort('chunk', path, 'is corrupt')
+        return chunk
+
+    def show_stats(self):
+        print('Chunk store data:     ', self.totalBytes, 'bytes')
+        print('Chunks written:       ', self.newChunks, '(' + str(self.newBytes), 'bytes)')
+        print('Chunks reused:        ', self.reusedChunks)
+
+@dataclass
+class SnapshotIndex:
+    """
+    Everything needed to rebuild the backup of a site from the chunk store.
+    www entries: [path, kind 'd' or 'f', mode, mtime in ns, size, hashes]
+    database entries: [file name, size, hashes]
+    """
+    siteName: str = ''
+    tag: str = ''
+    created: str = ''
+    www: list[list[Any]] = field(default_factory=list[list[Any]])
+    database: list[list[Any]] = field(default_factory=list[list[Any]])
+
+    def write(self, path: str):
+        fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.__dict__, f, separators=(',', ':'))
+        os.replace(tempPath, path)
+
+    def hashes(self) -> Iterator[str]:
+        for entry in self.www:
+            yield from entry[5]
+        for entry in self.database:
+            yield from entry[2]
+
+def read_index(path: str) -> SnapshotIndex:
+    with open(path, 'r', encoding='utf-8') as f:
+        return SnapshotIndex(**json.load(f))
+
+def store_dir(backupDir: str) -> str:
+    return backupDir + '/' + STORE_DIR
+
+def index_path(backupDir: str, siteName: str, tag: str) -> str:
+    return store_dir(backupDir) + '/index/' + siteName + '.' + tag + INDEX_SUFFIX
+
+def find_index(backupDir: str, siteName: str, tag: str) -> str:
+    """Returns the path of the snapshot index of siteName with tag or 'none'."""
+    path = index_path(backupDir, siteName, tag)
+    return path if os.path.isfile(path) else 'none'
+
+def list_indexes(backupDir: str, siteName: str = '*') -> list[str]:
+    """Returns the paths of the snapshot indexes of siteName, of all sites with '*'."""
+    pattern = glob.escape(store_dir(backupDir) + '/index/')
+    if siteName != '*':
+        pattern += glob.escape(siteName + '.')
+    return glob.glob(pattern + '*' + INDEX_SUFFIX)
+
+def latest_index(backupDir: str, siteName: str) -> SnapshotIndex | None:
+    latest = None
+    for path in list_indexes(backupDir, siteName):
+        index = read_index(path)
+        if index.siteName == siteName and (latest is None or index.created > latest.created):
+            latest = index
+    return latest
+
+def store_tree(store: ChunkStore, wwwDir: str, previous: SnapshotIndex | None,
+               exclusions: Exclusions | None = None,
+               pageCache: PageCache = PageCache()) -> list[list[Any]]:
+    """
+    Store the web files. Like the archives, symbolic links are followed.
+    Files whose size and mtime did not change since the previous snapshot
+    index are not read again, their chunks are taken from the index.
+    """
+    known: dict[str, list[Any]] = {}
+    if previous is not None:
+        known = {e[0]: e for e in previous.www if e[1] == 'f'}
+    entries: list[list[Any]] = []
+    for dirpath, dirnames, filenames in os.walk(wwwDir, followlinks=True):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, wwwDir).replace(os.sep, '/')
+        st = os.stat(dirpath)
+        entries.append([rel, 'd', stat.S_IMODE(st.st_mode), st.st_mtime_ns, 0, []])
+        if rel != '.' and exclusions is not None and exclusions.skips_contents(rel):
+            dirnames[:] = []
+            continue
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            relPath = name if rel == '.' else rel + '/' + name
+            if exclusions is not None and exclusions.skips(relPath, False):
+                continue
+            try:
+                st = os.stat(path)
+                old = known.get(relPath)
+                if (old and old[4] == st.st_size and old[3] == st.st_mtime_ns
+                        and all([store.touch(hash) for hash in old[5]])):
+                    hashes = old[5]
+                    store.totalBytes += st.st_size
+                    store.reusedChunks += len(hashes)
+                else:
+                    with open(path, 'rb', buffering=READ_SIZE) as f:
+                        reader = pageCache.reader(f, st.st_size)
+                        _, hashes = store.put_stream(reader)
+                        if isinstance(reader, DroppingReader):
+                            reader.finish()
+            except OSError:
+                print('Skipping unreadable file', path)
+                continue
+            entries.append([relPath, 'f', stat.S_IMODE(st.st_mode),
+                            st.st_mtime_ns, st.st_size, hashes])
+    return entries
+
+def store_command(store: ChunkStore, command: str) -> tuple[int, int, list[str]]:
+    """
+    Run a command, e.g. mysqldump, and store its stdout.
+    Returns the exit code, the size of the output and its chunk hashes.
+    """
+    u.RUNNER.show(command)
+    if 'simulate' in u.RUNNER.options:
+        return 0, 0, []
+    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    assert proc.stdout is not None
+    size, hashes = store.put_stream(proc.stdout)
+    return proc.wait(), size, hashes
+
+def restore_index(backupDir: str, indexPath: str, tempDir: str):
+    """Rebuild the www and database directories of a snapshot index in tempDir."""
+    store = ChunkStore(store_dir(backupDir))
+    index = read_index(indexPath)
+    print('Restoring from chunk store:', indexPath)
+    for rel, kind, mode, mtime, size, hashes in index.www:
+        path = tempDir + '/www' + ('' if rel == '.' else '/' + rel)
+        if kind == 'd':
+            os.makedirs(path, exist_ok=True)
+            continue
+        with open(path, 'wb') as f:
+            for hash in hashes:
+                f.write(store.get(hash))
+        if os.path.getsize(path) != size:
+            u.abort('size mismatch of restored file', path)
+        os.chmod(path, mode)
+        os.utime(path, ns=(mtime, mtime))
+    # directories last, writing files changes their mtime
+    for rel, kind, mode, mtime, size, hashes in reversed(index.www):
+        if kind == 'd':
+            path = tempDir + '/www' + ('' if rel == '.' else '/' + rel)
+            os.chmod(path, mode | stat.S_IRWXU)
+            os.utime(path, ns=(mtime, mtime))
+    if index.database:
+        os.makedirs(tempDir + '/database', exist_ok=True)
+    for name, size, hashes in index.database:
+        with open(tempDir + '/database/' + name, 'wb') as f:
+            for hash in hashes:
+                f.write(store.get(hash))
+
+def prune(backupDir: str):
+    """
+    Mark and sweep: delete all chunks which are not referenced by any
+    snapshot index. Indexes are overwritten and renamed by the rotation of
+    the backups, so the chunks follow the retention of the archives.
+    """
+    storeDir = store_dir(backupDir)
+    if not os.path.isdir(storeDir + '/chunks'):
+        return
+    timer = datetime.datetime.now()
+    referenced: set[str] = set()
+    indexes = list_indexes(backupDir)
+    for path in indexes:
+        referenced.update(read_index(path).hashes())
+    limit = time.time() - PRUNE_GRACE
+    numKept = 0
+    numDeleted = 0
+    deletedBytes = 0
+    for subdir in os.scandir(storeDir + '/chunks'):
+        if not subdir.is_dir():
+            continue
+        for entry in os.scandir(subdir.path):
+            if entry.name in referenced:
+                numKept += 1
+                continue
+            st = entry.stat()
+            if st.st_mtime > limit:
+                continue
+            os.remove(entry.path)
+            numDeleted += 1
+            deletedBytes += st.st_size
+    u.print_line()
+    print('Pruned chunk store:   ', storeDir)
+    print('Snapshot indexes:     ', len(indexes))
+    print('Chunks kept:          ', numKept)
+    print('Chunks deleted:       ', numDeleted, '(' + str(deletedBytes), 'bytes)')
+    print('Prune time elapsed:   ', (datetime.datetime.now() - timer).total_seconds(), 'sec')
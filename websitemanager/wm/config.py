@@ -16,17 +16,54 @@ class Parameters:
                        'sqlmainuser', 'sqlmainpw', 'sitedumpdir', 'snapshotdir', 
                        'logdir', 'wwwroot', 'wwwusergroup', 'wwwbanothers', 
                        'remotelocation']
+        # Optional parameters and their default values if they are missing.
+        self.optionalParams: dict[str, str] = {
+            'sqldumpmode': 'tempdir',
+            'sqldumpjobs': '1',
+            'sqlchunksize': '256',
+            'sqlchunkthreshold': '1024',
+            'sqlreuse': 'false',
+            'cmsexclusions': 'false',
+            'compression': 'gzip',
+            'compresslevel': '5',
+            'compressthreads': '0',
+            'autotunecodecs': 'none',
+            'archiveindex': 'true',
+            'storecompressed': 'false',
+            'pagecache': 'drop',
+            'pagecachelimit': '64',
+            'incremental': 'false',
+            'skipunchanged': 'false',
+            'backend': 'archive',
+            'snapshotformat': 'archive',
+            'backupwindow': '0',
+            'retention': 'legacy',
+            'keepdaily': '7',
+            'keepweekly': '4',
+            'keepmonthly': '12',
+            'keepyearly': '3',
+            'nice': '0',
+            'ionice': 'none',
+            'throttlepressure': '0',
+            'throttleload': '0',
+            'throttlemaxpause': '60',
+            'ssh': '/usr/bin/ssh',
+            'uploadjobs': '1',
+            'uploadqueue': '4',
+            'uploadretries': '2',
+            'uploader': 'scp',
+        }
         self.checkParams()
 
     def show(self):
         print_line()
         print('content of parameter table "' + self.config_file + '":')
         maxParamLength = 0
-        for p in self.params:
+        for p in self.params + list(self.optionalParams):
             maxParamLength = max(maxParamLength, len(p))
         indent = (maxParamLength + 3) * ' '
-        for p in self.params:
-            v = self.config.get(self.section, p)
+        for p in self.params + list(self.optionalParams):
+            v = self.get(p)
             line = p.ljust(maxParamLength) + ' = ' + "'" + v + "'"
             wrappedLine = textwrap.fill(line, WRAP_LENGTH, subsequent_indent=indent)
             print(wrappedLine)
@@ -43,5 +80,11 @@ class Parameters:
            
     def get(self, param: str) -> str:
         if not self.config.has_option(self.section, param):
+            if param in self.optionalParams:
+                return self.optionalParams[param]
             abort('===> param', param, 'missing in index')
         return self.config.get(self.section, param)
+
+    def set(self, param: str, value: str):
+        """Override a parameter, e.g. for the backup of a single site."""
+        self.config.set(self.section, param, value)
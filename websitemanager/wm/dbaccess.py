@@ -107,6 +107,11 @@ CMS_DICT : dict[str, Union[Joomla, Wordpress, Mediawiki]] =  {
     "mediawiki": MEDIAWIKI
     }
 
+def detect_cms(site: WebSiteData, cmsList: list[str] = CMS_LIST) -> list[str]:
+    """CMS types of cmsList mentioned in the comment of the website table."""
+    siteComment = site.comment.lower()
+    return [cms for cms in cmsList if cms in siteComment]
+
 def get_config_cms(
     params: Parameters, 
     site: WebSiteData, opt: Options,
@@ -118,8 +123,7 @@ def get_config_cms(
         site.show("Treated Website")
     elif opt.verbose == 1:
         print(f"Treating website '{site.siteName}' ...")
-    siteComment = site.comment.lower()
-    found = [cms for cms in CMS_LIST if cms in siteComment]
+    found = detect_cms(site)
     if len(found) == 0:
         return (False, "no config due to unknown_cms", "none")
     elif len(found) > 1:
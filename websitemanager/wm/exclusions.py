@@ -0,0 +1,99 @@
+import fnmatch, tarfile
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from wm.dbaccess import detect_cms
+from wm.websites import WebSiteData
+from wm.config import Parameters
+
+# Data which the CMS regenerates by itself and which is not backed up if
+# the profile of the CMS is enabled by cmsexclusions or the column exclude
+# of the website table. Paths are glob patterns relative to the web directory: the contents of
+# a matching directory are skipped, the empty directory is kept. Table
+# patterns match the table names including a table prefix, only the
+# schema of matching tables is dumped.
+
+@dataclass
+class Exclusions:
+    profile: str = 'none'
+    paths: list[str] = field(default_factory=list[str])
+    tables: list[str] = field(default_factory=list[str])
+
+    def skips_contents(self, rel: str) -> bool:
+        """Is the content of the directory rel skipped?"""
+        return any(fnmatch.fnmatchcase(rel, p) for p in self.paths)
+
+    def skips(self, rel: str, isDir: bool) -> bool:
+        """Is the file or directory rel skipped, e.g. as part of a skipped directory?"""
+        parts = rel.split('/')
+        for i in range(1, len(parts)):
+            if self.skips_contents('/'.join(parts[:i])):
+                return True
+        return not isDir and self.skips_contents(rel)
+
+    def tar_filter(self, filter: Callable[[tarfile.TarInfo], tarfile.TarInfo | None] | None = None
+                   ) -> Callable[[tarfile.TarInfo], tarfile.TarInfo | None]:
+        """Tar filter for members below www which applies filter to the members not skipped."""
+        def exclude(info: tarfile.TarInfo) -> tarfile.TarInfo | None:
+            if info.name.startswith('www/') and self.skips(info.name[4:], info.isdir()):
+                return None
+            return filter(info) if filter is not None else info
+        return exclude
+
+    def excluded_tables(self, tableNames: list[str]) -> list[str]:
+        return [t for t in tableNames if any(fnmatch.fnmatchcase(t, p) for p in self.tables)]
+
+    def show(self):
+        if self.paths or self.tables:
+            print('Exclusions:           ', self.profile, 'profile,', ' '.join(self.paths),
+                  ' '.join('table:' + t for t in self.tables))
+
+PROFILES: dict[str, Exclusions] = {
+    'wordpress': Exclusions('wordpress', ['wp-content/cache', 'wp-content/upgrade']),
+    'mediawiki': Exclusions('mediawiki', ['images/thumb', 'images/tmp', 'cache'],
+                            ['*objectcache', '*l10n_cache', '*querycache', '*querycachetwo']),
+    'joomla':    Exclusions('joomla', ['cache', 'administrator/cache', 'tmp'],
+                            ['*_session']),
+    'drupal':    Exclusions('drupal', ['sites/*/files/css', 'sites/*/files/js',
+                                       'sites/*/files/php'],
+                            ['cache', 'cache_*', '*_cache', '*_cache_*', 'sessions', '*_sessions']),
+}
+
+def get_exclusions(params: Parameters, site: WebSiteData) -> Exclusions:
+    """
+    Exclusions of a website, changed by the optional column exclude of the
+    website table. exclude is 'none' (the profile of its CMS, detected like
+    wm.dbaccess does, if cmsexclusions = true), 'off' (nothing is excluded)
+    or a comma separated list of path and table:<table> patterns which are
+    added, or removed if they start with '!'. The item 'profile' of the
+    list enables the profile of the CMS for this site.
+    """
+    if site.exclude == 'off':
+        return Exclusions()
+    items = site.exclude.split(',') if site.exclude != 'none' else []
+    exclusions = Exclusions()
+    if params.get('cmsexclusions') == 'true' or 'profile' in items:
+        found = detect_cms(site, list(PROFILES))
+        if len(found) == 1:
+            profile = PROFILES[found[0]]
+            exclusions = Exclusions(profile.profile, list(profile.paths), list(profile.tables))
+    if not items:
+        return exclusions
+    for item in items:
+        if item == 'profile':
+            continue
+        remove = item.startswith('!')
+        item = item.lstrip('!')
+        patterns = exclusions.paths
+        if item.startswith('table:'):
+            item = item[len('table:'):]
+            remove = remove or item.startswith('!')
+            item = item.lstrip('!')
+            patterns = exclusions.tables
+        if remove:
+            if item in patterns:
+                patterns.remove(item)
+        elif item != '' and item not in patterns:
+            patterns.append(item)
+    if exclusions.profile == 'none':
+        exclusions.profile = 'site'
+    return exclusions
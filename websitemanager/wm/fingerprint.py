@@ -0,0 +1,120 @@
+import hashlib, os
+import wm.dbutils as db
+from wm.archive import archive_suffix, fingerprint_path
+from wm.catalog import Catalog
+from wm.config import Parameters
+from wm.exclusions import Exclusions
+from wm.tabledump import run_query, table_states
+from wm.websites import WebSiteData
+
+# The fingerprint of a site summarises everything an archive of the site
+# depends on: the path, size, mtime, mode and owner of the web files, the
+# state of the database tables and schema objects and the options which
+# change the archive. It is stored next to each daily archive
+# (siteName.tag.tar.gz.fingerprint). Computing it only reads metadata.
+
+# Options of the configuration which change the content of an archive.
+ARCHIVE_OPTIONS = ['compression', 'compresslevel', 'archiveindex', 'storecompressed',
+                   'sqldumpoptions', 'sqldumpmode', 'sqldumpjobs', 'sqlchunksize',
+                   'sqlchunkthreshold']
+
+def tree_digest(wwwDir: str, exclusions: Exclusions) -> str:
+    """Digest of the metadata of the web files. Like the archive, links are followed."""
+    h = hashlib.sha256()
+
+    def scan(dir: str, rel: str):
+        with os.scandir(dir) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for e in entries:
+            relPath = e.name if rel == '' else rel + '/' + e.name
+            try:
+                st = e.stat()
+                isDir = e.is_dir()
+            except OSError:
+                h.update(('x ' + relPath + '\n').encode('utf-8', 'surrogateescape'))
+                continue
+            if exclusions.skips(relPath, isDir):
+                continue
+            line = ' '.join([relPath, str(st.st_mode), str(st.st_uid), str(st.st_gid)])
+            if isDir:
+                h.update(('d ' + line + '\n').encode('utf-8', 'surrogateescape'))
+                if not exclusions.skips_contents(relPath):
+                    scan(e.path, relPath)
+            else:
+                h.update(('f ' + line + ' ' + str(st.st_size) + ' ' + str(st.st_mtime_ns)
+                          + '\n').encode('utf-8', 'surrogateescape'))
+
+    scan(wwwDir, '')
+    return h.hexdigest()
+
+def database_digest(params: Parameters, site: WebSiteData, exclusions: Exclusions) -> str:
+    """
+    Digest of the state of the database, see tabledump.table_states(), or
+    '' if the state of a table is unknown, e.g. since it has just been
+    changed. The data of excluded tables does not count.
+    """
+    if site.dbName == 'none':
+        return 'none'
+    defaults_file, credential = db.get_db_defaults_file(params, site)
+    try:
+        names = [row[0] for row in run_query(params, site, credential,
+                 'SELECT TABLE_NAME FROM information_schema.TABLES '
+                 'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = \'BASE TABLE\'')]
+        states = table_states(params, site, credential)
+        excluded = exclusions.excluded_tables(names)
+        if any(n not in states and n not in excluded for n in names):
+            return ''
+        objects = run_query(params, site, credential,
+            'SELECT \'routine\', ROUTINE_NAME, LAST_ALTERED FROM information_schema.ROUTINES '
+            'WHERE ROUTINE_SCHEMA = DATABASE() '
+            'UNION ALL SELECT \'trigger\', TRIGGER_NAME, CREATED FROM information_schema.TRIGGERS '
+            'WHERE TRIGGER_SCHEMA = DATABASE() '
+            'UNION ALL SELECT \'event\', EVENT_NAME, LAST_ALTERED FROM information_schema.EVENTS '
+            'WHERE EVENT_SCHEMA = DATABASE() '
+            'UNION ALL SELECT \'view\', TABLE_NAME, MD5(VIEW_DEFINITION) FROM information_schema.VIEWS '
+            'WHERE TABLE_SCHEMA = DATABASE()')
+    finally:
+        os.remove(defaults_file)
+    h = hashlib.sha256()
+    for name in sorted(names):
+        state = 'excluded' if name in excluded else states[name]
+        h.update(('t ' + name + ' ' + state + '\n').encode('utf-8'))
+    for row in sorted(objects):
+        h.update(('o ' + ' '.join(row) + '\n').encode('utf-8'))
+    return h.hexdigest()
+
+def site_fingerprint(params: Parameters, site: WebSiteData, wwwDir: str,
+                     exclusions: Exclusions) -> str:
+    """Fingerprint of a site or '' if it cannot be determined."""
+    dbDigest = database_digest(params, site, exclusions)
+    if dbDigest == '':
+        return ''
+    h = hashlib.sha256()
+    for option in ARCHIVE_OPTIONS:
+        h.update((option + '=' + params.get(option) + '\n').encode('utf-8'))
+    h.update((repr(site) + '\n' + repr(exclusions) + '\n').encode('utf-8'))
+    h.update(('www ' + tree_digest(wwwDir, exclusions) + '\n').encode('utf-8'))
+    h.update(('db ' + dbDigest + '\n').encode('utf-8'))
+    return h.hexdigest()
+
+def read_fingerprint(archivePath: str) -> str:
+    path = fingerprint_path(archivePath)
+    if not os.path.isfile(path):
+        return ''
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def write_fingerprint(archivePath: str, fingerprint: str):
+    with open(fingerprint_path(archivePath), 'w', encoding='utf-8') as f:
+        f.write(fingerprint + '\n')
+
+def find_unchanged(catalog: Catalog, backupDir: str, siteName: str, suffix: str,
+                   fingerprint: str) -> str:
+    """The newest archive of a site with the given fingerprint or 'none'."""
+    if fingerprint == '':
+        return 'none'
+    for e in reversed(catalog.entries(siteName, 'local', backupDir)):
+        if (e.codec != 'chunkstore' and archive_suffix(e.name) == suffix
+                and os.path.isfile(e.path) and read_fingerprint(e.path) == fingerprint):
+            return e.path
+    return 'none'
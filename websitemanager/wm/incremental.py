@@ -0,0 +1,322 @@
+import datetime, glob, hashlib, io, json, os, re, shutil, tarfile
+from dataclasses import dataclass, field
+from collections.abc import Callable
+from typing import Any
+import wm.utils as u
+from wm.exclusions import Exclusions
+from wm.archive import ARCHIVE_SUFFIXES, ArchiveReader, archive_suffix, list_archives
+from wm.archive import checksum_path, fingerprint_path, read_checksum, write_checksum
+from wm.memberindex import index_path
+
+# Name of the archive member with the backup metadata. It is the first
+# member of each archive written with incremental backups enabled.
+INFO_MEMBER = 'backup.json'
+MANIFEST_SUFFIX = '.manifest.json'
+# A full archive whose daily slot is overwritten while it is still the
+# base of younger incremental archives is kept with tag r<YYYYMMDD>.
+RETIRED_PREFIX = 'r'
+
+@dataclass
+class Entry:
+    kind: str            # 'f' file or 'd' directory
+    size: int = 0
+    mtime: int = 0       # st_mtime_ns
+    hash: str = ''       # sha256 of files
+
+@dataclass
+class Manifest:
+    """
+    State of the web files of a site when an archive was written.
+    Stored next to the archive as siteName.tag.manifest.json. The first
+    line holds the header, each further line one entry of the web files.
+    """
+    id: str = ''
+    siteName: str = ''
+    created: str = ''
+    level: str = 'full'  # 'full' or 'incremental'
+    base: str = ''       # id of the full archive an incremental builds on
+    entries: dict[str, Entry] = field(default_factory=dict[str, Entry])
+
+    def header(self) -> dict[str, Any]:
+        return {'id': self.id, 'siteName': self.siteName, 'created': self.created,
+                'level': self.level, 'base': self.base}
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.header()) + '\n')
+            for rel, e in self.entries.items():
+                f.write(json.dumps([e.kind, rel, e.size, e.mtime, e.hash]) + '\n')
+
+def read_manifest(path: str, headerOnly: bool = False) -> Manifest:
+    with open(path, 'r', encoding='utf-8') as f:
+        m = Manifest(**json.loads(f.readline()))
+        if not headerOnly:
+            for line in f:
+                kind, rel, size, mtime, hash = json.loads(line)
+                m.entries[rel] = Entry(kind, size, mtime, hash)
+    return m
+
+def manifest_path(archivePath: str) -> str:
+    """Path of the manifest belonging to an archive."""
+    return archivePath[:len(archivePath) - len(archive_suffix(archivePath))] + MANIFEST_SUFFIX
+
+def find_manifests(backupDir: str, siteName: str) -> list[str]:
+    return glob.glob(glob.escape(backupDir) + '/' + glob.escape(siteName) + '.*' + MANIFEST_SUFFIX)
+
+def manifest_archive(mPath: str) -> str:
+    """Path of the archive belonging to a manifest or 'none'."""
+    prefix = mPath[:len(mPath) - len(MANIFEST_SUFFIX)]
+    for suffix in ARCHIVE_SUFFIXES:
+        if os.path.isfile(prefix + suffix):
+            return prefix + suffix
+    return 'none'
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def scan_tree(wwwDir: str, previous: dict[str, Entry],
+              exclusions: Exclusions | None = None) -> dict[str, Entry]:
+    """
+    Scan the web files. Like the archive, symbolic links are followed.
+    Files whose size and mtime did not change keep the hash of the
+    previous manifest, all other files are hashed.
+    """
+    entries: dict[str, Entry] = {}
+    for dirpath, dirnames, filenames in os.walk(wwwDir, followlinks=True):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, wwwDir)
+        if rel != '.':
+            entries[rel] = Entry('d')
+            if exclusions is not None and exclusions.skips_contents(rel):
+                dirnames[:] = []
+                continue
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            relPath = name if rel == '.' else rel + '/' + name
+            if exclusions is not None and exclusions.skips(relPath, False):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                print('Skipping unreadable file', path)
+                continue
+            old = previous.get(relPath)
+            if old and old.kind == 'f' and old.size == st.st_size and old.mtime == st.st_mtime_ns:
+                entries[relPath] = old
+            else:
+                entries[relPath] = Entry('f', st.st_size, st.st_mtime_ns, hash_file(path))
+    return entries
+
+@dataclass
+class IncrementPlan:
+    manifest: Manifest
+    changed: list[str] = field(default_factory=list[str])
+    deleted: list[str] = field(default_factory=list[str])
+
+    def info(self) -> bytes:
+        info = self.manifest.header()
+        info['deleted'] = self.deleted
+        return json.dumps(info, indent=1).encode('utf-8')
+
+def latest_full_manifest(backupDir: str, siteName: str, skipTag: str) -> str:
+    """Returns the manifest path of the newest full archive or 'none'."""
+    latest = 'none'
+    latestCreated = ''
+    for path in find_manifests(backupDir, siteName):
+        if path.endswith('.' + skipTag + MANIFEST_SUFFIX):
+            continue
+        m = read_manifest(path, headerOnly=True)
+        if m.level == 'full' and m.created > latestCreated:
+            latest, latestCreated = path, m.created
+    return latest
+
+def plan_backup(backupDir: str, siteName: str, tag: str, wwwDir: str, full: bool,
+                exclusions: Exclusions | None = None) -> IncrementPlan:
+    """
+    Decide whether a full or an incremental archive is written and which
+    files it has to contain. An incremental archive contains the files
+    which are new or changed since the newest full archive, and the list
+    of deleted files. The daily archive with the same tag is about to be
+    overwritten and therefore is no base candidate.
+    """
+    now = datetime.datetime.now()
+    m = Manifest(id=siteName + '.' + now.strftime('%Y-%m-%d_%H-%M-%S.%f'),
+                 siteName=siteName, created=now.isoformat())
+    basePath = 'none'
+    if not full:
+        basePath = latest_full_manifest(backupDir, siteName, tag)
+    base = Manifest()
+    if basePath != 'none':
+        base = read_manifest(basePath)
+    m.entries = scan_tree(wwwDir, base.entries, exclusions)
+    plan = IncrementPlan(m)
+    if basePath == 'none':
+        return plan
+    m.level = 'incremental'
+    m.base = base.id
+    for rel, e in m.entries.items():
+        old = base.entries.get(rel)
+        if old is None or old.kind != e.kind or old.hash != e.hash:
+            plan.changed.append(rel)
+            # a file replaced by a directory or vice versa is removed first
+            if old is not None and old.kind != e.kind:
+                plan.deleted.append(rel)
+    plan.deleted += [rel for rel in base.entries if rel not in m.entries]
+    print('Incremental archive:  ', len(plan.changed), 'new or changed,',
+          len(plan.deleted), 'deleted entries since', base.id)
+    return plan
+
+def add_info(tar: tarfile.TarFile, plan: IncrementPlan):
+    """Add the backup metadata as first member of the archive."""
+    data = plan.info()
+    info = tarfile.TarInfo(INFO_MEMBER)
+    info.size = len(data)
+    info.mtime = int(datetime.datetime.now().timestamp())
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+def add_webfiles(tar: tarfile.TarFile, wwwDir: str, plan: IncrementPlan,
+                 filter: Callable[[tarfile.TarInfo], tarfile.TarInfo | None] | None = None):
+    """Add the web files of the plan to the archive below www."""
+    if plan.manifest.level == 'full':
+        tar.add(wwwDir, arcname='www', filter=filter)
+        return
+    tar.add(wwwDir, arcname='www', recursive=False, filter=filter)
+    for rel in plan.changed:
+        tar.add(wwwDir + '/' + rel, arcname='www/' + rel, recursive=False, filter=filter)
+
+def base_in_use(backupDir: str, siteName: str, archivePath: str) -> bool:
+    """Is the full archive at archivePath the base of another archive?"""
+    mPath = manifest_path(archivePath)
+    if not os.path.isfile(mPath):
+        return False
+    m = read_manifest(mPath, headerOnly=True)
+    if m.level != 'full':
+        return False
+    for path in find_manifests(backupDir, siteName):
+        if path != mPath and read_manifest(path, headerOnly=True).base == m.id:
+            return True
+    return False
+
+def rename_archive(oldPath: str, newPath: str):
+    """Rename an archive together with its manifest, fingerprint, member index and checksum."""
+    print('Replacing:', oldPath, newPath)
+    os.replace(oldPath, newPath)
+    if os.path.isfile(manifest_path(oldPath)):
+        os.replace(manifest_path(oldPath), manifest_path(newPath))
+    for sidecar in (fingerprint_path, index_path):
+        u.delete_file(sidecar(newPath))
+        if os.path.isfile(sidecar(oldPath)):
+            os.replace(sidecar(oldPath), sidecar(newPath))
+    digest = read_checksum(oldPath)
+    u.delete_file(checksum_path(oldPath))
+    u.delete_file(checksum_path(newPath))
+    if digest != '':
+        write_checksum(newPath, digest)
+
+def delete_archive(archivePath: str):
+    """Delete an archive together with its manifest, fingerprint, member index and checksum."""
+    u.delete_file(archivePath)
+    u.delete_file(manifest_path(archivePath))
+    u.delete_file(fingerprint_path(archivePath))
+    u.delete_file(index_path(archivePath))
+    u.delete_file(checksum_path(archivePath))
+
+def retire_archive(siteName: str, archivePath: str) -> str:
+    """
+    Keep a full archive which is still the base of other archives under
+    the tag r<YYYYMMDD> of its creation date. Returns the new path.
+    """
+    m = read_manifest(manifest_path(archivePath), headerOnly=True)
+    tag = RETIRED_PREFIX + m.created[:10].replace('-', '')
+    newPath = (os.path.dirname(archivePath) + '/' + siteName + '.' + tag
+               + archive_suffix(archivePath))
+    rename_archive(archivePath, newPath)
+    return newPath
+
+def prune_retired(backupDir: str, siteName: str):
+    """Delete retired full archives which are no longer a base."""
+    for mPath in find_manifests(backupDir, siteName):
+        tag = os.path.basename(mPath)[len(siteName) + 1:-len(MANIFEST_SUFFIX)]
+        if re.fullmatch(RETIRED_PREFIX + r'\d{8}', tag) is None:
+            continue
+        archivePath = manifest_archive(mPath)
+        if archivePath == 'none':
+            u.delete_file(mPath)
+        elif not base_in_use(backupDir, siteName, archivePath):
+            print('Removing retired archive:', archivePath)
+            delete_archive(archivePath)
+
+def read_info(archivePath: str, useManifest: bool = True) -> dict[str, Any]:
+    """
+    Read the backup metadata of an archive. Archives written without
+    incremental backups enabled are treated as full archives.
+    """
+    mPath = manifest_path(archivePath)
+    if useManifest and os.path.isfile(mPath):
+        return read_manifest(mPath, headerOnly=True).header()
+    with ArchiveReader(archivePath) as reader:
+        member = reader.tar.next()
+        if member is not None and member.name == INFO_MEMBER:
+            f = reader.tar.extractfile(member)
+            if f is not None:
+                return json.loads(f.read())
+    return {'id': '', 'level': 'full', 'base': ''}
+
+def find_archive_by_id(backupDir: str, siteName: str, id: str) -> str:
+    """Returns the path of the archive of siteName with the given id or 'none'."""
+    for path in find_manifests(backupDir, siteName):
+        if read_manifest(path, headerOnly=True).id == id:
+            archivePath = manifest_archive(path)
+            if archivePath != 'none':
+                return archivePath
+    # without manifests look into the archives themselves
+    for archive in list_archives(backupDir, siteName):
+        if read_info(backupDir + '/' + archive).get('id') == id:
+            return backupDir + '/' + archive
+    return 'none'
+
+def resolve_chain(backupDir: str, siteName: str, archivePath: str) -> list[str]:
+    """
+    Returns the archives which have to be layered to restore archivePath,
+    starting with the full archive and ending with archivePath.
+    """
+    chain = [archivePath]
+    info = read_info(archivePath)
+    while info.get('level') == 'incremental':
+        basePath = find_archive_by_id(backupDir, siteName, info['base'])
+        if basePath == 'none' or basePath in chain:
+            u.abort('base archive with id', info['base'], 'of', chain[0], 'is missing')
+        chain.insert(0, basePath)
+        info = read_info(basePath)
+    return chain
+
+def extract_chain(chain: list[str], tempDir: str):
+    """
+    Extract the archives of a chain on top of each other. Files deleted
+    since the base are removed. The database is always taken from the
+    last archive since each archive contains a complete SQL dump.
+    """
+    for archivePath in chain:
+        print('Extracting:             ', archivePath)
+        u.delete_dir(tempDir + '/database')
+        deleted: list[str] = []
+        if len(chain) > 1:
+            deleted = read_info(archivePath, useManifest=False).get('deleted', [])
+        for rel in deleted:
+            path = tempDir + '/www/' + rel
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+        with ArchiveReader(archivePath) as reader:
+            print('Archive codec:          ', reader.codec)
+            reader.tar.extractall(path=tempDir)
+        u.delete_file(tempDir + '/' + INFO_MEMBER)
@@ -0,0 +1,88 @@
+import datetime, json, os
+from dataclasses import dataclass
+from typing import Any
+import wm.utils as u
+
+# saveall records the state of each site in a journal in logdir, one JSON
+# line per state change like metrics.jsonl, so the concurrent jobs may
+# append to it. A new saveall run starts a new journal. saveall --resume
+# continues the run of the journal: finished sites are skipped, the
+# uploads of saved sites are queued again and all other sites are saved.
+JOURNAL_FILE = 'journal.jsonl'
+# States of a site in the order of a backup, followed by the final states.
+STATES = ['pending', 'dumping', 'archiving', 'uploading', 'done', 'failed', 'skipped']
+FINISHED = ('done', 'skipped')
+
+@dataclass
+class SiteState:
+    siteName: str
+    state: str
+    time: str = ''
+    archives: list[str] | None = None   # archives to be uploaded
+    backupDir: str = ''
+
+@dataclass
+class Journal:
+    logdir: str
+    run: str              # start time of the saveall run
+
+    @property
+    def path(self) -> str:
+        return self.logdir + '/' + JOURNAL_FILE
+
+    def record(self, siteName: str, state: str, archives: list[str] | None = None,
+               backupDir: str = ''):
+        data: dict[str, Any] = {'run': self.run, 'siteName': siteName, 'state': state,
+                                'time': datetime.datetime.now().isoformat(timespec='seconds')}
+        if archives is not None:
+            data['archives'] = archives
+            data['backupDir'] = backupDir
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(data) + '\n')
+
+    def states(self) -> dict[str, SiteState]:
+        """The last state of each site in this run."""
+        states: dict[str, SiteState] = {}
+        if not os.path.isfile(self.path):
+            return states
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    data: dict[str, Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    continue    # e.g. a line cut by a crash
+                if data.get('run') == self.run and data.get('state') in STATES:
+                    states[data['siteName']] = SiteState(data['siteName'], data['state'],
+                                                         data.get('time', ''),
+                                                         data.get('archives'),
+                                                         data.get('backupDir', ''))
+        return states
+
+def start_journal(logdir: str, siteNames: list[str]) -> Journal:
+    """Start the journal of a new saveall run with all sites pending."""
+    u.ensure_dir(logdir)
+    journal = Journal(logdir, datetime.datetime.now().isoformat(timespec='seconds'))
+    open(journal.path, 'w').close()
+    for siteName in siteNames:
+        journal.record(siteName, 'pending')
+    return journal
+
+def resume_journal(logdir: str) -> Journal:
+    """The journal of the last saveall run."""
+    path = logdir + '/' + JOURNAL_FILE
+    run = ''
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    run = json.loads(line).get('run', run)
+                    break
+                except json.JSONDecodeError:
+                    continue
+    if run == '':
+        u.abort('No saveall journal to resume in', logdir)
+    return Journal(logdir, run)
+
+def show_journal(states: dict[str, SiteState]):
+    counts = {s: sum(1 for st in states.values() if st.state == s) for s in STATES}
+    print('Journal:              ', ', '.join(str(n) + ' ' + s for s, n in counts.items() if n > 0))
@@ -0,0 +1,191 @@
+try:                 # FICLONE is only available on Linux
+    import fcntl
+except ImportError:
+    fcntl = None
+import datetime, glob, json, os, shutil, stat
+from dataclasses import dataclass
+from typing import Any
+from wm.exclusions import Exclusions
+from wm.pagecache import READ_SIZE, DroppingReader, PageCache
+from wm.throttle import THROTTLE
+
+# With snapshotformat = linkfarm a snapshot is a browsable directory
+# siteName.tag.linkfarm in the snapshot directory with the layout of an
+# extracted archive: www/ and database/. A web file which is unchanged
+# since the latest link farm of the site (same size, mtime, mode and
+# owner) is a hard link of the file there, all other files are reflink
+# clones (FICLONE, e.g. on btrfs and XFS) or copies of the web files.
+# linkfarm.json is written last, a link farm without it is incomplete.
+FARM_SUFFIX = '.linkfarm'
+INFO_FILE = 'linkfarm.json'
+# ioctl of Linux which lets dst share the extents of src
+FICLONE = 0x40049409
+
+@dataclass
+class FarmStats:
+    files: int = 0
+    linked: int = 0
+    cloned: int = 0
+    copied: int = 0
+    totalBytes: int = 0     # bytes of all web files
+    copiedBytes: int = 0    # bytes written, neither linked nor cloned
+
+    def show(self):
+        print('Link farm files:      ', self.files, 'of',
+              f'{self.totalBytes / 1e6:.1f}', 'MBytes:', self.linked, 'linked,',
+              self.cloned, 'cloned,', self.copied, 'copied')
+
+def farm_path(dir: str, siteName: str, tag: str) -> str:
+    return dir + '/' + siteName + '.' + tag + FARM_SUFFIX
+
+def is_complete(farmDir: str) -> bool:
+    return os.path.isfile(farmDir + '/' + INFO_FILE)
+
+def find_farm(dir: str, siteName: str, tag: str) -> str:
+    """Returns the path of the complete link farm of siteName with tag or 'none'."""
+    path = farm_path(dir, siteName, tag)
+    return path if is_complete(path) else 'none'
+
+def list_farms(dir: str, siteName: str = '*') -> list[str]:
+    """Returns the paths of the complete link farms in dir."""
+    pattern = '*' if siteName == '*' else glob.escape(siteName) + '.*'
+    return [p for p in glob.glob(glob.escape(dir) + '/' + pattern + FARM_SUFFIX)
+            if is_complete(p)]
+
+def info_mtime(farmDir: str) -> float:
+    """The time the link farm was completed."""
+    return os.path.getmtime(farmDir + '/' + INFO_FILE)
+
+def latest_farm(dir: str, siteName: str, exclude: str = 'none') -> str:
+    """Returns the newest complete link farm of siteName other than exclude or 'none'."""
+    farms = [p for p in list_farms(dir, siteName) if p != exclude]
+    if not farms:
+        return 'none'
+    return max(farms, key=info_mtime)
+
+def read_info(farmDir: str) -> dict[str, Any]:
+    with open(farmDir + '/' + INFO_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def clone_file(src: int, dst: int) -> bool:
+    """Let the open file dst share the extents of src. False if not supported."""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst, FICLONE, src)
+        return True
+    except OSError:
+        return False
+
+def copy_file(src: str, dst: str, st: os.stat_result, pageCache: PageCache) -> bool:
+    """Clone or copy src to dst with the metadata st. Returns True if cloned."""
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        cloned = clone_file(fin.fileno(), fout.fileno())
+        if not cloned:
+            reader = pageCache.reader(fin, st.st_size)
+            try:
+                shutil.copyfileobj(reader, fout, READ_SIZE)
+            finally:
+                if isinstance(reader, DroppingReader):
+                    reader.finish()
+    copy_metadata(dst, st)
+    return cloned
+
+def copy_metadata(path: str, st: os.stat_result):
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        os.chown(path, st.st_uid, st.st_gid)
+    os.chmod(path, stat.S_IMODE(st.st_mode))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def is_unchanged(st: os.stat_result, old: os.stat_result) -> bool:
+    return (stat.S_ISREG(old.st_mode) and st.st_size == old.st_size
+            and st.st_mtime_ns == old.st_mtime_ns and st.st_mode == old.st_mode
+            and st.st_uid == old.st_uid and st.st_gid == old.st_gid)
+
+def build_farm(wwwDir: str, farmDir: str, previous: str, exclusions: Exclusions,
+               pageCache: PageCache) -> FarmStats:
+    """
+    Fill farmDir/www with the web files of wwwDir, linked to the link farm
+    previous where unchanged. Like the archive, symbolic links are followed.
+    """
+    stats = FarmStats()
+
+    def fill(dir: str, rel: str, target: str):
+        os.mkdir(target)
+        with os.scandir(dir) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for e in entries:
+            relPath = e.name if rel == '' else rel + '/' + e.name
+            try:
+                st = e.stat()
+            except OSError:
+                print('Not readable:', e.path)     # e.g. a dangling link
+                continue
+            isDir = stat.S_ISDIR(st.st_mode)
+            if exclusions.skips(relPath, isDir):
+                continue
+            dst = target + '/' + e.name
+            if isDir:
+                if exclusions.skips_contents(relPath):
+                    os.mkdir(dst)
+                    copy_metadata(dst, st)
+                else:
+                    fill(e.path, relPath, dst)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue    # sockets and pipes
+            THROTTLE.wait()
+            stats.files += 1
+            stats.totalBytes += st.st_size
+            if previous != 'none':
+                old = previous + '/www/' + relPath
+                try:
+                    if is_unchanged(st, os.stat(old, follow_symlinks=False)):
+                        os.link(old, dst)
+                        stats.linked += 1
+                        continue
+                except OSError:
+                    pass    # missing, or e.g. too many links
+            if copy_file(e.path, dst, st, pageCache):
+                stats.cloned += 1
+            else:
+                stats.copied += 1
+                stats.copiedBytes += st.st_size
+        # the contents change the directory
+        copy_metadata(target, os.stat(dir))
+
+    fill(wwwDir, '', farmDir + '/www')
+    return stats
+
+def write_info(farmDir: str, siteName: str, tag: str, stats: FarmStats, previous: str,
+               dumpBytes: int):
+    """Mark the link farm as complete."""
+    info = {'siteName': siteName, 'tag': tag,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'previous': os.path.basename(previous), 'dumpBytes': dumpBytes} | stats.__dict__
+    with open(farmDir + '/' + INFO_FILE + '.part', 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=1)
+    os.replace(farmDir + '/' + INFO_FILE + '.part', farmDir + '/' + INFO_FILE)
+
+def restore_farm(farmDir: str, tempDir: str, names: list[str] = ['www', 'database']):
+    """
+    Copy the directories names of a link farm to tempDir like an archive is
+    extracted. The files are cloned where possible, but never linked,
+    such that changes of the restored site do not change the snapshot.
+    """
+    def clone_or_copy(src: str, dst: str):
+        st = os.stat(src)
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            if not clone_file(fin.fileno(), fout.fileno()):
+                shutil.copyfileobj(fin, fout, READ_SIZE)
+        copy_metadata(dst, st)
+
+    for name in names:
+        if os.path.isdir(farmDir + '/' + name):
+            shutil.copytree(farmDir + '/' + name, tempDir + '/' + name,
+                            copy_function=clone_or_copy)
+            if hasattr(os, 'geteuid') and os.geteuid() == 0:
+                # copytree does not keep the owners of the directories
+                for dirpath, _, _ in os.walk(tempDir + '/' + name):
+                    st = os.stat(farmDir + dirpath[len(tempDir):])
+                    os.chown(dirpath, st.st_uid, st.st_gid)
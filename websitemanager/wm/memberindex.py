@@ -0,0 +1,225 @@
+try:                 # optional, only needed for the codec zstd
+    import zstandard # type: ignore
+except ImportError:
+    zstandard = None
+import gzip, hashlib, io, json, os, tarfile, zlib
+from dataclasses import asdict, dataclass
+from typing import IO, Any
+from wm.pagecache import DroppingReader, CacheFriendlyTarFile
+
+# An indexed archive is a sequence of blocks, each an independent gzip
+# member or zstd frame, which standard tools read as a single stream. A
+# block ends at the start of the first tar member after BLOCK_SIZE bytes.
+# The member index siteName.tag.tar.gz.index lists each member with the
+# offset of its block in the archive and the offset of its tar header
+# within the uncompressed block, so a member is read by seeking to its
+# block and decompressing at most BLOCK_SIZE bytes before it.
+INDEX_SUFFIX = '.index'
+INDEX_FORMAT = 1
+INDEXED_CODECS = ['gzip', 'zstd']
+BLOCK_SIZE = 4 * 1024 * 1024
+# With storeCompressed, files which are compressed already are put into
+# blocks of their own which are stored by gzip (level 0) or compressed at
+# the fastest zstd level, which stores incompressible data as raw blocks.
+# Readers need not know about it. Files of other types are compressed if
+# they are small or the compression of their first PROBE_SIZE bytes gains
+# at least 5%.
+STORED_LEVELS = {'gzip': 0, 'zstd': 1}
+COMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic', '.ico',
+    '.mp4', '.m4v', '.mov', '.webm', '.mkv', '.avi', '.mp3', '.m4a', '.ogg', '.opus',
+    '.flac', '.aac', '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar',
+    '.jar', '.woff', '.woff2', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub'}
+TEXT_EXTENSIONS = {
+    '.php', '.inc', '.js', '.mjs', '.ts', '.map', '.css', '.scss', '.less', '.html',
+    '.htm', '.tpl', '.twig', '.xml', '.svg', '.json', '.sql', '.txt', '.md', '.csv',
+    '.log', '.ini', '.yml', '.yaml', '.po', '.pot'}
+PROBE_MIN = 64 * 1024
+PROBE_SIZE = 64 * 1024
+PROBE_RATIO = 0.95
+
+@dataclass
+class MemberEntry:
+    name: str
+    type: str           # f: file, d: directory, l: link, o: other
+    size: int
+    mtime: int
+    sha256: str         # of the content of a file
+    block: int          # offset of the block in the archive
+    skip: int           # offset of the tar header in the uncompressed block
+
+def member_kind(tarinfo: tarfile.TarInfo) -> str:
+    """Type of a member as in MemberEntry."""
+    if tarinfo.isreg():
+        return 'f'
+    if tarinfo.isdir():
+        return 'd'
+    return 'l' if tarinfo.issym() or tarinfo.islnk() else 'o'
+
+def index_path(archivePath: str) -> str:
+    return archivePath + INDEX_SUFFIX
+
+class BlockWriter:
+    """
+    Compressed stream of independent blocks, see above. The tar file
+    calls cut() before each member, which starts a new block if the
+    current one holds at least blockSize bytes or if the member is to be
+    stored and the current block is compressed, or vice versa.
+    """
+    def __init__(self, fileobj: IO[bytes], codec: str, level: int, threads: int = 1,
+                 blockSize: int = BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = level
+        self.storedLevel = STORED_LEVELS[codec]
+        self.threads = threads
+        self.blockSize = blockSize
+        self.pos = 0            # bytes written to the stream
+        self.written = 0        # bytes written to fileobj
+        self.blockStart = 0
+        self.blockOffset = 0
+        self.blockLevel: int = level
+        self.compressor = self.new_compressor(level)
+
+    def new_compressor(self, level: int) -> Any:
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=level, # type: ignore
+                                            threads=self.threads).compressobj()
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, data: Any) -> int:
+        self._output(self.compressor.compress(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def cut(self, stored: bool = False):
+        level = self.storedLevel if stored else self.level
+        if self.pos - self.blockStart < self.blockSize and level == self.blockLevel:
+            return
+        if self.pos > self.blockStart:
+            self._output(self.compressor.flush())
+        self.compressor = self.new_compressor(level)
+        self.blockLevel = level
+        self.blockStart = self.pos
+        self.blockOffset = self.written
+
+    def _output(self, data: bytes):
+        if data:
+            self.fileobj.write(data)
+            self.written += len(data)
+
+    def close(self):
+        self._output(self.compressor.flush())
+
+class HashingReader:
+    """Reader which computes the SHA-256 of the data read."""
+    def __init__(self, fileobj: Any):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+def is_compressed(name: str, fileobj: Any, size: int) -> bool:
+    """Is the file compressed already, see STORED_LEVELS?"""
+    ext = os.path.splitext(name)[1].lower()
+    if ext in COMPRESSED_EXTENSIONS:
+        return True
+    if ext in TEXT_EXTENSIONS or size < PROBE_MIN:
+        return False
+    try:
+        data = os.pread(fileobj.fileno(), PROBE_SIZE, 0)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+    return len(zlib.compress(data, 1)) > PROBE_RATIO * len(data)
+
+class IndexedTarFile(CacheFriendlyTarFile):
+    """
+    Tar file written to a BlockWriter which lists its members in entries.
+    With storeCompressed, files compressed already are not compressed again.
+    """
+    entries: list[MemberEntry]
+    hashing: HashingReader | None = None
+    storeCompressed = False
+    storedBytes = 0
+
+    def addfile(self, tarinfo: tarfile.TarInfo, fileobj: Any = None):
+        stream: BlockWriter = self.fileobj # type: ignore
+        stored = (self.storeCompressed and tarinfo.isreg() and fileobj is not None
+                  and is_compressed(tarinfo.name, fileobj, tarinfo.size))
+        if stored:
+            self.storedBytes += tarinfo.size
+        stream.cut(stored)
+        entry = MemberEntry(tarinfo.name, member_kind(tarinfo), tarinfo.size, int(tarinfo.mtime), '',
+                            stream.blockOffset, stream.pos - stream.blockStart)
+        self.hashing = None
+        super().addfile(tarinfo, fileobj)
+        if self.hashing is not None:
+            entry.sha256 = self.hashing.sha256.hexdigest()
+        self.entries.append(entry)
+
+    def content_reader(self, reader: 'DroppingReader | IO[bytes]') -> Any:
+        self.hashing = HashingReader(reader)
+        return self.hashing
+
+def write_index(archivePath: str, codec: str, entries: list[MemberEntry]):
+    header = {'format': INDEX_FORMAT, 'codec': codec, 'blockSize': BLOCK_SIZE,
+              'archiveBytes': os.path.getsize(archivePath)}
+    with open(index_path(archivePath) + '.part', 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+        for e in entries:
+            f.write(json.dumps(asdict(e)) + '\n')
+    os.replace(index_path(archivePath) + '.part', index_path(archivePath))
+
+def read_index(archivePath: str) -> tuple[str, list[MemberEntry]] | None:
+    """
+    Returns the codec and the members of an archive from its index, or
+    None if there is no index or it does not belong to the archive.
+    """
+    path = index_path(archivePath)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if (header.get('format') != INDEX_FORMAT
+                or header.get('archiveBytes') != os.path.getsize(archivePath)):
+            return None
+        return header['codec'], [MemberEntry(**json.loads(line)) for line in f]
+
+class BlockReader:
+    """
+    Archive opened at the block of entry for sequential reading, the next
+    member of the tar file is entry. Use as context manager, the tar file
+    is available as attribute tar.
+    """
+    def __init__(self, archivePath: str, codec: str, entry: MemberEntry):
+        self.raw = open(archivePath, 'rb')
+        self.raw.seek(entry.block)
+        if codec == 'zstd':
+            self.stream: Any = zstandard.ZstdDecompressor().stream_reader( # type: ignore
+                                   self.raw, read_across_frames=True, closefd=False)
+        else:
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='rb')
+        skip = entry.skip
+        while skip > 0:
+            data = self.stream.read(min(skip, BLOCK_SIZE))
+            if not data:
+                break
+            skip -= len(data)
+        self.tar = tarfile.open(fileobj=self.stream, mode='r|')
+
+    def close(self):
+        self.tar.close()
+        self.stream.close()
+        self.raw.close()
+
+    def __enter__(self) -> 'BlockReader':
+        return self
+
+    def __exit__(self, *exc: Any):
+        self.close()
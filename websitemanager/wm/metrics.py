@@ -0,0 +1,129 @@
+import dataclasses, datetime, json, os, tarfile
+from dataclasses import dataclass
+from typing import Any
+import wm.utils as u
+
+# Each backup, restore and background upload appends one JSON record to
+# this file in logdir, as does each choice of compresslevel = auto.
+# Appending a single line is atomic enough for the concurrent jobs of
+# saveall.
+METRICS_FILE = 'metrics.jsonl'
+
+@dataclass
+class Metrics:
+    """Metrics of a backup, restore or upload of one site. Times in seconds."""
+    time: str = ''
+    kind: str = ''            # backup, snapshot, restore, upload or tuning
+    siteName: str = ''
+    tag: str = ''
+    backend: str = ''
+    codec: str = ''
+    compressLevel: int = -1   # -1: unknown
+    level: str = ''           # full or incremental
+    seconds: float = 0.0      # total time
+    scanSeconds: float = 0.0  # manifest scan of incremental backups
+    dumpSeconds: float = 0.0
+    dumpBytes: int = 0
+    tarSeconds: float = 0.0   # writing the archive or the chunks
+    tarRate: float = 0.0      # MByte/s of web files while writing
+    throttleSeconds: float = 0.0  # paused by the throttle
+    fileCount: int = 0
+    bytesRead: int = 0        # bytes of the web files
+    archiveBytes: int = 0
+    ratio: float = 0.0        # (bytes read + dump bytes) / archive bytes
+    uploadSeconds: float = 0.0
+    uploadBytes: int = 0
+    uploadRate: float = 0.0   # MByte/s
+    extractSeconds: float = 0.0
+    databaseSeconds: float = 0.0
+
+    def finish(self):
+        if self.tarSeconds > 0:
+            self.tarRate = round(self.bytesRead / 1e6 / self.tarSeconds, 3)
+        if self.archiveBytes > 0:
+            self.ratio = round((self.bytesRead + self.dumpBytes) / self.archiveBytes, 3)
+        if self.uploadSeconds > 0:
+            self.uploadRate = round(self.uploadBytes / 1e6 / self.uploadSeconds, 3)
+
+class FileCounter:
+    """Tar filter which counts the regular files added and their bytes."""
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+
+    def __call__(self, info: tarfile.TarInfo) -> tarfile.TarInfo:
+        if info.isreg():
+            self.files += 1
+            self.bytes += info.size
+        return info
+
+def new_metrics(kind: str, siteName: str, tag: str) -> Metrics:
+    return Metrics(time=datetime.datetime.now().isoformat(timespec='seconds'),
+                   kind=kind, siteName=siteName, tag=tag)
+
+def write_metrics(logdir: str, m: Metrics):
+    m.finish()
+    u.ensure_dir(logdir)
+    with open(logdir + '/' + METRICS_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(dataclasses.asdict(m)) + '\n')
+
+def read_metrics(logdir: str) -> list[Metrics]:
+    records: list[Metrics] = []
+    path = logdir + '/' + METRICS_FILE
+    if not os.path.isfile(path):
+        return records
+    fields = {f.name for f in dataclasses.fields(Metrics)}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                data: dict[str, Any] = json.loads(line)
+            except json.JSONDecodeError:
+                continue    # e.g. a line cut by a crash
+            records.append(Metrics(**{k: v for k, v in data.items() if k in fields}))
+    return records
+
+def trend(values: list[float]) -> str:
+    """Change of the last value compared with the mean of the previous ones."""
+    if len(values) < 2:
+        return ''
+    mean = sum(values[:-1]) / (len(values) - 1)
+    if mean <= 0:
+        return ''
+    return f'{(values[-1] / mean - 1) * 100:+.0f}%'
+
+def show_stats(logdir: str, numRuns: int, siteName: str = 'none'):
+    """Summarise the last numRuns backups and uploads per site."""
+    records = read_metrics(logdir)
+    sites: dict[str, list[Metrics]] = {}
+    uploads: dict[str, list[Metrics]] = {}
+    for m in records:
+        if siteName != 'none' and m.siteName != siteName:
+            continue
+        if m.kind in ('backup', 'snapshot'):
+            sites.setdefault(m.siteName, []).append(m)
+        elif m.kind == 'upload':
+            uploads.setdefault(m.siteName, []).append(m)
+    u.print_line()
+    print('Backup statistics of the last', numRuns, 'runs per site from',
+          logdir + '/' + METRICS_FILE)
+    print('Times in seconds, sizes in MBytes, trend: last run against the previous runs')
+    u.print_line()
+    if not sites:
+        print('No backup metrics found.')
+        return
+    width = max([len(s) for s in sites] + [len('site')])
+    print('site'.ljust(width), ' runs', ' last s', ' trend', ' dump s', ' dump MB',
+          '  files', ' arch MB', ' trend', ' ratio', '   codec', ' tar MB/s', ' up MB/s')
+    for name in sorted(sites):
+        runs = sites[name][-numRuns:]
+        last = runs[-1]
+        ups = [m.uploadRate for m in uploads.get(name, [])[-numRuns:] + runs if m.uploadRate > 0]
+        upRate = f'{sum(ups) / len(ups):8.1f}' if ups else '       -'
+        codec = last.codec + ('-' + str(last.compressLevel) if last.compressLevel >= 0 else '')
+        print(name.ljust(width), f'{len(runs):5}', f'{last.seconds:7.1f}',
+              trend([m.seconds for m in runs]).rjust(6),
+              f'{last.dumpSeconds:7.1f}', f'{last.dumpBytes / 1e6:8.1f}',
+              f'{last.fileCount:7}', f'{last.archiveBytes / 1e6:8.1f}',
+              trend([m.archiveBytes for m in runs]).rjust(6),
+              f'{last.ratio:6.2f}', codec.rjust(8), f'{last.tarRate:9.1f}', upRate)
+    u.print_line()
@@ -0,0 +1,128 @@
+import ctypes, ctypes.util
+try:                 # mincore is only available on Linux
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                          ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+except (OSError, AttributeError, TypeError):
+    libc = None
+import io, mmap, os, re, tarfile
+from dataclasses import dataclass
+from typing import IO, Any, TypeGuard
+import wm.utils as u
+from wm.config import Parameters
+
+# The web files read by a backup must not evict the working set of the
+# web and database servers from the page cache. With pagecache = drop the
+# files are read in large sequential blocks and the pages read are
+# dropped again with posix_fadvise(). Pages which were cached before the
+# file was read, e.g. of the PHP files in use, are kept.
+READ_SIZE = 1024 * 1024
+PAGE_SIZE = mmap.PAGESIZE
+MAP_FAILED = ctypes.c_void_p(-1).value if libc is not None else None
+# runs of pages which were not cached in the result of mincore()
+NOT_CACHED = re.compile(b'\x00+')
+
+def cached_pages(fd: int, size: int) -> bytes:
+    """
+    One byte per page of the file, 1 if the page is in the page cache
+    and 0 if not. Without mincore() no page is reported as cached.
+    """
+    numPages = (size + PAGE_SIZE - 1) // PAGE_SIZE
+    if libc is None or size == 0:
+        return bytes(numPages)
+    addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+    if addr is None or addr == MAP_FAILED:
+        return bytes(numPages)
+    try:
+        vec = ctypes.create_string_buffer(numPages)
+        if libc.mincore(addr, size, vec) != 0:
+            return bytes(numPages)
+        return vec.raw
+    finally:
+        libc.munmap(addr, size)
+
+def is_file_reader(f: IO[bytes]) -> TypeGuard[io.BufferedReader]:
+    """True if f reads a file directly, e.g. not through a GzipFile."""
+    return isinstance(f, io.BufferedReader)
+
+@dataclass
+class PageCache:
+    """Page cache policy of the backup reads, see get_page_cache()."""
+    drop: bool = False
+    limit: int = 64 * 1024 * 1024   # bytes read before they are dropped
+
+    def reader(self, f: IO[bytes], size: int) -> 'DroppingReader | IO[bytes]':
+        """Reader of the regular file f of the given size which follows the policy."""
+        if not self.drop or not hasattr(os, 'posix_fadvise') or not is_file_reader(f):
+            return f
+        return DroppingReader(f, size, self.limit)
+
+class DroppingReader:
+    """
+    Reads a file sequentially and drops the pages read which were not
+    cached before, whenever limit bytes have been read and at the end.
+    """
+    def __init__(self, f: io.BufferedReader, size: int, limit: int):
+        self.file = f
+        self.fd = f.fileno()
+        self.limit = max(limit, PAGE_SIZE)
+        self.pos = 0
+        self.dropped = 0
+        self.cached = cached_pages(self.fd, size)
+        os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.advance(self.file.read(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.advance(self.file.readline(size))
+
+    def advance(self, data: bytes) -> bytes:
+        self.pos += len(data)
+        if self.pos - self.dropped >= self.limit:
+            self.drop(self.pos // PAGE_SIZE)
+        return data
+
+    def drop(self, endPage: int):
+        """Drop the pages read up to endPage which were not cached before."""
+        startPage = self.dropped // PAGE_SIZE
+        for m in NOT_CACHED.finditer(self.cached, startPage, endPage):
+            os.posix_fadvise(self.fd, m.start() * PAGE_SIZE, (m.end() - m.start()) * PAGE_SIZE,
+                             os.POSIX_FADV_DONTNEED)
+        if endPage > len(self.cached):
+            # grown since it was opened, the rest was not cached either
+            start = max(startPage, len(self.cached)) * PAGE_SIZE
+            os.posix_fadvise(self.fd, start, 0, os.POSIX_FADV_DONTNEED)
+        self.dropped = endPage * PAGE_SIZE
+
+    def finish(self):
+        """Drop the rest of the pages read, the file itself is not closed."""
+        self.drop((self.pos + PAGE_SIZE - 1) // PAGE_SIZE)
+
+class CacheFriendlyTarFile(tarfile.TarFile):
+    """Tar file which reads the regular files added according to pageCache."""
+    pageCache = PageCache()
+    copybufsize: int | None
+
+    def addfile(self, tarinfo: tarfile.TarInfo, fileobj: Any = None):
+        if fileobj is None:
+            return super().addfile(tarinfo, fileobj)
+        reader = self.pageCache.reader(fileobj, tarinfo.size)
+        try:
+            super().addfile(tarinfo, self.content_reader(reader))
+        finally:
+            if isinstance(reader, DroppingReader):
+                reader.finish()
+
+    def content_reader(self, reader: 'DroppingReader | IO[bytes]') -> Any:
+        """The reader passed to the tar file, e.g. to inspect the content."""
+        return reader
+
+def get_page_cache(params: Parameters) -> PageCache:
+    mode = params.get('pagecache')
+    if mode not in ('keep', 'drop'):
+        u.abort('unknown pagecache "' + mode + '", use keep or drop')
+    return PageCache(mode == 'drop', int(params.get('pagecachelimit')) * 1024 * 1024)
@@ -0,0 +1,128 @@
+import heapq, os, shutil, statistics
+from dataclasses import dataclass
+import wm.utils as u
+import wm.dbutils as db
+from wm.metrics import Metrics, read_metrics
+from wm.tabledump import list_tables
+from wm.websites import WebSiteData
+from wm.config import Parameters
+
+# The planner estimates the time and archive size of each site from the
+# metrics of its last backups (see wm.metrics), or from a scan of the web
+# files and the database size for sites without history. saveall starts
+# the longest sites first, so that concurrent jobs finish at about the
+# same time.
+HISTORY_RUNS = 5
+# Assumptions while there are no metrics at all.
+DEFAULT_RATE = 20e6      # bytes of web files and dump per second
+DEFAULT_RATIO = 2.0      # (web files + dump) / archive
+
+@dataclass
+class Estimate:
+    siteName: str
+    source: str          # history, scan or skipped
+    seconds: float = 0.0
+    archiveBytes: int = 0
+    dumpBytes: int = 0
+
+@dataclass
+class Plan:
+    estimates: list[Estimate]    # in the order of the backups
+    jobs: int
+    seconds: float               # predicted wall time
+    diskBytes: int               # predicted disk need
+
+def scan_size(wwwDir: str) -> int:
+    """Bytes of the files below wwwDir, symbolic links are followed like by the archive."""
+    size = 0
+    for dirpath, _, filenames in os.walk(wwwDir, followlinks=True):
+        for name in filenames:
+            try:
+                size += os.stat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return size
+
+def database_size(params: Parameters, site: WebSiteData) -> int:
+    """
+    Bytes of the tables of the database of site, 0 if the database cannot
+    be queried: the backup of the site reports the failure, not the plan.
+    """
+    if site.dbName == 'none':
+        return 0
+    defaults_file, credential = db.get_db_defaults_file(params, site)
+    try:
+        tables, _ = list_tables(params, site, credential)
+    except SystemExit:
+        # u.abort() of the query, e.g. the database is unreachable
+        print('Warning: size of database', site.dbName, 'unknown, planned without it.')
+        return 0
+    finally:
+        os.remove(defaults_file)
+    return sum(t.size for t in tables)
+
+def estimate_site(params: Parameters, site: WebSiteData, history: list[Metrics],
+                  rate: float, ratio: float) -> Estimate:
+    if site.save != '1':
+        return Estimate(site.siteName, 'skipped')
+    # unchanged sites are fast and need no space, but may change anyway
+    runs = [m for m in history if m.siteName == site.siteName and m.level != 'unchanged']
+    runs = runs[-HISTORY_RUNS:]
+    if runs:
+        return Estimate(site.siteName, 'history',
+                        statistics.median(m.seconds for m in runs),
+                        int(statistics.median(m.archiveBytes for m in runs)),
+                        max(m.dumpBytes for m in runs))
+    wwwDir = params.get('wwwroot') + '/' + site.wwwSubdir
+    dbBytes = database_size(params, site)
+    total = scan_size(wwwDir) + dbBytes
+    return Estimate(site.siteName, 'scan', total / rate, int(total / ratio), dbBytes)
+
+def plan_backups(params: Parameters, sites: list[WebSiteData], jobs: int) -> Plan:
+    """Estimate the sites and order them longest first."""
+    history = [m for m in read_metrics(params.get('logdir'))
+               if m.kind == 'backup' and m.seconds > 0]
+    seconds = sum(m.seconds for m in history)
+    rate = sum(m.bytesRead + m.dumpBytes for m in history) / seconds if seconds > 0 else 0
+    ratios = [m.ratio for m in history if m.ratio > 0]
+    estimates = [estimate_site(params, site, history, rate or DEFAULT_RATE,
+                               statistics.median(ratios) if ratios else DEFAULT_RATIO)
+                 for site in sites]
+    return schedule(estimates, jobs)
+
+def schedule(estimates: list[Estimate], jobs: int) -> Plan:
+    """Order the estimates longest first and predict the time and disk need."""
+    # longest processing time first, skipped sites at the end
+    estimates.sort(key=lambda e: (e.source == 'skipped', -e.seconds))
+    finish = [0.0] * max(jobs, 1)
+    for e in estimates:
+        heapq.heappush(finish, heapq.heappop(finish) + e.seconds)
+    # new archives are written before old ones are removed, plus the
+    # uncompressed dumps of the concurrent jobs
+    dumps = sorted((e.dumpBytes for e in estimates), reverse=True)[:max(jobs, 1)]
+    diskBytes = sum(e.archiveBytes for e in estimates) + sum(dumps)
+    return Plan(estimates, jobs, max(finish), diskBytes)
+
+def show_plan(params: Parameters, plan: Plan):
+    u.print_line()
+    print('Backup plan:', len(plan.estimates), 'websites with', plan.jobs, 'jobs, longest first')
+    width = max([len(e.siteName) for e in plan.estimates] + [len('site')])
+    print('   #', 'site'.ljust(width), ' source ', '    seconds', '  archive MB')
+    for i, e in enumerate(plan.estimates):
+        print(f'{i:4}', e.siteName.ljust(width), '', e.source.ljust(7),
+              f'{e.seconds:11.1f}', f'{e.archiveBytes / 1e6:12.1f}')
+    backupDir = params.get('sitedumpdir')
+    freeBytes = shutil.disk_usage(backupDir).free if os.path.isdir(backupDir) else 0
+    window = float(params.get('backupwindow'))
+    if window > 0:
+        print('Predicted time:       ', f'{plan.seconds:.0f}', 'sec of a backup window of',
+              f'{window * 60:.0f}', 'sec')
+    else:
+        print('Predicted time:       ', f'{plan.seconds:.0f}', 'sec')
+    print('Predicted disk need:  ', f'{plan.diskBytes / 1e6:.1f}', 'MBytes of',
+          f'{freeBytes / 1e6:.1f}', 'MBytes free in', backupDir)
+    if window > 0 and plan.seconds > window * 60:
+        print('Warning: the backups are predicted to exceed the backup window.')
+    if plan.diskBytes > freeBytes:
+        print('Warning: the free space of', backupDir, 'is predicted to be insufficient.')
+    u.print_line()
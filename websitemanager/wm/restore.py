@@ -3,13 +3,22 @@ try:                # for line editing on input for Linux
     import readline # type: ignore
 except ImportError:
     readline = None
-import glob, os, shutil, tarfile, textwrap
+import datetime, glob, os, shutil, textwrap
 import wm.utils as u
 import wm.dbaccess as acc
 import wm.dbutils as db
+import wm.incremental as inc
+import wm.chunkstore as cs
+import wm.linkfarm as lf
+import wm.retention as ret
+from wm.archive import ArchiveReader, detect_codec, find_archive
+from wm.memberindex import BlockReader, MemberEntry, read_index
+from wm.catalog import open_catalog
+from wm.tabledump import TABLES_DIR, restore_tables
+from wm.metrics import new_metrics, write_metrics
 from wm.websites import WebSiteData
 from wm.config import Parameters
-from wm.timeutils import get_dated_files, get_date_of_file, isSnapshot, print_timestamps
+from wm.timeutils import TimerElapsed, get_date_of_file, isSnapshot, print_timestamps
 
 BAN_OTHERS_RECURSIVE = "chmod -R o-rwx "
 BAN_OTHERS_SINGLE = "chmod o-rwx "
@@ -41,40 +50,41 @@ def get_archive_timestamp(params : Parameters, site : WebSiteData, altdir: str =
       site:      WebSiteData object containing the website data
       altdir:    If entered, alternative snapshot archive directory
     """
-    # "root_dir=DIRECTORY_PATH" is not yet in glob with Python 3.8:
-    cwd = os.getcwd()
-    dumpDir = params.get('sitedumpdir') 
-    os.chdir(dumpDir)
-    sitedumps = glob.glob(site.siteName + '*tar.gz')
-    datedDumps = get_dated_files(sitedumps)
+    catalog = open_catalog(params)
+    dumpDir = params.get('sitedumpdir')
+    datedDumps = [e.dated_name() for e in catalog.entries(site.siteName, 'local', dumpDir)]
     print_timestamps(datedDumps, site.siteName, 'Sitedumps in ' + dumpDir + ' :')
 
-    snapshotDir = params.get('snapshotdir') 
+    snapshotDir = params.get('snapshotdir')
+    location = 'snapshot'
     if altdir != 'none':
         snapshotDir = altdir
-    os.chdir(snapshotDir)
-    snapshots = glob.glob(site.siteName + '*tar.gz')
-    os.chdir(cwd)
+        location = 'alt'
+        catalog.scan_dir(location, snapshotDir, site.siteName)
+    snapshots = [e.name for e in catalog.entries(site.siteName, location, snapshotDir)]
     print_timestamps(snapshots, site.siteName, 'Snapshots in ' + snapshotDir + ' :')
     
     print('Snapshot timestamps have format YYYY-MM-DD_hh-mm or YYYY-MM-DD')
     print('Sitedump labels have format wd#, w# or m# where # is integer')
+    print('or d#, w#, m# or y# where # is a date YYYYMMDD (GFS retention)')
     print('Only enter the label without date and parens for a sitedump!')
     timestamp = input('Enter timestamp or label of "' + site.siteName 
                       + '" archive to be restored: ')
     if timestamp == '' or ' ' in timestamp or timestamp.isspace():
         print('Timestamp may not contain whitespace.')
         u.abort('invalid timestamp entered')
-    print('Try restoring from archive', site.siteName + '.' + timestamp + '.tar.gz')
+    print('Try restoring from archive', site.siteName + '.' + timestamp + '.tar*')
     return timestamp
 
-def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir: str):
+def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir: str,
+            dbOnly: bool = False):
     """
     Arguments:
       params:     Parameters object with general settings
       site:       WebSiteData object containing the website data
       timestamp:  timestamp of the archive to be restored
       backupDir:  backup archive directory
+      dbOnly:     only restore the database, the web files are kept
     """
     if site.owner == "default":
         wwwUserGroup  = params.get('wwwusergroup') # 'none': do nothing
@@ -84,11 +94,22 @@ def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir:
     wwwbanothers = params.get('wwwbanothers') == 'true'
     
     # Set up the archive name and global root directories
-    archive = backupDir + '/' + site.siteName + '.' + timestamp + '.tar.gz'
+    timestamp = ret.current_tag(backupDir, site.siteName, timestamp)
+    archive = find_archive(backupDir, site.siteName, timestamp)
+    # a snapshot index of the chunk store replaces an older archive
+    index = cs.find_index(backupDir, site.siteName, timestamp)
+    if index != 'none' and (archive == 'none' 
+                            or os.path.getmtime(index) > os.path.getmtime(archive)):
+        archive = index
+    # as well as a link farm snapshot
+    farm = lf.find_farm(backupDir, site.siteName, timestamp)
+    if farm != 'none' and (archive == 'none'
+                           or lf.info_mtime(farm) > os.path.getmtime(archive)):
+        archive = farm
     wwwPath = params.get('wwwroot') + '/' + site.wwwSubdir
     u.print_line()
     print('Restored webpage:', site.siteName)
-    print('Restored web directory:', wwwPath)
+    print('Restored web directory:', 'none' if dbOnly else wwwPath)
     print('Restored database:', site.dbName)
     print('Database user:', site.dbUser)
     
@@ -96,7 +117,7 @@ def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir:
     print('Entered archive timestamp:', timestamp)
     print('Webpage to be restored from:', archive)
     u.print_line()
-    if os.path.exists(archive):
+    if archive != 'none' and os.path.exists(archive):
         print('Archive file found...')
     else:
         u.abort('Error abort due to missing archive file...')
@@ -106,9 +127,39 @@ def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir:
     tempDir = backupDir + '/' + temp
     u.make_empty_dir(tempDir)
 
-    # Extract the files in the archive into the $Temp directory
-    with tarfile.open(archive, 'r:gz') as tar:
-        tar.extractall(path=tempDir)
+    metrics = new_metrics('restore', site.siteName, timestamp)
+    timer = TimerElapsed()
+    # Extract the files in the archive into the $Temp directory.
+    # An incremental archive is layered on top of its full base archive.
+    if archive == index:
+        metrics.backend = 'chunkstore'
+        cs.restore_index(backupDir, index, tempDir)
+    elif archive == farm:
+        metrics.backend = 'linkfarm'
+        lf.restore_farm(farm, tempDir, ['database'] if dbOnly else ['www', 'database'])
+    elif dbOnly:
+        # each archive of a chain contains the complete SQL dump
+        metrics.backend = 'archive'
+        metrics.codec = detect_codec(archive)
+        metrics.archiveBytes = os.path.getsize(archive)
+        print('Extracting:             ', archive, 'database')
+        extract_members(archive, 'database', tempDir)
+    else:
+        metrics.backend = 'archive'
+        metrics.codec = detect_codec(archive)
+        chain = inc.resolve_chain(backupDir, site.siteName, archive)
+        metrics.archiveBytes = sum(os.path.getsize(a) for a in chain)
+        inc.extract_chain(chain, tempDir)
+    metrics.extractSeconds = timer.show_elapsed('Extraction time elapsed')
+    if dbOnly:
+        metrics.databaseSeconds = restore_database(params, site, tempDir)
+        u.delete_dir(tempDir)
+        logFile = params.get('logdir') + '/' + site.siteName + '.txt'
+        u.append_logfile(logFile, timestamp + ' database restored: ')
+        metrics.seconds = metrics.extractSeconds + metrics.databaseSeconds
+        write_metrics(params.get('logdir'), metrics)
+        print('...', site.siteName, 'database restore', timestamp, 'complete.')
+        return
 
     # Look for the www directory
     tempWwwPath = tempDir + '/www'
@@ -116,7 +167,7 @@ def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir:
     u.is_dir_or_abort(tempWwwPath)
 
     # If database is not 'none', restore it
-    restore_database(params, site, tempDir)
+    metrics.databaseSeconds = restore_database(params, site, tempDir)
     
     # should all webfiles be restored?
     print('Webdir', wwwPath, 'has to be restored!')
@@ -154,14 +205,17 @@ def restore(params : Parameters, site : WebSiteData, timestamp: str, backupDir:
         date = get_date_of_file(archive)
         msg = date + '(' + timestamp + ') restored: '
     u.append_logfile(logFile, msg)        
+    metrics.seconds = metrics.extractSeconds + metrics.databaseSeconds
+    write_metrics(params.get('logdir'), metrics)
 
     print('...', site.siteName, 'restore', timestamp, 'complete.')
 
 
-def restore_database(params : Parameters, site : WebSiteData, tempDir: str):
+def restore_database(params : Parameters, site : WebSiteData, tempDir: str) -> float:
+    """Returns the time needed to restore the database in seconds."""
     if site.dbName == 'none':
         print('.... no database to be restored.')
-        return
+        return 0.0
     # Used SQL command.
     sql = params.get('sql')
     # Search DbFile, the SQL dump file within the extracted files.
@@ -178,6 +232,11 @@ def restore_database(params : Parameters, site : WebSiteData, tempDir: str):
     dbFile = tempDatabasePath + '/' + sqlfiles[0]
     print('Restoring database from:', dbFile)
     u.is_file_or_abort(dbFile)
+    # parallel dump: one file per table, restored before the main file
+    tableFiles = [tempDatabasePath + '/' + f for f in glob.glob(TABLES_DIR + '/*.sql')]
+    if tableFiles:
+        print('Restoring tables from:  ', len(tableFiles), 'files in',
+              tempDatabasePath + '/' + TABLES_DIR)
     
     if params.get('runasroot') == 'true':
         db.ensure_database_exists(params, site)
@@ -189,12 +248,17 @@ def restore_database(params : Parameters, site : WebSiteData, tempDir: str):
                       + ' ' + site.dbName + ' < ' + dbFile)
     wrappedCmd = textwrap.fill(restorecommand, u.WRAP_LENGTH)
     u.print_line('-')
+    if tableFiles:
+        print('preceded by the table files with', params.get('sqldumpjobs'), 'connections:')
     print(wrappedCmd)
     u.print_line('-')
     print('Overwriting database', site.dbName)
     u.query_continue()
 
     # now restore database
+    timer = TimerElapsed()
+    if tableFiles:
+        restore_tables(params, site, db_credential, tempDatabasePath, tableFiles)
     exitcode = u.RUNNER.do(restorecommand)
     os.remove(defaults_file)
     if exitcode == 0:
@@ -203,3 +267,88 @@ def restore_database(params : Parameters, site : WebSiteData, tempDir: str):
         u.abort('...database', site.dbName, 'restoration failed')
     # leave SQL directory to be able to clean up the temp directory
     os.chdir(workingDir)
+    return timer.show_elapsed('Database time elapsed')
+
+def member_entries(archivePath: str) -> list[MemberEntry]:
+    """The members of an archive from its index or, without index, by reading it."""
+    index = read_index(archivePath)
+    if index is not None:
+        return index[1]
+    print('No member index, reading:', archivePath)
+    entries: list[MemberEntry] = []
+    with ArchiveReader(archivePath) as reader:
+        for m in reader.tar:
+            kind = 'f' if m.isreg() else 'd' if m.isdir() else (
+                   'l' if m.issym() or m.islnk() else 'o')
+            entries.append(MemberEntry(m.name, kind, m.size, int(m.mtime), '', -1, 0))
+    return entries
+
+def extract_members(archivePath: str, memberPath: str, targetDir: str) -> int:
+    """
+    Extract the member memberPath of an archive, or all members below it,
+    into targetDir. With a member index the archive is only read from the
+    blocks of these members. Returns the number of members extracted.
+    """
+    prefix = memberPath.rstrip('/') + '/'
+    def wanted(name: str) -> bool:
+        return name == memberPath.rstrip('/') or name.startswith(prefix)
+
+    index = read_index(archivePath)
+    if index is None:
+        print('No member index, reading:', archivePath)
+        count = 0
+        with ArchiveReader(archivePath) as reader:
+            for m in reader.tar:
+                if wanted(m.name):
+                    reader.tar.extract(m, path=targetDir)
+                    count += 1
+        return count
+    codec, entries = index
+    selected = [i for i, e in enumerate(entries) if wanted(e.name)]
+    # consecutive members are read from the block of the first one
+    runs: list[list[int]] = []
+    for i in selected:
+        if runs and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    for run in runs:
+        with BlockReader(archivePath, codec, entries[run[0]]) as reader:
+            for _ in run:
+                m = reader.tar.next()
+                if m is None:
+                    u.abort('Member index does not match', archivePath)
+                    break
+                reader.tar.extract(m, path=targetDir)
+    return len(selected)
+
+def inspect_archive(params : Parameters, site : WebSiteData, timestamp: str, backupDir: str,
+                    extractPath: str = 'none', targetDir: str = '.'):
+    """
+    List the members of an archive or, with extractPath, extract a member
+    or directory of it into targetDir. An incremental archive only holds
+    the changed files, unchanged ones are taken from its base archives.
+    """
+    timestamp = ret.current_tag(backupDir, site.siteName, timestamp)
+    archive = find_archive(backupDir, site.siteName, timestamp)
+    if archive == 'none':
+        u.abort('No archive', site.siteName + '.' + timestamp, 'in', backupDir)
+    u.print_line()
+    print('Archive:                ', archive)
+    print('Member index:           ', 'yes' if read_index(archive) is not None else 'no')
+    if extractPath == 'none':
+        entries = member_entries(archive)
+        for e in entries:
+            date = datetime.datetime.fromtimestamp(e.mtime).strftime('%Y-%m-%d %H:%M')
+            print(e.type, f'{e.size:12}', date, e.name)
+        print(len(entries), 'members,', f'{sum(e.size for e in entries) / 1e6:.1f}', 'MBytes')
+        return
+    timer = TimerElapsed()
+    for archivePath in reversed(inc.resolve_chain(backupDir, site.siteName, archive)):
+        count = extract_members(archivePath, extractPath, targetDir)
+        if count > 0:
+            print('Extracted:              ', count, 'members from', archivePath,
+                  'into', os.path.abspath(targetDir))
+            timer.show_elapsed('Extraction time elapsed')
+            return
+    u.abort(extractPath, 'not found in', archive)
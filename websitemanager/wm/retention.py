@@ -0,0 +1,275 @@
+import datetime, os, re, shlex, shutil, subprocess
+from collections.abc import Callable
+from dataclasses import dataclass
+import wm.utils as u
+import wm.incremental as inc
+import wm.chunkstore as cs
+from wm.archive import find_archive
+from wm.catalog import Catalog, open_catalog, remote_key
+from wm.config import Parameters
+
+# GFS retention: the daily backups of saveall are tagged d<YYYYMMDD>.
+# Backups kept as weekly, monthly or yearly backups are renamed to
+# w<YYYYMMDD>, m<YYYYMMDD> or y<YYYYMMDD>, the date is never changed.
+# A backup belongs to the highest of these classes selecting it.
+CLASSES = 'dwmy'
+TAG_PATTERN = re.compile(r'([dwmy])(\d{8})')
+
+@dataclass
+class Policy:
+    daily: int = 7
+    weekly: int = 4
+    monthly: int = 12
+    yearly: int = 3
+
+@dataclass
+class Backup:
+    siteName: str
+    tag: str
+    kind: str              # class letter of CLASSES
+    date: datetime.date
+    path: str              # archive or snapshot index of the chunk store
+    isIndex: bool = False
+    mtime: float = 0.0
+
+def is_gfs(params: Parameters) -> bool:
+    retention = params.get('retention')
+    if retention not in ('legacy', 'gfs'):
+        u.abort('unknown retention "' + retention + '", use legacy or gfs')
+    return retention == 'gfs'
+
+def get_policy(params: Parameters) -> Policy:
+    return Policy(int(params.get('keepdaily')), int(params.get('keepweekly')),
+                  int(params.get('keepmonthly')), int(params.get('keepyearly')))
+
+def daily_tag(d: datetime.date) -> str:
+    return 'd' + d.strftime('%Y%m%d')
+
+def make_tag(kind: str, d: datetime.date) -> str:
+    return kind + d.strftime('%Y%m%d')
+
+def build_index(catalog: Catalog, backupDir: str, siteName: str) -> list[Backup]:
+    """
+    GFS backups of a site in backupDir from the catalog, oldest first.
+    Of the same date, the newest backup comes first: it holds the last
+    state of the site on this day, e.g. of a second saveall.
+    """
+    backups: list[Backup] = []
+    for e in catalog.entries(siteName, 'local', backupDir):
+        match = TAG_PATTERN.fullmatch(e.tag)
+        if match is None:
+            continue
+        try:
+            date = datetime.datetime.strptime(match.group(2), '%Y%m%d').date()
+        except ValueError:
+            continue
+        backups.append(Backup(siteName, e.tag, match.group(1), date, e.path,
+                              e.codec == 'chunkstore', e.mtime))
+    backups.sort(key=lambda b: (b.date, -b.mtime, b.path))
+    return backups
+
+def select(backups: list[Backup], policy: Policy) -> dict[str, str]:
+    """
+    Decide which backups are kept and as which class. For each class, the
+    backups are grouped in buckets (day, ISO week, month, year) and the
+    oldest backup of each of the newest buckets is selected, of its date
+    the newest one. Thus the selection is stable while new backups are
+    added, and a missed run only moves the promotion to the next existing
+    backup.
+    Returns the class letter of each kept backup by path.
+    """
+    bucketKeys: dict[str, Callable[[datetime.date], object]] = {
+        'd': lambda d: d,
+        'w': lambda d: d.isocalendar()[:2],
+        'm': lambda d: (d.year, d.month),
+        'y': lambda d: d.year,
+    }
+    counts = {'d': policy.daily, 'w': policy.weekly,
+              'm': policy.monthly, 'y': policy.yearly}
+    keep: dict[str, str] = {}
+    for kind in CLASSES:
+        first: dict[object, Backup] = {}
+        for b in backups:          # the oldest date comes first, its newest backup first
+            first.setdefault(bucketKeys[kind](b.date), b)
+        newest = list(first.values())[::-1][:counts[kind]]
+        for b in newest:
+            keep[b.path] = kind    # later classes rank higher
+    return keep
+
+def keep_bases(backups: list[Backup], keep: dict[str, str]):
+    """
+    Incremental archives need their base archive. A base which is not
+    selected itself is kept with its current class.
+    """
+    byId: dict[str, Backup] = {}
+    bases: dict[str, str] = {}
+    for b in backups:
+        mPath = inc.manifest_path(b.path)
+        if b.isIndex or not os.path.isfile(mPath):
+            continue
+        m = inc.read_manifest(mPath, headerOnly=True)
+        byId[m.id] = b
+        if m.level == 'incremental':
+            bases[b.path] = m.base
+    for path in list(keep):
+        base = byId.get(bases.get(path, ''))
+        if base is not None and base.path not in keep:
+            keep[base.path] = base.kind
+
+def full_backup_due(backupDir: str, siteName: str, tag: str, d: datetime.date) -> bool:
+    """
+    With incremental backups and GFS retention, the first backup of each
+    ISO week is a full one.
+    """
+    mPath = inc.latest_full_manifest(backupDir, siteName, tag)
+    if mPath == 'none':
+        return True
+    created = datetime.date.fromisoformat(inc.read_manifest(mPath, headerOnly=True).created[:10])
+    return created.isocalendar()[:2] != d.isocalendar()[:2]
+
+def current_tag(backupDir: str, siteName: str, tag: str) -> str:
+    """
+    A GFS backup may have been promoted since its tag was noted. Returns the
+    tag of the backup of the same date, or tag if there is none.
+    """
+    match = TAG_PATTERN.fullmatch(tag)
+    if match is None:
+        return tag
+    for kind in CLASSES:
+        other = kind + match.group(2)
+        if (find_archive(backupDir, siteName, other) != 'none'
+                or cs.find_index(backupDir, siteName, other) != 'none'):
+            if other != tag:
+                print('Backup', tag, 'has been promoted to', other)
+            return other
+    return tag
+
+class RemoteLocation:
+    """
+    Apply renames and deletions to the uploaded copies of the archives.
+    remotelocation is either a mounted directory or host:path for scp,
+    then the commands of a site are sent to the host with a single ssh call.
+    The catalog is updated accordingly.
+    """
+    def __init__(self, params: Parameters, catalog: Catalog):
+        self.catalog = catalog
+        self.location = params.get('remotelocation')
+        self.ssh = params.get('ssh')
+        self.host = ''
+        self.dir = self.location
+        if ':' in self.location and not os.path.isdir(self.location):
+            self.host, _, self.dir = self.location.partition(':')
+        self.commands: list[str] = []
+
+    def rename(self, oldName: str, newName: str):
+        if self.location == 'none':
+            return
+        self.catalog.rename('remote', remote_key(self.location), oldName, newName)
+        if self.host == '':
+            if os.path.isfile(self.dir + '/' + oldName):
+                os.replace(self.dir + '/' + oldName, self.dir + '/' + newName)
+        else:
+            self.commands.append('mv -f ' + self.remote_path(oldName) + ' '
+                                 + self.remote_path(newName))
+
+    def delete(self, name: str):
+        if self.location == 'none':
+            return
+        self.catalog.delete('remote', remote_key(self.location), name)
+        if self.host == '':
+            u.delete_file(self.dir + '/' + name)
+        else:
+            self.commands.append('rm -f ' + self.remote_path(name))
+
+    def copy(self, oldName: str, newName: str, localPath: str) -> bool:
+        """
+        Copy an uploaded archive on the remote location instead of uploading
+        the local archive localPath with the same content as newName.
+        Returns False if the copy failed.
+        """
+        if self.location == 'none':
+            return False
+        if self.host == '':
+            part = self.dir + '/' + newName + '.part'
+            try:
+                u.delete_file(part)
+                try:
+                    os.link(self.dir + '/' + oldName, part)
+                except OSError:
+                    shutil.copy2(self.dir + '/' + oldName, part)
+                os.replace(part, self.dir + '/' + newName)
+            except OSError:
+                return False
+        else:
+            command = (self.ssh + ' ' + self.host + ' '
+                       + shlex.quote('cp -p ' + self.remote_path(oldName) + ' '
+                                     + self.remote_path(newName)))
+            u.RUNNER.show(command)
+            if ('simulate' not in u.RUNNER.options
+                    and subprocess.run(command, shell=True).returncode != 0):
+                return False
+        self.catalog.add_remote(self.location, localPath)
+        return True
+
+    def remote_path(self, name: str) -> str:
+        return shlex.quote(self.dir + '/' + name if self.dir != '' else name)
+
+    def flush(self):
+        if self.commands:
+            script = ' ; '.join(self.commands)
+            u.RUNNER.do(self.ssh + ' ' + self.host + ' ' + shlex.quote(script))
+        self.commands = []
+
+def apply_retention(params: Parameters, siteNames: list[str]):
+    """
+    GFS retention of the saveall backups of the given sites: promote the
+    selected backups by renaming them and delete the others, locally and
+    at the remote location in one pass.
+    """
+    backupDir = params.get('sitedumpdir')
+    policy = get_policy(params)
+    catalog = open_catalog(params)
+    remote = RemoteLocation(params, catalog)
+    u.print_line()
+    print('GFS retention:         daily', policy.daily, ' weekly', policy.weekly,
+          ' monthly', policy.monthly, ' yearly', policy.yearly)
+    for siteName in siteNames:
+        backups = build_index(catalog, backupDir, siteName)
+        keep = select(backups, policy)
+        keep_bases(backups, keep)
+        numPromoted = 0
+        numDeleted = 0
+        # deletions first: a promoted backup may replace a deleted one of the same date
+        for b in sorted(backups, key=lambda b: b.path in keep):
+            name = os.path.basename(b.path)
+            kind = keep.get(b.path, '')
+            if kind == '':
+                print('Removing:', name)
+                catalog.delete('local', os.path.dirname(b.path), name)
+                if b.isIndex:
+                    u.delete_file(b.path)
+                else:
+                    inc.delete_archive(b.path)
+                    remote.delete(name)
+                numDeleted += 1
+            elif kind != b.kind:
+                newName = name.replace('.' + b.tag + '.', '.' + make_tag(kind, b.date) + '.', 1)
+                newPath = os.path.dirname(b.path) + '/' + newName
+                if newPath in keep:
+                    # never replace a kept backup, e.g. the base of b
+                    print('Not promoted, kept:   ', newName)
+                    continue
+                if not os.path.isfile(b.path):
+                    print('Missing, reindex the catalog:', b.path)
+                    continue
+                catalog.rename('local', os.path.dirname(b.path), name, newName)
+                if b.isIndex:
+                    print('Replacing:', b.path, newPath)
+                    os.replace(b.path, newPath)
+                else:
+                    inc.rename_archive(b.path, newPath)
+                    remote.rename(name, newName)
+                numPromoted += 1
+        remote.flush()
+        print(siteName + ':', len(backups), 'backups,', numPromoted, 'promoted,',
+              numDeleted, 'deleted')
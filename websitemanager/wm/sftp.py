@@ -0,0 +1,161 @@
+try:                 # optional, only needed for uploader = sftp
+    import paramiko  # type: ignore
+except ImportError:
+    paramiko = None
+import hashlib, os, shlex
+from collections.abc import Callable
+from typing import Any
+import wm.utils as u
+from wm.archive import read_checksum
+from wm.throttle import THROTTLE
+
+# Size of the blocks written to the remote file. paramiko splits them
+# into SFTP write requests which are pipelined, i.e. sent without
+# waiting for the acknowledgement of the previous request.
+BLOCK_SIZE = 1024 * 1024
+# SSH channel window, large enough to keep a slow, distant link busy.
+WINDOW_SIZE = 64 * 1024 * 1024
+# Uploads are written to name.part and renamed when verified.
+PART_SUFFIX = '.part'
+
+def parse_location(remoteLocation: str) -> tuple[str, str, str]:
+    """Split the scp style location [user@]host:directory into user, host and directory."""
+    host, _, dir = remoteLocation.partition(':')
+    user, _, host = host.rpartition('@')
+    return user, host, dir
+
+def local_sha256(path: str) -> str:
+    """Returns the SHA-256 stored when the archive was written, else computes it."""
+    digest = read_checksum(path)
+    if digest != '':
+        return digest
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+class SftpSession:
+    """
+    SFTP session to the remote location which is reused for all uploads.
+    Host name, port, user and key of an alias in ~/.ssh/config are used
+    like scp does. The host key has to be known (~/.ssh/known_hosts).
+    Uploads resume a partial upload of a previous attempt and are verified
+    by SHA-256 before they get their final name. The messages of the
+    session are passed to log.
+    """
+    def __init__(self, remoteLocation: str, log: Callable[..., None] = print):
+        if paramiko is None:
+            u.abort('uploader sftp requires the Python package paramiko')
+        self.user, self.host, self.dir = parse_location(remoteLocation)
+        if self.host == '':
+            u.abort('uploader sftp requires remotelocation host:directory')
+        self.log = log
+        self.ssh: Any = None
+        self.sftp: Any = None
+
+    def connect(self):
+        if self.sftp is not None:
+            return
+        assert paramiko is not None     # checked by __init__
+        options: dict[str, Any] = {'hostname': self.host}
+        configFile = os.path.expanduser('~/.ssh/config')
+        if os.path.isfile(configFile):
+            options = paramiko.SSHConfig.from_path(configFile).lookup(self.host)
+        ssh = paramiko.SSHClient()
+        ssh.load_system_host_keys()
+        ssh.set_missing_host_key_policy(paramiko.RejectPolicy())
+        ssh.connect(options['hostname'], port=int(options.get('port', 22)),
+                    username=self.user or options.get('user'),
+                    key_filename=options.get('identityfile'))
+        self.log('SFTP session opened:  ', self.host)
+        self.ssh = ssh
+        transport = ssh.get_transport()
+        if transport is None:
+            raise paramiko.SSHException('SSH session to ' + self.host + ' closed')
+        self.sftp = paramiko.SFTPClient.from_transport(transport, window_size=WINDOW_SIZE)
+
+    def close(self):
+        if self.ssh is not None:
+            self.ssh.close()
+        self.ssh = None
+        self.sftp = None
+
+    def remote_path(self, name: str) -> str:
+        return self.dir + '/' + name if self.dir != '' else name
+
+    def upload(self, localPath: str, name: str):
+        """
+        Upload localPath as name into the remote directory. Raises an
+        exception if the upload fails, the session is closed then and
+        reopened by the next upload.
+        """
+        try:
+            self.connect()
+            self.send(localPath, name)
+        except Exception:
+            self.close()
+            raise
+
+    def send(self, localPath: str, name: str):
+        partPath = self.remote_path(name + PART_SUFFIX)
+        size = os.path.getsize(localPath)
+        offset = 0
+        try:
+            offset = self.sftp.stat(partPath).st_size
+        except FileNotFoundError:
+            pass
+        if offset > size:
+            offset = 0
+        if offset > 0:
+            self.log('Resuming upload at:   ', offset, 'of', size, 'bytes')
+        with open(localPath, 'rb') as f, self.sftp.open(partPath, 'ab' if offset else 'wb') as r:
+            r.set_pipelined(True)
+            f.seek(offset)
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                THROTTLE.wait()
+                r.write(block)
+        digest = local_sha256(localPath)
+        remoteDigest = self.remote_sha256(partPath)
+        if remoteDigest != digest:
+            # e.g. a stale partial upload of another archive was resumed
+            self.sftp.remove(partPath)
+            raise IOError('SHA-256 mismatch of uploaded ' + name)
+        try:
+            self.sftp.posix_rename(partPath, self.remote_path(name))
+        except IOError:
+            # server without posix-rename extension
+            try:
+                self.sftp.remove(self.remote_path(name))
+            except FileNotFoundError:
+                pass
+            self.sftp.rename(partPath, self.remote_path(name))
+
+    def remote_sha256(self, path: str) -> str:
+        """
+        SHA-256 of a remote file, computed by sha256sum on the remote host
+        if possible, otherwise by reading the file back.
+        """
+        assert paramiko is not None
+        try:
+            _, stdout, _ = self.ssh.exec_command('sha256sum ' + shlex.quote(path))
+            output = stdout.read().decode('utf-8', errors='replace')
+            if stdout.channel.recv_exit_status() == 0 and output != '':
+                return output.split()[0]
+        except paramiko.SSHException:
+            pass
+        h = hashlib.sha256()
+        with self.sftp.open(path, 'rb') as f:
+            f.prefetch()
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                h.update(block)
+        return h.hexdigest()
@@ -0,0 +1,92 @@
+import gzip, os, shutil, subprocess, tarfile, tempfile, time
+from typing import IO
+import wm.utils as u
+from wm.throttle import THROTTLE
+
+# Size of the blocks read from the stdout of mysqldump.
+BLOCK_SIZE = 1024 * 1024
+# The spool only has to be fast, the archive is compressed again anyway.
+SPOOL_COMPRESSLEVEL = 1
+
+class SqlSpool:
+    """
+    SQL dump which is streamed from the stdout of mysqldump into a gzip
+    compressed anonymous temp file. The uncompressed size needed for the
+    tar header is counted while streaming. Thus the dump never lands on
+    disk uncompressed and no temp directory is left behind on a crash.
+    """
+    def __init__(self, spoolDir: str, path: str = '', size: int = 0):
+        """A spool saved to path before may be opened again with its size."""
+        if path != '':
+            self.file: IO[bytes] = open(path, 'rb')
+            self.mtime = os.path.getmtime(path)
+        else:
+            self.file = tempfile.TemporaryFile(dir=spoolDir, prefix='temp932524687.')
+            self.mtime = time.time()
+        self.gz: gzip.GzipFile | None = None
+        self.size = size
+
+    def dump(self, command: str) -> int:
+        """Run the dump command and spool its stdout. Returns the exit code."""
+        u.RUNNER.show(command)
+        if 'simulate' in u.RUNNER.options:
+            return 0
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+        assert proc.stdout is not None
+        while True:
+            block = proc.stdout.read(BLOCK_SIZE)
+            if not block:
+                break
+            self.write(block)
+        self.finish()
+        return proc.wait()
+
+    def write(self, data: bytes):
+        THROTTLE.wait()    # mysqldump blocks on the full pipe meanwhile
+        if self.gz is None:
+            self.gz = gzip.GzipFile(fileobj=self.file, mode='wb',
+                                    compresslevel=SPOOL_COMPRESSLEVEL)
+        self.gz.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        """End writing, the spool can be added to an archive then."""
+        if self.gz is not None:
+            self.gz.close()
+            self.gz = None
+        self.mtime = time.time()
+
+    def save(self, path: str):
+        """Copy the compressed spool to path."""
+        self.file.seek(0)
+        with open(path + '.part', 'wb') as f:
+            shutil.copyfileobj(self.file, f)
+        os.replace(path + '.part', path)
+
+    def extract(self, path: str):
+        """Write the uncompressed dump to path."""
+        self.file.seek(0)
+        with gzip.GzipFile(fileobj=self.file, mode='rb') as gz, open(path, 'wb') as f:
+            shutil.copyfileobj(gz, f, BLOCK_SIZE)
+        os.utime(path, (self.mtime, self.mtime))
+
+    def add_to(self, tar: tarfile.TarFile, arcname: str):
+        """Add the spooled dump as member arcname to the tar archive."""
+        info = tarfile.TarInfo(arcname)
+        info.size = self.size
+        info.mtime = int(self.mtime)
+        info.mode = 0o644
+        self.file.seek(0)
+        with gzip.GzipFile(fileobj=self.file, mode='rb') as gz:
+            tar.addfile(info, gz)
+
+    def close(self):
+        self.file.close()
+
+def add_directory(tar: tarfile.TarFile, arcname: str):
+    """Add an empty directory member to the tar archive."""
+    info = tarfile.TarInfo(arcname)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    info.mtime = int(time.time())
+    tar.addfile(info)
@@ -0,0 +1,557 @@
+import json, math, os, re, shlex, subprocess, threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+import wm.utils as u
+import wm.dbutils as db
+from wm.sqlstream import SqlSpool
+from wm.exclusions import get_exclusions
+from wm.websites import WebSiteData
+from wm.config import Parameters
+
+# Table-parallel dumps: the base tables are dumped by several mysqldump
+# processes into one file per table below database/tables, views,
+# routines and events into database/<siteName>.sql as before.
+TABLES_DIR = 'tables'
+# Tables larger than sqlchunkthreshold are split into primary key ranges
+# of about sqlchunksize. The ranges are listed in this file of database/,
+# so restore loads them concurrently without parsing the SQL.
+CHUNK_MAP = 'chunks.json'
+# With sqlreuse the table dumps of each site are kept compressed in this
+# directory of the backup directory, with the state of each table when
+# it was dumped. Unchanged tables are added from there to the archive.
+TABLE_CACHE = 'tablecache'
+STATE_FILE = 'state.json'
+# An update time this close to the time the state is taken is not
+# trusted, a later write within the same second would not change it.
+UPDATE_MARGIN = 2
+# mysqldump starts each table with one of these comments.
+TABLE_MARKER = re.compile(rb'^-- (?:Table structure|Dumping data) for table `(.*)`$')
+# Seconds the tables are kept locked for the dump processes to start.
+LOCK_TIMEOUT = 300
+# Bytes of rows per INSERT statement of a chunk, like mysqldump's net_buffer_length.
+INSERT_SIZE = 1024 * 1024
+CHUNK_HEADER = (b'/*!40101 SET NAMES utf8mb4 */;\n'
+                b'/*!40014 SET FOREIGN_KEY_CHECKS=0 */;\n'
+                b'/*!40014 SET UNIQUE_CHECKS=0 */;\n')
+# Column types which are dumped as hex literals.
+HEX_TYPES = {'binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'bit',
+             'geometry', 'point', 'linestring', 'polygon', 'multipoint',
+             'multilinestring', 'multipolygon', 'geometrycollection'}
+INTEGER_TYPES = {'tinyint', 'smallint', 'mediumint', 'int', 'bigint'}
+# Escapes of the batch output of the mysql client.
+BATCH_ESCAPE = re.compile(rb'\\(.)')
+BATCH_CHARS = {b'n': b'\n', b't': b'\t', b'0': b'\0', b'\\': b'\\'}
+
+@dataclass
+class Table:
+    name: str
+    size: int                  # data and index bytes as estimated by the server
+
+@dataclass
+class Chunk:
+    """Primary key range [low, high] of a table."""
+    table: str
+    file: str                  # member name below database/
+    key: str
+    low: int
+    high: int
+    size: int                  # estimated bytes
+    names: list[str] = field(default_factory=list[str])      # quoted column names
+    columns: list[str] = field(default_factory=list[str])    # select expressions
+
+@dataclass
+class Worker:
+    """One mysqldump process dumping a set of tables and one session for the chunks."""
+    tables: list[Table] = field(default_factory=list[Table])
+    chunks: list[Chunk] = field(default_factory=list[Chunk])
+    size: int = 0
+    spools: dict[str, SqlSpool] = field(default_factory=dict[str, SqlSpool])
+    ready: threading.Event = field(default_factory=threading.Event)
+    exitcode: int = 0
+
+def table_file(tableName: str) -> str:
+    """Member name of the dump of a table below database/."""
+    return TABLES_DIR + '/' + tableName.replace('/', '_') + '.sql'
+
+def quote_name(name: str) -> str:
+    return '`' + name.replace('`', '``') + '`'
+
+def quote_string(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+def client_command(params: Parameters, site: WebSiteData, credential: str) -> list[str]:
+    return shlex.split(params.get('sql') + credential + ' -h ' + site.host)
+
+def run_query(params: Parameters, site: WebSiteData, credential: str,
+              query: str) -> list[list[str]]:
+    """Rows of a query as lists of column strings."""
+    output = subprocess.run(client_command(params, site, credential)
+                            + ['-N', '-B', '-e', query, site.dbName], capture_output=True)
+    if output.returncode != 0:
+        u.abort('query on', site.dbName, 'failed:', output.stderr.decode('utf-8', 'replace'))
+    return [line.split('\t') for line in output.stdout.decode('utf-8').splitlines()]
+
+def list_tables(params: Parameters, site: WebSiteData,
+                credential: str) -> tuple[list[Table], list[str]]:
+    """Returns the base tables, largest first, and the views of the database."""
+    tables: list[Table] = []
+    views: list[str] = []
+    for row in run_query(params, site, credential,
+                         'SELECT TABLE_NAME, TABLE_TYPE, IFNULL(DATA_LENGTH + INDEX_LENGTH, 0) '
+                         'FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()'):
+        if len(row) != 3:
+            continue
+        if row[1] == 'VIEW':
+            views.append(row[0])
+        else:
+            tables.append(Table(row[0], int(row[2])))
+    tables.sort(key=lambda t: t.size, reverse=True)
+    return tables, views
+
+def plan_chunks(params: Parameters, site: WebSiteData, credential: str,
+                table: Table) -> list[Chunk]:
+    """
+    Split a table into primary key ranges of about sqlchunksize MBytes.
+    Returns no chunks if the table has no single integer primary key.
+    """
+    rows = run_query(params, site, credential,
+                     'SELECT COLUMN_NAME, DATA_TYPE, COLUMN_KEY, EXTRA '
+                     'FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() '
+                     'AND TABLE_NAME = ' + quote_string(table.name) + ' ORDER BY ORDINAL_POSITION')
+    keys = [r for r in rows if len(r) == 4 and r[2] == 'PRI']
+    if len(keys) != 1 or keys[0][1] not in INTEGER_TYPES:
+        return []
+    names: list[str] = []
+    columns: list[str] = []
+    for name, dataType, _, extra in rows:
+        if 'GENERATED' in extra.upper():
+            continue
+        column = quote_name(name)
+        names.append(column)
+        if dataType in HEX_TYPES:
+            columns.append('IF(' + column + ' IS NULL, \'NULL\', IF(LENGTH(' + column
+                           + ') = 0, CHAR(39, 39), CONCAT(\'0x\', HEX(' + column + '))))')
+        else:
+            columns.append('QUOTE(' + column + ')')
+    key = keys[0][0]
+    bounds = run_query(params, site, credential, 'SELECT MIN(' + quote_name(key) + '), MAX('
+                       + quote_name(key) + ') FROM ' + quote_name(table.name))
+    if not bounds or bounds[0][0] == 'NULL':
+        return []
+    low, high = int(bounds[0][0]), int(bounds[0][1])
+    count = max(1, math.ceil(table.size / (int(params.get('sqlchunksize')) * 1e6)))
+    width = math.ceil((high - low + 1) / count)
+    chunks: list[Chunk] = []
+    for i in range(count):
+        chunkLow = low + i * width
+        if chunkLow > high:
+            break
+        chunks.append(Chunk(table.name, table_file(table.name)[:-4] + f'.{i:04}.sql', key,
+                            chunkLow, min(high, chunkLow + width - 1),
+                            table.size // count, names, columns))
+    return chunks
+
+def assign_work(tables: list[Table], chunks: list[Chunk], jobs: int) -> list[Worker]:
+    """Distribute tables and chunks, largest first, to the least loaded worker."""
+    items: list[Table | Chunk] = sorted([*tables, *chunks], key=lambda i: i.size, reverse=True)
+    workers = [Worker() for _ in range(min(jobs, len(items)))]
+    for item in items:
+        worker = min(workers, key=lambda w: w.size)
+        if isinstance(item, Table):
+            worker.tables.append(item)
+        else:
+            worker.chunks.append(item)
+        worker.size += item.size
+    return workers
+
+def split_output(proc: subprocess.Popen[bytes], worker: Worker, spoolDir: str):
+    """
+    Split the output of mysqldump into one spool per table. The header
+    with the session settings is repeated at the start of each table.
+    """
+    assert proc.stdout is not None
+    header = b''
+    spool: SqlSpool | None = None
+    for line in proc.stdout:
+        match = TABLE_MARKER.match(line.rstrip(b'\n'))
+        if match is not None:
+            worker.ready.set()    # the snapshot of the process is open
+            member = table_file(match.group(1).decode('utf-8').replace('``', '`'))
+            if member not in worker.spools:
+                spool = SqlSpool(spoolDir)
+                spool.write(header)
+                worker.spools[member] = spool
+            spool = worker.spools[member]
+        if spool is None:
+            header += line
+        else:
+            spool.write(line)
+    worker.exitcode = proc.wait()
+    worker.ready.set()
+
+class ChunkSession:
+    """
+    A mysql session which opens its consistent snapshot when created,
+    i.e. while the tables are locked, and later selects the rows of the
+    chunks within this snapshot as SQL literals.
+    """
+    def __init__(self, params: Parameters, site: WebSiteData, credential: str):
+        self.proc = subprocess.Popen(client_command(params, site, credential)
+                                     + ['-N', '-B', '--default-character-set=utf8mb4',
+                                        site.dbName],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.command('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;\n'
+                     'START TRANSACTION WITH CONSISTENT SNAPSHOT;\n'
+                     "SELECT 'ready';\n")
+        if self.readline() != b'ready':
+            u.abort('opening a snapshot of', site.dbName, 'failed')
+
+    def command(self, sql: str):
+        assert self.proc.stdin is not None
+        self.proc.stdin.write(sql.encode('utf-8'))
+        self.proc.stdin.flush()
+
+    def readline(self) -> bytes:
+        assert self.proc.stdout is not None
+        return self.proc.stdout.readline().rstrip(b'\n')
+
+    def dump(self, chunk: Chunk, spool: SqlSpool) -> bool:
+        """Write the rows of the chunk as INSERT statements. Returns False on error."""
+        self.command('SELECT CONCAT(\'(\', CONCAT_WS(\',\', ' + ', '.join(chunk.columns)
+                     + '), \')\') FROM ' + quote_name(chunk.table) + ' WHERE '
+                     + quote_name(chunk.key) + f' BETWEEN {chunk.low} AND {chunk.high} '
+                     + 'ORDER BY ' + quote_name(chunk.key) + ";\nSELECT 'end';\n")
+        insert = ('INSERT INTO ' + quote_name(chunk.table) + ' ('
+                  + ', '.join(chunk.names) + ') VALUES ').encode('utf-8')
+        spool.write(CHUNK_HEADER)
+        rows: list[bytes] = []
+        size = 0
+        while True:
+            line = self.readline()
+            if line == b'end' or line == b'':
+                break
+            row = BATCH_ESCAPE.sub(lambda m: BATCH_CHARS.get(m.group(1), m.group(1)), line)
+            rows.append(row)
+            size += len(row)
+            if size >= INSERT_SIZE:
+                spool.write(insert + b',\n'.join(rows) + b';\n')
+                rows = []
+                size = 0
+        if rows:
+            spool.write(insert + b',\n'.join(rows) + b';\n')
+        return line == b'end'
+
+    def close(self) -> int:
+        assert self.proc.stdin is not None
+        self.proc.stdin.write(b'COMMIT;\n')
+        self.proc.stdin.close()
+        return self.proc.wait()
+
+def run_worker(worker: Worker, proc: subprocess.Popen[bytes] | None,
+               session: ChunkSession | None, spoolDir: str):
+    if proc is not None:
+        split_output(proc, worker, spoolDir)
+    if session is not None:
+        for chunk in worker.chunks:
+            spool = SqlSpool(spoolDir)
+            worker.spools[chunk.file] = spool
+            if not session.dump(chunk, spool):
+                worker.exitcode = 1
+                break
+        if session.close() != 0:
+            worker.exitcode = 1
+
+def table_states(params: Parameters, site: WebSiteData, credential: str) -> dict[str, str]:
+    """
+    State of each base table from information_schema.TABLES, such that a
+    table with the same state has not been changed. Tables without update
+    time, e.g. InnoDB after a server restart, are checksummed. An empty
+    state means the table has to be dumped.
+    """
+    version = run_query(params, site, credential, 'SELECT VERSION()')[0][0]
+    query = ('SELECT TABLE_NAME, ENGINE, IFNULL(CREATE_TIME, \'\'), IFNULL(UPDATE_TIME, \'\'), '
+             'TABLE_ROWS, UNIX_TIMESTAMP(NOW()) - IFNULL(UNIX_TIMESTAMP(UPDATE_TIME), 0) '
+             'FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() '
+             'AND TABLE_TYPE = \'BASE TABLE\'')
+    if 'MariaDB' not in version and int(version.split('.')[0]) >= 8:
+        # MySQL caches these statistics for a day by default
+        query = 'SET SESSION information_schema_stats_expiry = 0; ' + query
+    states: dict[str, str] = {}
+    unknown: list[str] = []
+    for name, engine, created, updated, rows, age in run_query(params, site, credential, query):
+        if updated == '':
+            unknown.append(name)
+        elif float(age) > UPDATE_MARGIN:
+            # the row count of InnoDB is an estimate which changes anyway
+            states[name] = (created + '|' + updated + '|'
+                            + (rows if engine != 'InnoDB' else ''))
+    if unknown:
+        checksums = run_query(params, site, credential, 'CHECKSUM TABLE '
+                              + ', '.join(quote_name(t) for t in unknown))
+        for name, (_, checksum) in zip(unknown, checksums):
+            if checksum != 'NULL':
+                states[name] = 'checksum|' + checksum
+    return states
+
+class TableCache:
+    """
+    The table dumps of the last backup of a site with the state of the
+    tables and the dump options, see TABLE_CACHE.
+    """
+    def __init__(self, backupDir: str, siteName: str, options: str):
+        self.dir = backupDir + '/' + TABLE_CACHE + '/' + siteName
+        self.options = options
+        self.tables: dict[str, dict[str, Any]] = {}
+        u.ensure_dir(self.dir)
+        path = self.dir + '/' + STATE_FILE
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.tables = json.load(f)
+
+    def path(self, member: str) -> str:
+        return self.dir + '/' + member.replace('/', '#') + '.gz'
+
+    def reuse(self, table: str, state: str) -> dict[str, Any] | None:
+        """The cache entry of an unchanged table or None."""
+        entry = self.tables.get(table)
+        if (entry is None or state == '' or entry['state'] != state
+                or entry['options'] != self.options):
+            return None
+        if not all(os.path.isfile(self.path(m)) for m in entry['members']):
+            return None
+        return entry
+
+    def save(self, table: str, state: str, spools: dict[str, SqlSpool],
+             chunkEntry: dict[str, Any] | None):
+        for member, spool in spools.items():
+            spool.save(self.path(member))
+        self.tables[table] = {'state': state, 'options': self.options,
+                              'members': {m: s.size for m, s in spools.items()},
+                              'chunks': chunkEntry}
+
+    def write(self, tableNames: list[str]):
+        """Write the states, drop the dumps of tables which no longer exist."""
+        self.tables = {t: e for t, e in self.tables.items() if t in tableNames}
+        path = self.dir + '/' + STATE_FILE
+        with open(path + '.part', 'w', encoding='utf-8') as f:
+            json.dump(self.tables, f, indent=1)
+        os.replace(path + '.part', path)
+        members = {self.path(m) for e in self.tables.values() for m in e['members']}
+        for entry in os.scandir(self.dir):
+            if entry.name != STATE_FILE and entry.path not in members:
+                os.remove(entry.path)
+
+class TableLock:
+    """
+    A mysql session holding a read lock on all base tables while the
+    dump processes open their transactions (--single-transaction) or
+    lock the tables themselves. Thus all processes see the same state
+    of the database.
+    """
+    def __init__(self, params: Parameters, site: WebSiteData, credential: str,
+                 tables: list[Table]):
+        self.proc = subprocess.Popen(client_command(params, site, credential)
+                                     + ['-N', site.dbName],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        assert self.proc.stdin is not None and self.proc.stdout is not None
+        lockList = ', '.join(quote_name(t.name) + ' READ' for t in tables)
+        self.proc.stdin.write(b'LOCK TABLES ' + lockList.encode('utf-8') + b';\n'
+                              + b"SELECT 'locked';\n")
+        self.proc.stdin.flush()
+        if self.proc.stdout.readline().strip() != b'locked':
+            u.abort('locking the tables of', site.dbName, 'failed')
+
+    def release(self):
+        assert self.proc.stdin is not None
+        self.proc.stdin.write(b'UNLOCK TABLES;\n')
+        self.proc.stdin.close()
+        self.proc.wait()
+
+def dump_tables(params: Parameters, site: WebSiteData, spoolDir: str) -> list[tuple[str, SqlSpool]]:
+    """
+    Dump the database with sqldumpjobs concurrent mysqldump processes into
+    compressed spools. Returns the archive member names below database/
+    with their spools, the table files first. With sqlreuse the dumps of
+    unchanged tables are taken from the TableCache instead.
+    """
+    jobs = int(params.get('sqldumpjobs'))
+    threshold = int(params.get('sqlchunkthreshold')) * 1e6
+    options = params.get('sqldumpoptions')
+    if '--compact' in options or '--skip-comments' in options:
+        u.abort('sqldumpjobs > 1 requires the comments of mysqldump,',
+                'remove --compact and --skip-comments from sqldumpoptions')
+    cache = None
+    if params.get('sqlreuse') == 'true':
+        cache = TableCache(spoolDir, site.siteName, options)
+    defaults_file, credential = db.get_db_defaults_file(params, site)
+    try:
+        allTables, views = list_tables(params, site, credential)
+        lock = TableLock(params, site, credential, allTables) if allTables else None
+        try:
+            # the states are taken while the tables are locked
+            states = table_states(params, site, credential) if cache is not None else {}
+            tables: list[Table] = []
+            chunks: list[Chunk] = []
+            chunkMap: dict[str, dict[str, Any]] = {}
+            reused: list[tuple[str, SqlSpool]] = []
+            excluded = get_exclusions(params, site).excluded_tables([t.name for t in allTables])
+            for table in allTables:
+                if table.name in excluded:
+                    continue
+                entry = None
+                if cache is not None:
+                    entry = cache.reuse(table.name, states.get(table.name, ''))
+                if cache is not None and entry is not None:
+                    reused += [(m, SqlSpool(spoolDir, cache.path(m), size))
+                               for m, size in entry['members'].items()]
+                    if entry['chunks'] is not None:
+                        chunkMap[table.name] = entry['chunks']
+                    continue
+                tableChunks = []
+                if table.size > threshold:
+                    tableChunks = plan_chunks(params, site, credential, table)
+                if len(tableChunks) > 1:
+                    chunks += tableChunks
+                else:
+                    tables.append(table)
+            chunkedTables = sorted({c.table for c in chunks})
+            workers = assign_work(tables, chunks, jobs)
+            dumpCommand = (params.get('sqldump') + credential + ' -h ' + site.host + ' '
+                           + options + ' ')
+            print('Parallel SQL dump:    ', len(allTables) - len(excluded), 'tables,', len(chunks), 'chunks of',
+                  len(chunkedTables), 'tables,', len(workers), 'connections')
+            if cache is not None:
+                print('Reused table dumps:   ', len(allTables) - len(excluded) - len(tables)
+                      - len(chunkedTables),
+                      'unchanged tables')
+            threads: list[threading.Thread] = []
+            for worker in workers:
+                proc = None
+                if worker.tables:
+                    command = (dumpCommand + '--skip-routines --skip-events ' + site.dbName
+                               + ' ' + ' '.join(shlex.quote(t.name) for t in worker.tables))
+                    u.RUNNER.show(command)
+                    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+                else:
+                    worker.ready.set()
+                session = ChunkSession(params, site, credential) if worker.chunks else None
+                thread = threading.Thread(target=run_worker,
+                                          args=(worker, proc, session, spoolDir))
+                thread.start()
+                threads.append(thread)
+            for worker in workers:
+                if not worker.ready.wait(LOCK_TIMEOUT):
+                    print('Warning: dump not started within', LOCK_TIMEOUT,
+                          'sec, releasing the table lock')
+                    break
+        finally:
+            if lock is not None:
+                lock.release()
+        # structure of the chunked tables, their triggers are created after the rows
+        structures: dict[str, SqlSpool] = {}
+        for table in chunkedTables:
+            structures[table] = SqlSpool(spoolDir)
+            structures[table].dump(dumpCommand + '--no-data --skip-triggers '
+                                   + '--skip-routines --skip-events '
+                                   + site.dbName + ' ' + shlex.quote(table))
+        # schema of the excluded tables, views, routines and events
+        objects = SqlSpool(spoolDir)
+        exitcode = 0
+        if excluded:
+            print('Schema only:          ', ' '.join(excluded))
+            exitcode |= objects.dump(dumpCommand + '--no-data --skip-routines --skip-events '
+                                     + site.dbName + ' '
+                                     + ' '.join(shlex.quote(t) for t in excluded))
+        if views:
+            command = (dumpCommand + '--no-data --skip-triggers ' + site.dbName + ' '
+                       + ' '.join(shlex.quote(v) for v in views))
+        else:
+            command = dumpCommand + '--no-data --no-create-info --skip-triggers ' + site.dbName
+        exitcode |= objects.dump(command)
+        triggerTables = sorted(chunkedTables + list(chunkMap))
+        if triggerTables:
+            exitcode |= objects.dump(dumpCommand + '--no-data --no-create-info '
+                                     + '--skip-routines --skip-events ' + site.dbName + ' '
+                                     + ' '.join(shlex.quote(t) for t in triggerTables))
+        for thread in threads:
+            thread.join()
+    finally:
+        os.remove(defaults_file)
+    dumped: dict[str, dict[str, SqlSpool]] = {}
+    for table, spool in structures.items():
+        dumped.setdefault(table, {})[table_file(table)] = spool
+    for worker in workers:
+        for spool in worker.spools.values():
+            spool.finish()
+        for t in worker.tables:
+            if table_file(t.name) in worker.spools:
+                dumped.setdefault(t.name, {})[table_file(t.name)] = worker.spools[table_file(t.name)]
+        for c in worker.chunks:
+            if c.file in worker.spools:
+                dumped.setdefault(c.table, {})[c.file] = worker.spools[c.file]
+    for table, entry in chunk_map(chunks).items():
+        chunkMap[table] = entry
+    spools = reused + [(m, s) for members in dumped.values() for m, s in members.items()]
+    spools.append((site.siteName + '.sql', objects))
+    if chunkMap:
+        mapSpool = SqlSpool(spoolDir)
+        mapSpool.write(json.dumps({'tables': chunkMap}, indent=1).encode('utf-8'))
+        mapSpool.finish()
+        spools.append((CHUNK_MAP, mapSpool))
+    if exitcode != 0 or any(w.exitcode != 0 for w in workers):
+        for _, spool in spools:
+            spool.close()
+        u.abort('ERROR in parallel SQL dump of', site.dbName)
+    if cache is not None:
+        for table, members in dumped.items():
+            cache.save(table, states.get(table, ''), members, chunkMap.get(table))
+        cache.write([t.name for t in allTables])
+    print('Streamed SQL dump:    ', sum(s.size for _, s in spools), 'bytes in',
+          len(spools), 'files')
+    return spools
+
+def chunk_map(chunks: list[Chunk]) -> dict[str, dict[str, Any]]:
+    """Entries of CHUNK_MAP: the key ranges of the chunk files by table."""
+    tables: dict[str, dict[str, Any]] = {}
+    for c in chunks:
+        entry = tables.setdefault(c.table, {'key': c.key, 'structure': table_file(c.table),
+                                            'chunks': []})
+        entry['chunks'].append({'file': c.file, 'low': c.low, 'high': c.high})
+    return tables
+
+def read_chunk_files(databaseDir: str) -> set[str]:
+    """Paths of the chunk files listed in the chunk map of an extracted dump."""
+    path = databaseDir + '/' + CHUNK_MAP
+    if not os.path.isfile(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        tables = json.load(f)['tables']
+    return {databaseDir + '/' + c['file'] for t in tables.values() for c in t['chunks']}
+
+def run_restore(command: str) -> int:
+    return subprocess.run(command, shell=True).returncode
+
+def restore_tables(params: Parameters, site: WebSiteData, credential: str,
+                   databaseDir: str, tableFiles: list[str]):
+    """
+    Restore the table files of a parallel dump with sqldumpjobs connections.
+    The chunks of split tables are loaded after all table structures.
+    """
+    jobs = max(1, int(params.get('sqldumpjobs')))
+    chunkFiles = read_chunk_files(databaseDir)
+    phases = [[f for f in tableFiles if f not in chunkFiles],
+              [f for f in tableFiles if f in chunkFiles]]
+    for files in phases:
+        files = sorted(files, key=os.path.getsize, reverse=True)
+        commands = [params.get('sql') + credential + ' -h ' + site.host + ' '
+                    + site.dbName + ' < ' + shlex.quote(f) for f in files]
+        for command in commands:
+            u.RUNNER.show(command)
+        if 'simulate' in u.RUNNER.options:
+            continue
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            exitcodes = list(pool.map(run_restore, commands))
+        failed = [f for f, e in zip(files, exitcodes) if e != 0]
+        if failed:
+            u.abort('restoring', str(len(failed)), 'table files failed, e.g.', failed[0])
@@ -0,0 +1,111 @@
+import os, threading, time
+import wm.utils as u
+from wm.config import Parameters
+
+# Pressure stall information of Linux (4.20+): the percentage of time in
+# which some tasks waited for I/O or CPU, averaged over the last 10 seconds.
+PSI_FILES = {'io': '/proc/pressure/io', 'cpu': '/proc/pressure/cpu'}
+# Seconds between two checks of the pressure and of a pause.
+CHECK_INTERVAL = 1.0
+PAUSE_STEP = 1.0
+
+def read_pressure(path: str) -> float:
+    """The some avg10 value of a PSI file, 0 if it cannot be read."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == 'some':
+                    for field in fields[1:]:
+                        key, _, value = field.partition('=')
+                        if key == 'avg10':
+                            return float(value)
+    except (OSError, ValueError):
+        pass
+    return 0.0
+
+def load_per_cpu() -> float:
+    if not hasattr(os, 'getloadavg'):
+        return 0.0
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+class Throttle:
+    """
+    Adaptive throttle of the backup work. Archive compression, dump reads,
+    chunk store writes and uploads call wait() regularly. While the server
+    is under pressure, i.e. the PSI of I/O or CPU or the load per CPU
+    exceeds its limit, wait() pauses the calling thread. A single pause
+    lasts at most maxPause seconds, such that a backup always progresses.
+    A limit of 0 disables its check.
+    """
+    def __init__(self, pressure: float = 0.0, load: float = 0.0, maxPause: float = 60.0):
+        self.pressure = pressure
+        self.load = load
+        self.maxPause = maxPause
+        self.lock = threading.Lock()
+        self.lastCheck = 0.0
+        self.reason = ''
+        self.pausedSeconds = 0.0
+
+    def enabled(self) -> bool:
+        return self.pressure > 0 or self.load > 0
+
+    def check(self) -> str:
+        """Returns why the server is under pressure or ''."""
+        if self.pressure > 0:
+            for kind, path in PSI_FILES.items():
+                value = read_pressure(path)
+                if value > self.pressure:
+                    return kind + ' pressure ' + str(value) + '%'
+        if self.load > 0:
+            load = load_per_cpu()
+            if load > self.load:
+                return 'load ' + f'{load:.2f}' + ' per CPU'
+        return ''
+
+    def busy(self) -> str:
+        """Like check(), but the result is reused for CHECK_INTERVAL seconds."""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.lastCheck >= CHECK_INTERVAL:
+                self.lastCheck = now
+                self.reason = self.check()
+            return self.reason
+
+    def wait(self):
+        if not self.enabled() or self.busy() == '':
+            return
+        start = time.monotonic()
+        while self.busy() != '' and time.monotonic() - start < self.maxPause:
+            time.sleep(PAUSE_STEP)
+        with self.lock:
+            self.pausedSeconds += time.monotonic() - start
+
+    def show_paused(self, pausedBefore: float) -> float:
+        """Show and return the seconds paused since pausedSeconds was pausedBefore."""
+        paused = round(self.pausedSeconds - pausedBefore, 1)
+        if paused > 0:
+            print('Throttled:            ', paused, 'sec')
+        return paused
+
+# Throttle of this process, see configure_throttle().
+THROTTLE = Throttle()
+
+def configure_throttle(params: Parameters):
+    THROTTLE.pressure = float(params.get('throttlepressure'))
+    THROTTLE.load = float(params.get('throttleload'))
+    THROTTLE.maxPause = float(params.get('throttlemaxpause'))
+
+def set_priority(params: Parameters):
+    """
+    Lower the CPU and I/O priority of this process for backups. The
+    commands run, e.g. mysqldump and scp, inherit the priority.
+    """
+    niceness = int(params.get('nice'))
+    if niceness > 0 and hasattr(os, 'nice'):
+        os.nice(niceness)
+        print('CPU priority:          nice', niceness)
+    ionice = params.get('ionice')
+    if ionice != 'none':
+        u.RUNNER.do(ionice + ' -p ' + str(os.getpid()))
+        print('I/O priority:         ', ionice)
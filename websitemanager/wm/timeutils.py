@@ -1,5 +1,5 @@
 
-import datetime, os, textwrap
+import datetime, os, re, textwrap
 from wm.utils import WRAP_LENGTH
 
 def get_weekday() -> str:
@@ -43,7 +43,8 @@ def print_timestamps(archives : list[str], sitename : str, msg : str):
     line: list[str] = []
     for a in archives:
         a = a.replace(sitename +'.', '')
-        a = a.replace('.tar.gz', '')
+        a = re.sub(r'(\.tar(\.gz|\.zst|\.xz)?|\.json)(?=\)|$)', '', a)
+        a = re.sub(r'[^()]*/', '', a)
         line.append(a)
     line.sort()
     print(msg + '\n', textwrap.fill('   '.join(line), WRAP_LENGTH), '\n')
@@ -52,16 +53,18 @@ class TimerElapsed:
   def __init__(self):
     self.starttime = datetime.datetime.now()
     self.interimtime = self.starttime
-  def show_elapsed(self, comment: str):
+  def show_elapsed(self, comment: str) -> float:
     now = datetime.datetime.now()
     # diff: timedelta Object
     diff = now - self.interimtime
     self.interimtime = now
     print('=> ' + comment + ' = ' + str(diff.total_seconds()) + ' sec')
-  def show_total_elapsed(self, comment: str):
+    return diff.total_seconds()
+  def show_total_elapsed(self, comment: str) -> float:
     #self.newtime = datetime.datetime.now()
     now = datetime.datetime.now()
     # diff: timedelta Object
     diff = now - self.starttime
     self.starttime = now
     print('=> ' + comment + ' = ' + str(diff.total_seconds()) + ' sec')
+    return diff.total_seconds()
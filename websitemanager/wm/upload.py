@@ -0,0 +1,175 @@
+import datetime, os, queue, subprocess, threading, time
+from dataclasses import dataclass
+import wm.utils as u
+from wm.config import Parameters
+from wm.archive import archive_tag
+from wm.sftp import SftpSession
+from wm.catalog import Catalog
+from wm.metrics import new_metrics, write_metrics
+from wm.throttle import THROTTLE
+from wm.journal import Journal
+
+# Seconds to wait before the first retry of a failed upload, doubled
+# for each further retry.
+RETRY_DELAY = 10
+
+@dataclass
+class Upload:
+    archive: str                 # file name of the archive
+    backupDir: str
+    remoteLocation: str
+    siteName: str = ''
+    status: str = 'pending'      # done or failed
+    attempts: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+
+class UploadQueue:
+    """
+    Upload archives to the remote location in background threads, so the
+    backup of the next site starts while the previous archives are still
+    being uploaded. The queue is bounded: if maxPending archives wait for
+    their upload, put() blocks and thus limits the disk space used by
+    archives which are not yet uploaded. Failed uploads are retried.
+    With uploader 'sftp' each thread keeps one SFTP session for all its
+    uploads instead of starting scp for each archive. The messages of the
+    threads are collected and printed by show_messages() between the
+    output of the backups.
+    """
+    def __init__(self, scp: str, workers: int = 1, maxPending: int = 4, retries: int = 2,
+                 uploader: str = 'scp', logdir: str = 'none'):
+        if uploader not in ('scp', 'sftp'):
+            u.abort('unknown uploader "' + uploader + '", use scp or sftp')
+        self.scp = scp
+        self.uploader = uploader
+        self.retries = retries
+        self.logdir = logdir         # metrics and catalog, 'none': not recorded
+        self.queue: queue.Queue[Upload | None] = queue.Queue(maxsize=max(1, maxPending))
+        self.uploads: list[Upload] = []
+        self.lock = threading.Lock()
+        self.messages: list[str] = []
+        self.journal: Journal | None = None     # records when the uploads of a site are done
+        self.threads = [threading.Thread(target=self.work, daemon=True)
+                        for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, archives: list[str], backupDir: str, remoteLocation: str, siteName: str = ''):
+        """Queue archives of backupDir for upload, blocks if the queue is full."""
+        uploads = [Upload(archive, backupDir, remoteLocation, siteName) for archive in archives]
+        with self.lock:
+            self.uploads += uploads
+        for upload in uploads:
+            self.queue.put(upload)
+
+    def log(self, *msg: object):
+        with self.lock:
+            self.messages.append(' '.join(str(m) for m in msg))
+
+    def show_messages(self):
+        """Print the messages of the upload threads since the last call."""
+        with self.lock:
+            messages, self.messages = self.messages, []
+        for message in messages:
+            print(message, flush=True)
+
+    def work(self):
+        session: SftpSession | None = None
+        while True:
+            upload = self.queue.get()
+            if upload is None:
+                break
+            if self.uploader == 'sftp' and session is None:
+                session = SftpSession(upload.remoteLocation, self.log)
+            self.run(upload, session)
+        if session is not None:
+            session.close()
+
+    def run(self, upload: Upload, session: SftpSession | None = None):
+        path = upload.backupDir + '/' + upload.archive
+        scpCommand = (self.scp + ' -p ' + path + ' '
+                      + upload.remoteLocation + '/' + upload.archive)
+        start = datetime.datetime.now()
+        while upload.attempts <= self.retries:
+            if upload.attempts > 0:
+                delay = RETRY_DELAY * 2 ** (upload.attempts - 1)
+                self.log('Upload retry in', delay, 'sec:', upload.archive)
+                time.sleep(delay)
+            upload.attempts += 1
+            THROTTLE.wait()    # scp itself runs at full speed once started
+            if session is not None:
+                try:
+                    session.upload(path, upload.archive)
+                    upload.status = 'done'
+                    break
+                except Exception as e:
+                    self.log('Upload failed:', upload.archive, '-', str(e))
+                continue
+            if 'verbose' in u.RUNNER.options:
+                self.log(scpCommand)
+            if 'simulate' in u.RUNNER.options:
+                upload.status = 'done'
+                break
+            # the output of scp would interleave with the backups as well
+            output = subprocess.run(scpCommand, shell=True, capture_output=True)
+            if output.returncode == 0:
+                upload.status = 'done'
+                break
+            self.log('Upload failed with exit code', output.returncode, ':', upload.archive, '-',
+                     output.stderr.decode('utf-8', 'replace').strip())
+        if upload.status != 'done':
+            upload.status = 'failed'
+        upload.seconds = (datetime.datetime.now() - start).total_seconds()
+        if os.path.isfile(path):
+            upload.bytes = os.path.getsize(path)
+        self.log('Upload', upload.status + ':', upload.archive, f'({upload.seconds:.1f} sec)')
+        if self.journal is not None and upload.status == 'done':
+            with self.lock:
+                siteDone = all(up.status == 'done' for up in self.uploads
+                               if up.siteName == upload.siteName)
+            if siteDone:
+                self.journal.record(upload.siteName, 'done')
+        if self.logdir != 'none' and upload.status == 'done':
+            Catalog(self.logdir).add_remote(upload.remoteLocation, path)
+            metrics = new_metrics('upload', upload.siteName,
+                                  archive_tag(upload.siteName, upload.archive))
+            metrics.uploadSeconds = upload.seconds
+            metrics.uploadBytes = upload.bytes
+            write_metrics(self.logdir, metrics)
+
+    def wait(self) -> bool:
+        """Wait for all uploads, stop the threads. Returns True if all succeeded."""
+        self.show_messages()
+        if self.uploads:
+            u.print_line()
+            print('Waiting for', sum(1 for up in self.uploads if up.status == 'pending'),
+                  'pending uploads...', flush=True)
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.show_messages()
+        return all(up.status == 'done' for up in self.uploads)
+
+    def show_summary(self):
+        if not self.uploads:
+            return
+        u.print_line()
+        print('Upload summary:')
+        width = max([len(up.archive) for up in self.uploads] + [len('archive')])
+        print('archive'.ljust(width), ' status   ', 'tries', '    seconds', '     MByte/s')
+        for up in self.uploads:
+            rate = up.bytes / 1e6 / up.seconds if up.seconds > 0 else 0.0
+            print(up.archive.ljust(width), '', up.status.ljust(8), f'{up.attempts:5}',
+                  f'{up.seconds:11.1f}', f'{rate:12.1f}')
+        numFailed = sum(1 for up in self.uploads if up.status != 'done')
+        print('Uploaded:', len(self.uploads) - numFailed, ' failed:', numFailed)
+        u.print_line()
+
+def open_upload_queue(params: Parameters) -> UploadQueue:
+    if params.get('uploader') == 'sftp' and params.get('remotelocation') != 'none':
+        # check paramiko and the location before the threads need them
+        SftpSession(params.get('remotelocation'))
+    return UploadQueue(params.get('scp'), int(params.get('uploadjobs')),
+                       int(params.get('uploadqueue')), int(params.get('uploadretries')),
+                       params.get('uploader'), params.get('logdir'))
@@ -19,11 +19,13 @@ RUNNER_OPTIONS: list[str] = []                        # for production
 class OsCommandRunner:
     def __init__(self, options: list[str] = []):
       self.options = options
-    def do(self, cmd: str):
+    def show(self, cmd: str):
         if 'verbose' in self.options:
             print_line('-')
             print(textwrap.fill(cmd, WRAP_LENGTH))
             print_line('-')
+    def do(self, cmd: str):
+        self.show(cmd)
         if 'simulate' not in self.options:
             exitcode = os.system(cmd)
             if (exitcode != 0):
@@ -35,6 +37,7 @@ RUNNER = OsCommandRunner(RUNNER_OPTIONS)
 class Operation(Enum):
     UNKNOWN = 0
     BATCH_SAVEALL = -1
+    INSPECT = -2
     SAVEALL = 1
     SNAPSHOT = 2
     REPLACE_AFTER_SNAPSHOT = 3
@@ -15,6 +15,7 @@ class WebSiteData:
     dbUser : str = "none"
     dbPassWord : str = "none"
     comment : str = "none"
+    exclude : str = "none"      # optional column, see wm.exclusions
 
     @classmethod
     def field_names(cls) -> list[str]:
@@ -33,6 +34,9 @@ class WebSiteData:
         print("--------------------------------------")
 
 
+# Columns which may be omitted in the table, the default value is used then.
+OPTIONAL_COLUMNS = ['exclude']
+
 class WebSiteTable:
     def __init__(self, tablePath: str):
         print('Reading:', tablePath)
@@ -55,20 +59,21 @@ class WebSiteTable:
                         self.numWebsites += 1
                         if self.numWebsites >= 1:
                             # set new website data
-                            if len(line) < len(self.columns):
+                            if len(line) < len(self.header):
                                 abort("too few columns in line:", str(line))
                             self.table.append(line)
                             self.site2index[line[0]] = self.numWebsites - 1
                         else:
                             # set header line
                             self.header = line
+                            self.widths = [len(h) for h in self.header]
                             self.checkheader()
                             self.col2index = {c: i for i, c in enumerate(self.header)}
         except FileNotFoundError:
             abort(f"FEHLER: Die Datei '{tablePath}' wurde nicht gefunden.")
         if self.numWebsites < 1:
             abort("no website data in table:", tablePath)
-        for j in range(len(self.columns)):
+        for j in range(len(self.header)):
             for i in range(self.numWebsites):
                 self.widths[j] = max(self.widths[j], len(self.table[i][j]))
         self.checkSites()
@@ -81,7 +86,7 @@ class WebSiteTable:
         colSet = set(self.columns)
         headerSet = set(self.header)
         if colSet != headerSet:
-            missing = colSet - headerSet
+            missing = colSet - headerSet - set(OPTIONAL_COLUMNS)
             extra = headerSet - colSet
             if missing:
                 abort("missing headers in table:", str(missing))
@@ -158,7 +163,7 @@ class WebSiteTable:
         skippedColIndices = [self.col2index[c] for c in skippedCols]
         for i in range(self.numWebsites):
             line = f"{i:2d}  "
-            for j in range(len(self.columns)):
+            for j in range(len(self.header)):
                 if j not in skippedColIndices:
                     value = self.table[i][j]
                     line += value.ljust(self.widths[j]) + "  "
@@ -172,6 +177,7 @@ class WebSiteTable:
     def getSite(self, siteName: str) -> WebSiteData:
         return self.getData(self.site2index[siteName])
     def getData(self, row: int) -> WebSiteData:
-        data = {col: self.table[row][self.col2index[col]] for col in self.columns}
+        data = {col: self.table[row][self.col2index[col]] for col in self.columns
+                if col in self.col2index}
         # ** means: take each key-value pair as a named parameter.
         return WebSiteData(**data)